@@ -0,0 +1,186 @@
+"""Append-only chat history and the context sent with each request.
+
+The history used to be one JSON blob per user in ``chat_history``, re-read
+and rewritten on every turn, and the whole conversation was sent to the API
+each time. Now:
+
+- every message is one row of ``chat_messages``, only ever appended;
+- a request carries the system prompt, the rolling summary of the older
+  conversation (``chat_summaries``) and the newest messages that fit
+  ``CHAT_CONTEXT_TOKEN_BUDGET`` (``assemble_context``);
+- once ``CHAT_SUMMARY_MIN_MESSAGES`` messages have dropped out of the last
+  ``CHAT_WINDOW_MESSAGES``, a background task folds them into the summary.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from AIModels.openai_client import openai_gateway
+from config import (
+    CHAT_CONTEXT_TOKEN_BUDGET,
+    CHAT_SUMMARY_MIN_MESSAGES,
+    CHAT_SUMMARY_MODEL,
+    CHAT_WINDOW_MESSAGES,
+)
+from utils import async_database, database
+
+logger = logging.getLogger(__name__)
+
+# Rough size of a token for budgeting (Arabic and English text alike)
+CHARS_PER_TOKEN = 3
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a conversation between a student and "
+    "an assistant in a Telegram study bot. Update the summary with the new "
+    "messages. Keep facts about the student (level, goals, weak topics, "
+    "preferences) and open questions; drop small talk. Answer with the "
+    "summary only, in the language of the conversation, under 200 words."
+)
+
+_refreshing = set()  # user ids whose summary is being refreshed
+_tasks = set()  # running refresh tasks (the loop only keeps weak references)
+
+
+def estimate_tokens(message: Dict[str, str]) -> int:
+    return len(message.get("content") or "") // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def append_messages(user_id: int, messages: List[Dict[str, str]]):
+    """Appends a turn's messages to the user's history (blocking)."""
+    now = datetime.now().isoformat(sep=" ", timespec="seconds")
+    with database.connection_manager.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO chat_messages (user_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+            [(user_id, m["role"], m["content"], now) for m in messages],
+        )
+
+
+def recent_messages(user_id: int, limit: int = CHAT_WINDOW_MESSAGES) -> List[Dict[str, str]]:
+    """Returns the user's last ``limit`` messages, oldest first (blocking)."""
+    rows = database.get_data(
+        "SELECT role, content FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (user_id, limit),
+    )
+    return [{"role": role, "content": content} for role, content in reversed(rows)]
+
+
+def get_summary(user_id: int) -> Optional[str]:
+    rows = database.get_data(
+        "SELECT summary FROM chat_summaries WHERE user_id = ?", (user_id,)
+    )
+    return rows[0][0] if rows else None
+
+
+def clear_history(user_id: int):
+    with database.connection_manager.transaction() as conn:
+        conn.execute("DELETE FROM chat_messages WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM chat_summaries WHERE user_id = ?", (user_id,))
+        conn.execute("DELETE FROM chat_history WHERE user_id = ?", (user_id,))
+
+
+def assemble_context(
+    system_message: str,
+    summary: Optional[str],
+    window: List[Dict[str, str]],
+    budget: int = CHAT_CONTEXT_TOKEN_BUDGET,
+) -> List[Dict[str, str]]:
+    """Builds the request messages: system prompt, summary and newest turns.
+
+    The newest message is always kept; older ones are dropped once the
+    budget is spent.
+    """
+    head = []
+    if system_message:
+        head.append({"role": "system", "content": system_message})
+    if summary:
+        head.append(
+            {"role": "system", "content": f"ملخص المحادثة السابقة مع المستخدم:\n{summary}"}
+        )
+    remaining = budget - sum(estimate_tokens(m) for m in head)
+
+    tail = []
+    for message in reversed([m for m in window if m["role"] != "system"]):
+        cost = estimate_tokens(message)
+        if tail and cost > remaining:
+            break
+        tail.append(message)
+        remaining -= cost
+    return head + tail[::-1]
+
+
+def _messages_to_summarize(user_id: int):
+    """Returns the summary and the messages that left the window since it was written."""
+    with database.connection_manager.transaction() as conn:
+        row = conn.execute(
+            "SELECT summary, last_message_id FROM chat_summaries WHERE user_id = ?",
+            (user_id,),
+        ).fetchone()
+        summary, last_message_id = row if row else (None, 0)
+        rows = conn.execute(
+            """
+            SELECT id, role, content FROM chat_messages
+            WHERE user_id = ? AND id > ? AND id < (
+                SELECT MIN(id) FROM (
+                    SELECT id FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?
+                )
+            )
+            ORDER BY id
+            """,
+            (user_id, last_message_id, user_id, CHAT_WINDOW_MESSAGES),
+        ).fetchall()
+    return summary, rows
+
+
+def _store_summary(user_id: int, summary: str, last_message_id: int):
+    now = datetime.now().isoformat(sep=" ", timespec="seconds")
+    with database.connection_manager.transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO chat_summaries (user_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                summary = excluded.summary,
+                last_message_id = excluded.last_message_id,
+                updated_at = excluded.updated_at
+            """,
+            (user_id, summary, last_message_id, now),
+        )
+
+
+async def _refresh_summary(user_id: int, summary: Optional[str], rows):
+    try:
+        transcript = "\n".join(f"{role}: {content}" for _, role, content in rows)
+        completion = await openai_gateway.chat_completion(
+            "summary",
+            model=CHAT_SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {
+                    "role": "user",
+                    "content": f"Current summary:\n{summary or '-'}\n\nNew messages:\n{transcript}",
+                },
+            ],
+        )
+        new_summary = completion.choices[0].message.content
+        if new_summary:
+            await async_database.run(_store_summary, user_id, new_summary, rows[-1][0])
+    except Exception as e:
+        logger.error(f"Error refreshing the chat summary of user {user_id}: {e}")
+    finally:
+        _refreshing.discard(user_id)
+
+
+async def refresh_summary_if_needed(user_id: int):
+    """Starts a background summary refresh once enough messages left the window."""
+    if user_id in _refreshing:
+        return
+    summary, rows = await async_database.run(_messages_to_summarize, user_id)
+    if len(rows) < CHAT_SUMMARY_MIN_MESSAGES or user_id in _refreshing:
+        return
+    _refreshing.add(user_id)
+    task = asyncio.create_task(_refresh_summary(user_id, summary, rows))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
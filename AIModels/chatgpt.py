@@ -1,26 +1,103 @@
-import asyncio
 from datetime import datetime
-import json
+import logging
 import os
+import time
 from typing import List, Dict, Optional
 from telegram import Update
+from telegram.error import BadRequest
 from telegram.ext import CallbackContext, ConversationHandler
-from openai import OpenAI
+from AIModels import chat_memory
+from AIModels.openai_client import openai_gateway
+from AIModels.response_cache import response_cache
 from AIModels.tts import generate_tts
-from config import OPENAI_API_KEY
-from utils.database import execute_query, get_data
+from config import (
+    CHAT_WINDOW_MESSAGES,
+    OPENAI_STREAM_RESPONSES,
+    STREAM_EDIT_INTERVAL_SECONDS,
+    STREAM_EDIT_MIN_CHARS,
+)
+from utils import async_database
+from utils.usage_quota import chatgpt_quota
 from utils.user_management import get_user_setting
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+logger = logging.getLogger(__name__)
 
 # Constants for subscription tiers (Example - adapt as needed)
 FREE_TIER_LIMIT = 10
 PAID_TIER_LIMIT = 20
 
+TELEGRAM_MESSAGE_LIMIT = 4096
+STREAMING_CURSOR = " ▌"
+EMPTY_REPLY_TEXT = "حدث خطأ أثناء معالجة طلبك. يرجى المحاولة مرة أخرى لاحقًا."
+
+
+def split_message(text: str) -> List[str]:
+    """Splits a reply into Telegram-sized parts, at a line break when there is one."""
+    parts = []
+    while len(text) > TELEGRAM_MESSAGE_LIMIT:
+        cut = text.rfind("\n", 0, TELEGRAM_MESSAGE_LIMIT)
+        if cut <= 0:
+            cut = TELEGRAM_MESSAGE_LIMIT
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        parts.append(text)
+    return parts
+
+
+async def show_reply(message, text: str):
+    """Replaces ``message`` with the reply; the parts beyond the first are sent after it."""
+    first, *rest = split_message(text)
+    try:
+        await message.edit_text(first)
+    except BadRequest as e:
+        # The last streaming preview may already show exactly this text
+        if "message is not modified" not in str(e).lower():
+            raise
+    for part in rest:
+        await message.reply_text(part)
+
+
+class StreamingMessageEditor:
+    """Shows a reply growing in a Telegram message without flooding edits.
+
+    Edits are coalesced: at most one every ``STREAM_EDIT_INTERVAL_SECONDS``
+    and only once ``STREAM_EDIT_MIN_CHARS`` new characters have arrived.
+    """
+
+    def __init__(self, message):
+        self.message = message
+        self._last_edit = 0.0
+        self._shown_length = 0
+
+    async def update(self, text: str):
+        if (
+            time.monotonic() - self._last_edit < STREAM_EDIT_INTERVAL_SECONDS
+            or len(text) - self._shown_length < STREAM_EDIT_MIN_CHARS
+        ):
+            return
+        preview = text[: TELEGRAM_MESSAGE_LIMIT - len(STREAMING_CURSOR)] + STREAMING_CURSOR
+        self._last_edit = time.monotonic()
+        self._shown_length = len(text)
+        try:
+            await self.message.edit_text(preview)
+        except Exception as e:
+            # A skipped preview (flood control, unchanged text) is harmless
+            logger.debug(f"Skipped a streaming edit: {e}")
+
+    async def finish(self, text: str):
+        """Shows the whole reply without the cursor; raises if nothing arrived."""
+        if not text.strip():
+            await self.message.edit_text(EMPTY_REPLY_TEXT)
+            raise ValueError("The streamed reply was empty")
+        await show_reply(self.message, text)
+
 
 class ChatGPT:
-    def __init__(self, model: str = "gpt-4o-mini"):
+    def __init__(self, model: str = "gpt-4o-mini", section: str = "chat"):
         self.model = model
+        # Concurrency limit group of the shared OpenAI client
+        self.section = section
 
     async def chat_with_assistant(
         self,
@@ -32,6 +109,7 @@ class ChatGPT:
         save_history: bool = True,
         use_response_mode: bool = True,
         return_as_text: bool = False,
+        cache_key: Optional[tuple] = None,
         **kwargs,  # Additional parameters for generate_response
     ) -> Optional[str]:
         """
@@ -46,6 +124,9 @@ class ChatGPT:
             save_history (bool, optional): Whether to save the chat history to the database. Default is True.
             use_response_mode (bool, optional): The desired response mode ("text" or "voice"). Default is True.
             return_as_text (bool, optional): Whether to return the response as text. Default is False.
+            cache_key (tuple, optional): Marks a request whose reply does not depend on the
+                user (see AIModels/response_cache.py); it is sent without the chat history
+                and its reply is shared. Default is None.
             **kwargs: Additional keyword arguments to pass to the OpenAI API.
 
         Returns:
@@ -58,38 +139,55 @@ class ChatGPT:
                 )
                 return ConversationHandler.END  # Or an appropriate state
 
-        messages = []
-        if context:
-            messages = context.user_data.get("messages", [])
-        if not messages and system_message:
-            messages = [{"role": "system", "content": system_message}]
-        if user_message:
-            messages.append({"role": "user", "content": user_message})
+        # The recent turns kept in the session, this turn's messages, and the
+        # request: system prompt, summary of older turns and the newest turns
+        window = context.user_data.get("messages", []) if context else []
+        turn = [{"role": "user", "content": user_message}] if user_message else []
+        if cache_key is not None:
+            cache_key = (*cache_key, self.model)
+            messages = chat_memory.assemble_context(system_message, None, turn)
+        else:
+            summary = await async_database.run(chat_memory.get_summary, user_id)
+            messages = chat_memory.assemble_context(system_message, summary, window + turn)
+        cached_response = response_cache.get(cache_key) if cache_key else None
 
         try:
             message = None
             if not return_as_text:
                 message = await update.message.reply_text("جارٍ التفكير في رد... 🤔")
 
-            assistant_response = await self.generate_response(messages, **kwargs)
-
             if return_as_text:
+                if cached_response:
+                    return cached_response
+                assistant_response = await self.generate_response(messages, **kwargs)
+                if cache_key:
+                    response_cache.put(cache_key, assistant_response)
                 return assistant_response
 
-            messages.append({"role": "assistant", "content": assistant_response})
-
-            if save_history:
-                await self.save_chat_history(user_id, messages)
-            context.user_data["messages"] = messages
-
             if use_response_mode:
                 response_mode = await get_user_setting(user_id, "voice_written")
             else:
                 response_mode = "written"
 
+            # Written replies appear while they are generated; voice needs the full text
+            stream_reply = (
+                OPENAI_STREAM_RESPONSES and response_mode != "voice" and not cached_response
+            )
+            if cached_response:
+                assistant_response = cached_response
+            elif stream_reply:
+                assistant_response = await self.stream_response(messages, message, **kwargs)
+            else:
+                assistant_response = await self.generate_response(messages, **kwargs)
+            if cache_key and not cached_response:
+                response_cache.put(cache_key, assistant_response)
+
+            turn.append({"role": "assistant", "content": assistant_response})
+            await self.remember_turn(user_id, context, turn, save_history)
+
             if response_mode == "voice":
                 await _voice_response_processor(assistant_response, message)
-            else:
+            elif not stream_reply:
                 await _written_response_processor(assistant_response, message)
 
             await self.increment_usage(
@@ -99,12 +197,14 @@ class ChatGPT:
             return True
         except Exception as e:
             print(f"Error calling OpenAI API: {e}")
+            if not return_as_text:
+                await self.release_usage(user_id)
             return None
 
     async def generate_response(self, messages, **kwargs) -> str:
         try:
-            completion = await asyncio.to_thread(
-                client.chat.completions.create,
+            completion = await openai_gateway.chat_completion(
+                self.section,
                 model=self.model,
                 messages=messages,
                 **kwargs,
@@ -115,50 +215,36 @@ class ChatGPT:
             print(f"Error calling generate_response: {e}")
             return None
 
-    async def check_usage_limit(self, user_id: int) -> bool:
-        """Checks if the user has reached their daily ChatGPT usage limit."""
-        today = datetime.now().date()
-        usage_data = get_data(
-            "SELECT usage_count, last_used FROM chatgpt_usage WHERE user_id = ?",
-            (user_id,),
-        )
+    async def stream_response(self, messages, message, **kwargs) -> str:
+        """Streams the reply into ``message``, editing it as the text arrives."""
+        editor = StreamingMessageEditor(message)
+        assistant_response = ""
+        async for delta in openai_gateway.stream_chat_completion(
+            self.section, model=self.model, messages=messages, **kwargs
+        ):
+            assistant_response += delta
+            await editor.update(assistant_response)
+        await editor.finish(assistant_response)
+        return assistant_response
 
-        if usage_data:
-            usage_count, last_used_str = usage_data[0]
-            last_used = datetime.strptime(last_used_str, "%Y-%m-%d").date()
-            if last_used == today:
-                # limit = (
-                #     PAID_TIER_LIMIT
-                #     if await self.is_subscribed(user_id)
-                #     else FREE_TIER_LIMIT
-                # )  # Check subscription status
-                limit = FREE_TIER_LIMIT
-                return usage_count < limit
-            else:  # Reset count if it's a new day
-                await self.reset_daily_usage(user_id)
-                return True  # Allow usage as it's reset
-        else:  # No usage data yet, create new entry and allow
-            execute_query(
-                "INSERT INTO chatgpt_usage (user_id, usage_count, last_used) VALUES (?, ?, ?)",
-                (user_id, 0, today.strftime("%Y-%m-%d")),
-            )
-            return True
+    async def check_usage_limit(self, user_id: int) -> bool:
+        """Reserves one of the user's daily ChatGPT messages; False once none is left."""
+        # limit = (
+        #     PAID_TIER_LIMIT
+        #     if await self.is_subscribed(user_id)
+        #     else FREE_TIER_LIMIT
+        # )  # Check subscription status
+        limit = FREE_TIER_LIMIT
+        allowed, _ = await chatgpt_quota.reserve(user_id, limit)
+        return allowed
 
     async def increment_usage(self, user_id: int):
-        """Increments the user's ChatGPT usage count."""
-        today = datetime.now().date()
-        execute_query(
-            "UPDATE chatgpt_usage SET usage_count = usage_count + 1, last_used = ? WHERE user_id = ?",
-            (today.strftime("%Y-%m-%d"), user_id),
-        )
+        """Counts the reserved message as used (written to chatgpt_usage in the background)."""
+        await chatgpt_quota.commit(user_id)
 
-    async def reset_daily_usage(self, user_id: int):
-        """Resets the user's daily usage count."""
-        today = datetime.now().date()
-        execute_query(
-            "UPDATE chatgpt_usage SET usage_count = 0, last_used = ? WHERE user_id = ?",
-            (today.strftime("%Y-%m-%d"), user_id),
-        )
+    async def release_usage(self, user_id: int):
+        """Gives back the reserved message when no reply was sent."""
+        await chatgpt_quota.release(user_id)
 
     async def is_subscribed(self, user_id: int) -> bool:
         """Checks if the user has an active subscription."""
@@ -173,53 +259,43 @@ class ChatGPT:
         return False
 
     @staticmethod
-    async def get_chat_history(
+    async def remember_turn(
         user_id: int,
-    ) -> List[Dict[str, str]]:  # Make this asynchronous
-        result = await asyncio.to_thread(
-            get_data,  # Run database query in a separate thread
-            "SELECT messages FROM chat_history WHERE user_id = ?",
-            (user_id,),
-        )
-        return json.loads(result[0][0]) if result else []
+        context: CallbackContext,
+        turn: List[Dict[str, str]],
+        save_history: bool = True,
+    ) -> None:
+        """Adds a turn to the session's window (and the stored history)."""
+        if save_history:
+            await ChatGPT.save_chat_history(user_id, turn)
+        window = context.user_data.get("messages", [])
+        context.user_data["messages"] = (window + turn)[-CHAT_WINDOW_MESSAGES:]
 
     @staticmethod
-    async def save_chat_history(
-        user_id: int, messages: List[Dict[str, str]]
-    ) -> None:  # Make this asynchronous
-        existing_history = await ChatGPT.get_chat_history(user_id)
-        if existing_history:
-            # Update existing chat history
-            await asyncio.to_thread(
-                execute_query,  # Run database query in a separate thread
-                "UPDATE chat_history SET messages = ? WHERE user_id = ?",
-                (json.dumps(messages), user_id),
-            )
-        else:
-            # Insert new chat history if it doesn't exist
-            await asyncio.to_thread(
-                execute_query,  # Run database query in a separate thread
-                "INSERT INTO chat_history (user_id, messages) VALUES (?, ?)",
-                (user_id, json.dumps(messages)),
-            )
+    async def get_chat_history(user_id: int) -> List[Dict[str, str]]:
+        """Returns the user's most recent messages (the context window)."""
+        return await async_database.run(chat_memory.recent_messages, user_id)
 
     @staticmethod
-    async def clear_user_history(user_id: int) -> None:  # Make this asynchronous
+    async def save_chat_history(user_id: int, messages: List[Dict[str, str]]) -> None:
+        """Appends a turn's new messages to the user's history."""
+        await async_database.run(chat_memory.append_messages, user_id, messages)
+        # Fold the turns that left the window into the summary, in the background
+        await chat_memory.refresh_summary_if_needed(user_id)
+
+    @staticmethod
+    async def clear_user_history(user_id: int) -> None:
         """Clears the chat history for a specific user."""
-        await asyncio.to_thread(
-            execute_query,  # Run database query in a separate thread
-            "DELETE FROM chat_history WHERE user_id = ?",
-            (user_id,),
-        )
+        await async_database.run(chat_memory.clear_history, user_id)
 
 
-def get_chatgpt_instance(model: Optional[str] = None) -> ChatGPT:
-    return ChatGPT(model) if model else ChatGPT()
+def get_chatgpt_instance(model: Optional[str] = None, section: str = "chat") -> ChatGPT:
+    return ChatGPT(model, section) if model else ChatGPT(section=section)
 
 
 async def _written_response_processor(response: str, message: Update):
     """Sends the response as a text message."""
-    await message.edit_text(response)
+    await show_reply(message, response)
 
 
 async def _voice_response_processor(response: str, message: Update):
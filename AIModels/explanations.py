@@ -0,0 +1,266 @@
+"""Pre-generated AI explanations for every question and answer option.
+
+Explaining a question's answer is the same work for every student who gets
+it, so instead of asking the model while the student waits,
+``python -m AIModels.explanations [limit]`` walks the ``questions`` table once
+and stores a student-friendly explanation per option in ``ai_explanations``:
+for the correct option why it is right, for each wrong option why it is
+wrong and what the right answer is.
+
+- Requests run with at most ``AI_EXPLANATIONS_CONCURRENCY`` in flight.
+- Every explanation is stored as soon as it arrives, so an interrupted run
+  resumes where it stopped; explanations are only regenerated when the
+  question changes (``source_hash``) or ``EXPLANATION_PROMPT_VERSION`` is
+  bumped.
+- Token usage is stored per row and summed per run; the run stops starting
+  new requests once ``AI_EXPLANATIONS_MAX_COST_USD`` is spent.
+
+``get_explanation`` serves them to the tests' AI assistance and to
+conversation learning; only free-form follow-ups reach the model. Point
+``OPENAI_BASE_URL`` at ``AIModels/fake_openai_server.py`` (with a dummy
+``OPENAI_API_KEY``) to try a run without a real API key.
+"""
+
+import asyncio
+import hashlib
+import logging
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+from AIModels.openai_client import openai_gateway
+from config import (
+    AI_EXPLANATIONS_CONCURRENCY,
+    AI_EXPLANATIONS_INPUT_COST_PER_1K,
+    AI_EXPLANATIONS_MAX_COST_USD,
+    AI_EXPLANATIONS_MODEL,
+    AI_EXPLANATIONS_OUTPUT_COST_PER_1K,
+)
+from utils import async_database, database
+from utils.question_bank import OPTION_INDEX, QUESTION_COLUMNS, Question, question_bank
+
+logger = logging.getLogger(__name__)
+
+# Bump when the prompts change so the stored explanations are regenerated
+EXPLANATION_PROMPT_VERSION = 1
+
+# Answer letters as typed or shown elsewhere -> the bank's option letters (أ/ب/ج/د)
+LATIN_OPTIONS = {"A": "أ", "B": "ب", "C": "ج", "D": "د", "ا": "أ"}
+
+SYSTEM_PROMPT = (
+    "You are a patient tutor helping Arabic-speaking students prepare for an "
+    "aptitude test. Explain in simple Arabic, in at most 120 words, without "
+    "repeating the whole question."
+)
+
+
+def option_letter(answer: str) -> Optional[str]:
+    """Returns the bank's option letter for an answer (أ/ب/ج/د or A-D), else None."""
+    answer = (answer or "").strip().upper()
+    answer = LATIN_OPTIONS.get(answer, answer)
+    return answer if answer in OPTION_INDEX else None
+
+
+def source_hash(question: Question) -> str:
+    """Digest of the fields an explanation is written from."""
+    content = "\x1f".join(
+        str(field or "")
+        for field in (
+            question.question_text,
+            question.option_a,
+            question.option_b,
+            question.option_c,
+            question.option_d,
+            question.correct_answer,
+            question.explanation,
+        )
+    )
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+def get_explanation(question_id: int, answer: str) -> Optional[str]:
+    """Returns the stored explanation for choosing ``answer`` (blocking)."""
+    option = option_letter(answer)
+    question = question_bank.get(question_id) if option else None
+    if question is None:
+        return None
+    rows = database.get_data(
+        """
+        SELECT explanation FROM ai_explanations
+        WHERE question_id = ? AND option = ? AND source_hash = ?
+        """,
+        (question.id, option, source_hash(question)),
+    )
+    return rows[0][0] if rows else None
+
+
+def build_prompt(question: Question, option: str) -> str:
+    correct = option_letter(question.correct_answer)
+    lines = [
+        f"Question: {question.question_text}",
+        *(f"{letter}: {question.option_text(letter)}" for letter in OPTION_INDEX),
+        f"Correct answer: {correct}",
+        f"Reference explanation: {question.explanation or '-'}",
+        "",
+    ]
+    if option == correct:
+        lines.append(f"Explain why option {option} is the correct answer.")
+    else:
+        lines.append(
+            f"The student chose option {option}. Explain kindly why it is wrong, "
+            f"the mistake that usually leads to it, and why option {correct} is correct."
+        )
+    return "\n".join(lines)
+
+
+class BatchReport(NamedTuple):
+    generated: int = 0
+    skipped: int = 0
+    failed: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cost_usd: float = 0.0
+    stopped_by_budget: bool = False
+
+
+def _cost(prompt_tokens: int, completion_tokens: int) -> float:
+    return (
+        prompt_tokens * AI_EXPLANATIONS_INPUT_COST_PER_1K
+        + completion_tokens * AI_EXPLANATIONS_OUTPUT_COST_PER_1K
+    ) / 1000
+
+
+def _pending_work(limit: Optional[int] = None):
+    """Returns ``[(question, option)]`` still missing an up-to-date explanation, and the skipped count."""
+    with database.connection_manager.transaction() as conn:
+        questions = [
+            Question(*row)
+            for row in conn.execute(
+                f"SELECT {QUESTION_COLUMNS} FROM questions WHERE retired = 0 ORDER BY id"
+            )
+        ]
+        done = {
+            (question_id, option): digest
+            for question_id, option, digest in conn.execute(
+                "SELECT question_id, option, source_hash FROM ai_explanations WHERE prompt_version = ?",
+                (EXPLANATION_PROMPT_VERSION,),
+            )
+        }
+
+    work, skipped = [], 0
+    for question in questions:
+        if option_letter(question.correct_answer) is None:
+            continue  # Nothing sensible to explain
+        digest = source_hash(question)
+        for option in OPTION_INDEX:
+            if done.get((question.id, option)) == digest:
+                skipped += 1
+            else:
+                work.append((question, option))
+    return (work[:limit] if limit else work), skipped
+
+
+def _store_explanation(question: Question, option: str, explanation: str, usage):
+    with database.connection_manager.transaction() as conn:
+        conn.execute(
+            """
+            INSERT INTO ai_explanations
+                (question_id, option, explanation, source_hash, prompt_version, model,
+                 prompt_tokens, completion_tokens, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(question_id, option) DO UPDATE SET
+                explanation = excluded.explanation,
+                source_hash = excluded.source_hash,
+                prompt_version = excluded.prompt_version,
+                model = excluded.model,
+                prompt_tokens = excluded.prompt_tokens,
+                completion_tokens = excluded.completion_tokens,
+                created_at = excluded.created_at
+            """,
+            (
+                question.id,
+                option,
+                explanation,
+                source_hash(question),
+                EXPLANATION_PROMPT_VERSION,
+                AI_EXPLANATIONS_MODEL,
+                usage[0],
+                usage[1],
+                datetime.now().isoformat(sep=" ", timespec="seconds"),
+            ),
+        )
+
+
+async def generate_explanations(
+    limit: Optional[int] = None,
+    concurrency: int = AI_EXPLANATIONS_CONCURRENCY,
+    max_cost_usd: float = AI_EXPLANATIONS_MAX_COST_USD,
+) -> BatchReport:
+    """Generates the missing explanations; safe to interrupt and run again."""
+    work, skipped = await async_database.run(_pending_work, limit)
+    logger.info(f"{len(work)} explanations to generate, {skipped} up to date")
+    queue = asyncio.Queue()
+    for item in work:
+        queue.put_nowait(item)
+    totals = {"generated": 0, "failed": 0, "prompt": 0, "completion": 0}
+
+    def spent():
+        return _cost(totals["prompt"], totals["completion"])
+
+    async def worker():
+        while not queue.empty() and spent() < max_cost_usd:
+            question, option = queue.get_nowait()
+            try:
+                completion = await openai_gateway.chat_completion(
+                    "explanations",
+                    model=AI_EXPLANATIONS_MODEL,
+                    messages=[
+                        {"role": "system", "content": SYSTEM_PROMPT},
+                        {"role": "user", "content": build_prompt(question, option)},
+                    ],
+                )
+                explanation = completion.choices[0].message.content
+                usage = completion.usage
+                tokens = (usage.prompt_tokens, usage.completion_tokens) if usage else (0, 0)
+                totals["prompt"] += tokens[0]
+                totals["completion"] += tokens[1]
+                if not explanation:
+                    raise ValueError("Empty explanation")
+                await async_database.run(_store_explanation, question, option, explanation, tokens)
+                totals["generated"] += 1
+            except Exception as e:
+                logger.error(f"Error explaining question {question.id} option {option}: {e}")
+                totals["failed"] += 1
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    report = BatchReport(
+        totals["generated"],
+        skipped,
+        totals["failed"],
+        totals["prompt"],
+        totals["completion"],
+        spent(),
+        not queue.empty(),
+    )
+    logger.info(
+        f"Explanations: {report.generated} generated, {report.failed} failed, "
+        f"{report.prompt_tokens}+{report.completion_tokens} tokens, ${report.cost_usd:.4f}"
+        + (" (stopped by the budget)" if report.stopped_by_budget else "")
+    )
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    from utils.migrations import run_migrations
+
+    async def main(limit):
+        await database.create_tables()
+        run_migrations()
+        try:
+            return await generate_explanations(limit)
+        finally:
+            await openai_gateway.close()
+
+    print(asyncio.run(main(int(sys.argv[1]) if sys.argv[1:] else None)))
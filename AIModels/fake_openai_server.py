@@ -0,0 +1,116 @@
+"""Local stand-in for the OpenAI chat completions API, for trying the bot offline.
+
+Run ``python -m AIModels.fake_openai_server [port]`` and start the bot (or the
+explanation batch) with ``OPENAI_BASE_URL=http://127.0.0.1:<port>/v1``. The
+key is not checked, but the client still needs one: without
+``APIs/openai.txt`` set any ``OPENAI_API_KEY``, e.g. ``OPENAI_API_KEY=fake``.
+``POST /v1/chat/completions`` answers every request, streamed or not, with a
+deterministic Arabic reply and token usage estimated from the text length.
+``FAKE_OPENAI_LATENCY_SECONDS`` delays each reply and ``FAKE_OPENAI_ERROR_RATE``
+answers that share of requests with a 503, to exercise the retries.
+"""
+
+import hashlib
+import json
+import os
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_PORT = 8765
+LATENCY_SECONDS = float(os.environ.get("FAKE_OPENAI_LATENCY_SECONDS", "0.2"))
+ERROR_RATE = float(os.environ.get("FAKE_OPENAI_ERROR_RATE", "0"))
+
+
+def _tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def fake_reply(messages) -> str:
+    """A reply that is the same for the same prompt."""
+    prompt = messages[-1]["content"] if messages else ""
+    digest = hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:8]
+    return f"هذا رد تجريبي ({digest}) على: {prompt[:80]}"
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(LATENCY_SECONDS)
+        if random.random() < ERROR_RATE:
+            self._send_json(503, {"error": {"message": "Fake overload"}})
+            return
+
+        messages = request.get("messages", [])
+        reply = fake_reply(messages)
+        usage = {
+            "prompt_tokens": sum(_tokens(m.get("content") or "") for m in messages),
+            "completion_tokens": _tokens(reply),
+        }
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        base = {
+            "id": f"chatcmpl-fake-{int(time.time() * 1000)}",
+            "created": int(time.time()),
+            "model": request.get("model", "fake"),
+        }
+        if request.get("stream"):
+            self._send_stream(base, reply)
+        else:
+            self._send_json(
+                200,
+                {
+                    **base,
+                    "object": "chat.completion",
+                    "choices": [
+                        {
+                            "index": 0,
+                            "finish_reason": "stop",
+                            "message": {"role": "assistant", "content": reply},
+                        }
+                    ],
+                    "usage": usage,
+                },
+            )
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, base, reply):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = reply.split(" ")
+        for index, word in enumerate(words):
+            delta = {"content": word if index == 0 else " " + word}
+            chunk = {
+                **base,
+                "object": "chat.completion.chunk",
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(0.02)
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def log_message(self, format, *args):
+        pass  # Keep the console quiet under load
+
+
+def serve(port: int = DEFAULT_PORT):
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeOpenAIHandler)
+    print(f"Fake OpenAI API on http://127.0.0.1:{port}/v1")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    import sys
+
+    serve(int(sys.argv[1]) if sys.argv[1:] else DEFAULT_PORT)
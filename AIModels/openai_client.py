@@ -0,0 +1,159 @@
+"""Shared asynchronous OpenAI client for every section of the bot.
+
+Each section used to call its own synchronous ``OpenAI`` client through
+``asyncio.to_thread``, so every request in flight pinned a thread of the
+default executor and hundreds of concurrent chats exhausted it. All calls now
+go through ``openai_gateway``:
+
+- one ``AsyncOpenAI`` client on a pooled keep-alive HTTP connection pool;
+- a global limit (``OPENAI_MAX_CONCURRENCY``) and a per-section limit
+  (``OPENAI_SECTION_CONCURRENCY``) on the requests in flight;
+- a timeout per request, and retries of rate limits, server errors and
+  connection errors with exponential backoff and full jitter.
+
+``stream_chat_completion`` yields the reply as it is generated and records
+the time to its first token in the ``openai.ttft_seconds`` metric.
+"""
+
+import asyncio
+import logging
+import random
+import time
+
+import httpx
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    InternalServerError,
+    RateLimitError,
+)
+
+from config import (
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+    OPENAI_DEFAULT_SECTION_CONCURRENCY,
+    OPENAI_MAX_CONCURRENCY,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_RETRIES,
+    OPENAI_RETRY_BASE_SECONDS,
+    OPENAI_RETRY_MAX_SECONDS,
+    OPENAI_SECTION_CONCURRENCY,
+    OPENAI_TIMEOUT_SECONDS,
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Errors worth trying again (APITimeoutError is an APIConnectionError)
+RETRYABLE_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+
+class OpenAIGateway:
+    """The process-wide OpenAI client and its concurrency limits."""
+
+    def __init__(self):
+        self._client = None
+        self._loop = None
+        self._global_slots = None
+        self._section_slots = {}
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        if self._client is None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+                ),
+                timeout=OPENAI_TIMEOUT_SECONDS,
+            )
+            self._client = AsyncOpenAI(
+                api_key=OPENAI_API_KEY,
+                base_url=OPENAI_BASE_URL,
+                http_client=http_client,
+                timeout=OPENAI_TIMEOUT_SECONDS,
+                max_retries=0,  # Retried here, outside the concurrency slots
+            )
+        return self._client
+
+    def _slots(self, section: str):
+        """Returns the global and the section semaphore for the running loop."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._global_slots = asyncio.Semaphore(OPENAI_MAX_CONCURRENCY)
+            self._section_slots = {}
+        if section not in self._section_slots:
+            self._section_slots[section] = asyncio.Semaphore(
+                OPENAI_SECTION_CONCURRENCY.get(section, OPENAI_DEFAULT_SECTION_CONCURRENCY)
+            )
+        return self._global_slots, self._section_slots[section]
+
+    async def call(self, section: str, request):
+        """Awaits ``request(client)`` within the limits, retrying transient errors."""
+        global_slots, section_slots = self._slots(section)
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            try:
+                # The section slot first, so a busy section does not hold global slots
+                async with section_slots, global_slots:
+                    return await request(self.client)
+            except RETRYABLE_ERRORS as e:
+                if attempt == OPENAI_MAX_RETRIES:
+                    raise
+                await self._backoff(section, attempt, e)
+
+    @staticmethod
+    async def _backoff(section, attempt, error):
+        delay = random.uniform(
+            0, min(OPENAI_RETRY_MAX_SECONDS, OPENAI_RETRY_BASE_SECONDS * 2**attempt)
+        )
+        logger.warning(
+            f"OpenAI request of {section} failed ({type(error).__name__}), "
+            f"retrying in {delay:.1f}s"
+        )
+        await asyncio.sleep(delay)
+
+    async def chat_completion(self, section: str, **kwargs):
+        return await self.call(section, lambda client: client.chat.completions.create(**kwargs))
+
+    async def stream_chat_completion(self, section: str, **kwargs):
+        """Yields the text of a streamed chat completion as it arrives.
+
+        The request holds its concurrency slots until the stream ends. It is
+        retried like ``call`` only until the first text arrives.
+        """
+        global_slots, section_slots = self._slots(section)
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            started = time.perf_counter()
+            received = False
+            try:
+                async with section_slots, global_slots:
+                    stream = await self.client.chat.completions.create(stream=True, **kwargs)
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if not delta:
+                            continue
+                        if not received:
+                            received = True
+                            metrics.histogram("openai.ttft_seconds").observe(
+                                time.perf_counter() - started
+                            )
+                        yield delta
+                return
+            except RETRYABLE_ERRORS as e:
+                if received or attempt == OPENAI_MAX_RETRIES:
+                    raise
+                await self._backoff(section, attempt, e)
+
+    async def generate_image(self, section: str, **kwargs):
+        return await self.call(section, lambda client: client.images.generate(**kwargs))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+
+openai_gateway = OpenAIGateway()
@@ -0,0 +1,62 @@
+"""Cache of assistant replies to prompts that many users send identically.
+
+Answer feedback in conversation learning is built from the question, the
+correct answer, its stored explanation and the user's answer, so the same few
+hundred questions produce the same few thousand prompts across all students.
+Callers mark such a request with a cache key (for feedback:
+``(question_id, normalized answer, prompt version)``); ``ChatGPT`` adds its
+model, sends the request without the user's history so the reply fits anyone,
+and serves later identical requests from ``response_cache``.
+
+Entries expire after ``AI_RESPONSE_CACHE_TTL_SECONDS`` and the least recently
+used are evicted beyond ``AI_RESPONSE_CACHE_SIZE``. Lookups are counted as
+``ai_responses.hits`` / ``ai_responses.misses``. Follow-up turns depend on
+the conversation so far and must not pass a key.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from config import AI_RESPONSE_CACHE_SIZE, AI_RESPONSE_CACHE_TTL_SECONDS
+from utils.metrics import metrics
+
+
+class ResponseCache:
+    """LRU cache of reply texts whose entries expire after ``ttl_seconds``."""
+
+    def __init__(self, max_size: int, ttl_seconds: float, name: str = "ai_responses"):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.name = name
+        self._entries = OrderedDict()  # key -> (expires at, reply)
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        metrics.counter(f"{self.name}.{'hits' if entry else 'misses'}").inc()
+        return entry[1] if entry else None
+
+    def put(self, key: Hashable, reply: str):
+        if not reply:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, reply)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache(AI_RESPONSE_CACHE_SIZE, AI_RESPONSE_CACHE_TTL_SECONDS)
@@ -23,7 +23,56 @@ BOT_TOKEN = get_text_from_file(BOT_TOKEN_PATH)
 
 # OpenAI key
 OPENAI_API_PATH = os.path.join(API_PATH, "openai.txt")
-OPENAI_API_KEY = get_text_from_file(OPENAI_API_PATH)
+# Without the file, the OPENAI_API_KEY environment variable is used
+if os.path.exists(OPENAI_API_PATH) or not os.environ.get("OPENAI_API_KEY"):
+    OPENAI_API_KEY = get_text_from_file(OPENAI_API_PATH)
+else:
+    OPENAI_API_KEY = os.environ["OPENAI_API_KEY"]
+# Another OpenAI-compatible endpoint, e.g. AIModels/fake_openai_server.py for local runs
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL") or None
+
+# Shared async OpenAI client (AIModels/openai_client.py)
+OPENAI_MAX_CONNECTIONS = 100  # Pooled keep-alive HTTP connections
+OPENAI_MAX_CONCURRENCY = 64  # Requests in flight across the whole bot
+OPENAI_SECTION_CONCURRENCY = {  # Requests in flight per section
+    "chat": 32,
+    "conversation": 16,
+    "tips": 8,
+    "tests": 8,
+    "level": 16,
+    "design": 4,
+    "question_generation": 4,
+    "summary": 4,
+    "explanations": 8,
+}
+OPENAI_DEFAULT_SECTION_CONCURRENCY = 8
+OPENAI_TIMEOUT_SECONDS = 60
+OPENAI_MAX_RETRIES = 3
+OPENAI_RETRY_BASE_SECONDS = 1  # Backoff before retry n is random(0, base * 2**n)
+OPENAI_RETRY_MAX_SECONDS = 20
+
+# Chat context (AIModels/chat_memory.py)
+CHAT_CONTEXT_TOKEN_BUDGET = 3000  # Estimated tokens of history sent with a request
+CHAT_WINDOW_MESSAGES = 12  # Newest messages sent as they are (the last 6 turns)
+CHAT_SUMMARY_MIN_MESSAGES = 8  # Older messages needed before the summary is refreshed
+CHAT_SUMMARY_MODEL = "gpt-4o-mini"
+
+# Shared replies to identical prompts, e.g. answer feedback (AIModels/response_cache.py)
+AI_RESPONSE_CACHE_SIZE = 5000
+AI_RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60  # Edited questions are picked up within a week
+
+# Pre-generated explanations per question and option (AIModels/explanations.py)
+AI_EXPLANATIONS_MODEL = "gpt-4o-mini"
+AI_EXPLANATIONS_CONCURRENCY = 8  # Requests in flight during a batch run
+AI_EXPLANATIONS_MAX_COST_USD = 5.0  # A run stops starting requests beyond this spend
+AI_EXPLANATIONS_INPUT_COST_PER_1K = 0.00015  # USD per 1000 prompt tokens
+AI_EXPLANATIONS_OUTPUT_COST_PER_1K = 0.0006  # USD per 1000 completion tokens
+AI_EXPLANATIONS_PER_TEST = 10  # Wrong answers explained after a test
+
+# Written assistant replies are streamed into their Telegram message
+OPENAI_STREAM_RESPONSES = True
+STREAM_EDIT_INTERVAL_SECONDS = 1.0  # At most one edit of a streaming message per interval
+STREAM_EDIT_MIN_CHARS = 40  # New text needed before the message is edited again
 
 # ----------------
 # Main files directory
@@ -37,6 +86,25 @@ IMAGE_FOLDER = "Images"
 # Path to Database File
 DATABASE_FILE = os.path.join(MAIN_FILES, "database.db")
 
+# SQLite connection tuning (applied to every pooled connection)
+DATABASE_BUSY_TIMEOUT_MS = 5000  # Wait this long on a locked database before failing
+DATABASE_CACHE_SIZE_KB = 20000  # Page cache per connection (~20 MB)
+DATABASE_MMAP_SIZE = 256 * 1024 * 1024  # Memory-map up to 256 MB of the file
+
+# Dedicated database threads used by the async handlers (utils/async_database.py)
+DATABASE_WORKER_THREADS = 4
+DATABASE_QUEUE_SIZE = 1000  # Max queries waiting for a database thread
+
+# Group-commit writer for high-frequency inserts (utils/write_queue.py)
+WRITE_QUEUE_MAX_BATCH_ROWS = 200  # Commit as soon as this many rows are waiting
+WRITE_QUEUE_MAX_DELAY_MS = 50  # ...or after this long, whichever comes first
+
+# Daily ChatGPT / AI image counters kept in memory (utils/usage_quota.py)
+USAGE_QUOTA_FLUSH_INTERVAL_SECONDS = 5  # How often changed counters are written
+
+# How often the in-memory question bank checks for a sync made by another process
+QUESTION_BANK_REFRESH_SECONDS = 60
+
 
 # ----------------
 # Text files directory
@@ -70,6 +138,19 @@ VERBAL_FILE = os.path.join(VERBEL_FILES_DIRECTORY, "الاسئلة اللفظي
 
 CONTEXT_DIRECTORY = os.path.join(VERBEL_FILES_DIRECTORY, "Context")
 
+# In-memory passage cache (utils/passage_store.py)
+PASSAGE_CACHE_SIZE = 256  # Passages kept in memory
+PASSAGE_CACHE_RECHECK_SECONDS = 30  # How often a cached passage is checked for edits
+
+# Write-ahead journals of running quizzes (utils/quiz_log.py)
+QUIZ_JOURNAL_DIRECTORY = os.path.join(MAIN_FILES, "quiz_journal")
+QUIZ_JOURNAL_FSYNC_INTERVAL_SECONDS = 1  # How often journaled answers are fsynced (0: every answer)
+
+# Quiz deadline timer wheel (utils/quiz_deadlines.py)
+DEADLINE_WHEEL_TICK_SECONDS = 1  # Resolution of quiz deadlines
+DEADLINE_WHEEL_SLOTS = 512  # Slots per turn of the wheel
+QUIZ_IDLE_TIMEOUT_SECONDS = 30 * 60  # Untimed quizzes end after this long without an answer
+
 # ----------------
 # Rewards Files directory
 REWARDS_FILES_DIRECTORY = os.path.join(MAIN_FILES, "Rewards Files")
@@ -111,10 +192,48 @@ WORD_FOLDER_PATH = os.path.join(TEMPLATE_FILES_DIRECTORY, "Word")
 WORD_MAIN_PATH = os.path.join(WORD_FOLDER_PATH, "Main.docx")
 Q_AND_A_FILE_PATH = os.path.join(WORD_FOLDER_PATH, "Q&A.docx")
 
+# Quiz result PDFs: "docx" renders Q_AND_A_FILE_PATH and converts it with
+# LibreOffice, "native" draws them directly (utils/quiz_report.py). The font
+# the native renderer needs is not shipped: put an Arabic TTF (the template
+# uses Hacen Tehran) at QUIZ_REPORT_FONT_FILE before switching to "native"
+QUIZ_PDF_RENDERER = "docx"
+# True: quiz PDFs are not rendered when the quiz ends but the first time the
+# user presses the download button, from the stored answers, then kept
+QUIZ_PDF_ON_DEMAND = False
+# Arabic TTF font used by the native renderer (the template uses Hacen Tehran)
+QUIZ_REPORT_FONT_FILE = os.path.join(TEMPLATE_FILES_DIRECTORY, "Fonts", "HacenTehran.ttf")
+# Laid-out question blocks kept in memory and shared between reports
+QUIZ_REPORT_FRAGMENT_CACHE_SIZE = 5000
+
 # Power Point Files
 POWERPOINT_FOLDER_PATH = os.path.join(TEMPLATE_FILES_DIRECTORY, "Powerpoint")
 POWERPOINT_MAIN_PATH = os.path.join(POWERPOINT_FOLDER_PATH, "Main.pptx")
 
+# Pool of headless LibreOffice processes converting documents to PDF (utils/office_pool.py)
+OFFICE_BINARY = "libreoffice"
+OFFICE_POOL_SIZE = 2  # Office processes kept running (= conversions in parallel)
+OFFICE_POOL_BASE_PORT = 2002  # Worker N listens for UNO connections on this port + N
+OFFICE_JOB_TIMEOUT_SECONDS = 120  # A conversion taking longer restarts its worker
+OFFICE_START_TIMEOUT_SECONDS = 30
+OFFICE_PROFILES_DIRECTORY = os.path.join(MAIN_FILES, "office_profiles")
+
+# Counters and timings of utils/metrics.py are written to the log this often
+METRICS_LOG_INTERVAL_SECONDS = 15 * 60
+
+# Stored quiz reports (utils/report_storage.py)
+USER_REPORTS_DIRECTORY = "user_tests"
+USER_REPORTS_QUOTA_BYTES = 50 * 1024 * 1024  # The oldest reports of a user above this are deleted
+USER_REPORTS_ARCHIVE_AFTER_DAYS = 30  # Older reports are gzipped
+USER_REPORTS_RETENTION_DAYS = 180  # Older reports are deleted
+USER_REPORTS_ORPHAN_GRACE_SECONDS = 60 * 60  # Unreferenced files younger than this are kept
+USER_REPORTS_GC_INTERVAL_SECONDS = 6 * 60 * 60
+
+# Durable document job queue (utils/document_jobs.py)
+DOCUMENT_JOB_WORKERS = 2  # Jobs rendered in parallel
+DOCUMENT_JOB_MAX_ATTEMPTS = 3  # A job failing this many times is marked failed
+DOCUMENT_JOB_RETRY_DELAY_SECONDS = 30  # Wait before a failed job's retry, doubled per attempt
+DOCUMENT_JOB_IDLE_POLL_SECONDS = 5  # Idle workers look for jobs whose retry is due this often
+
 
 # ----------------
 # Moivation messages directory
@@ -132,3 +251,24 @@ MALE_GO_BACK_MESSAGES_FILE = os.path.join(
 FEMALE_GO_BACK_MESSAGES_FILE = os.path.join(
     MOTIVATIONAL_MESSAGES_PATH, "go_back/Female Sructure.xlsx"
 )
+
+# ----------------
+# Compiled content bundle (build it with: python -m utils.content_bundle)
+CONTENT_BUNDLE_FILE = os.path.join(MAIN_FILES, "content_bundle.db")
+
+# Every workbook the bot reads; the bundle is used unless the .xlsx is newer
+CONTENT_BUNDLE_SOURCES = [
+    EXCEL_FILE_BASHAR,
+    VERBAL_FILE,
+    REMINDER_FILE,
+    FAQ_FILE,
+    REWARDS_EXCEL,
+    GENERAL_ADVICE_FILE,
+    SOLUTION_STRATEGIES_FILE,
+    DESIGNS_FOR_MALE_FILE,
+    DESIGNS_FOR_FEMALE_FILE,
+    MALE_MAIN_MENU_MESSAGES_FILE,
+    FEMALE_MAIN_MENUMESSAGES_FILE,
+    MALE_GO_BACK_MESSAGES_FILE,
+    FEMALE_GO_BACK_MESSAGES_FILE,
+]
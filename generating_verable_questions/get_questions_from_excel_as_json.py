@@ -5,6 +5,7 @@ import os
 
 from AIModels.chatgpt import get_chatgpt_instance
 from config import CONTEXT_DIRECTORY, VERBAL_FILE
+from utils.passage_store import get_passage_store
 
 
 def read_context_from_folder(folder_path, context_name):
@@ -12,11 +13,7 @@ def read_context_from_folder(folder_path, context_name):
     Reads context from a text file in the specified folder if the file matches the context name.
     Returns the context content if found; otherwise, returns 'N/A'.
     """
-    context_file_path = os.path.join(folder_path, f"{context_name}.txt")
-    if os.path.isfile(context_file_path):
-        with open(context_file_path, "r", encoding="utf-8") as f:
-            return f.read().strip()
-    return "N/A"
+    return get_passage_store(folder_path).get(context_name) or "N/A"
 
 
 def prepare_fine_tuning_data(excel_file, context_folder):
@@ -272,7 +269,7 @@ def generate_verbel_questions_with_excel_data():
 
     excel_file = VERBAL_FILE  # Replace with your file's path
 
-    chatgpt = get_chatgpt_instance()
+    chatgpt = get_chatgpt_instance(section="question_generation")
 
     try:
         df = pd.read_excel(excel_file)
@@ -305,7 +302,7 @@ def generate_verbel_questions_with_excel_data():
 def generate_verbel_questions_with_category():
     loop = asyncio.get_event_loop()
 
-    chatgpt = get_chatgpt_instance()
+    chatgpt = get_chatgpt_instance(section="question_generation")
 
     try:
         # Generate custom questions for a specific category
@@ -84,7 +84,7 @@ async def confirm_clear_history(update: Update, context: CallbackContext) -> int
     if user_response == "نعم":
         user_id = update.effective_user.id
         await chatgpt.clear_user_history(user_id)
-        context.user_data["messages"] = [{"role": "system", "content": SYSTEM_MESSAGE}]
+        context.user_data["messages"] = []
         await update.message.reply_text("تم مسح سجل الدردشة الخاص بك.")
         await update.message.reply_text(
             "هل تريد بدء محادثة جديدة؟",
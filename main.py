@@ -1,10 +1,15 @@
 import asyncio
 import logging
-import os
 from telegram import BotCommand
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler
 from telegram.request import HTTPXRequest
-from config import BOT_TOKEN, DATABASE_FILE
+from AIModels.openai_client import openai_gateway
+from config import (
+    BOT_TOKEN,
+    METRICS_LOG_INTERVAL_SECONDS,
+    USAGE_QUOTA_FLUSH_INTERVAL_SECONDS,
+    USER_REPORTS_GC_INTERVAL_SECONDS,
+)
 
 from handlers.conversation.conversation_handler import (
     register_converstaion_handlers,
@@ -16,10 +21,21 @@ from handlers.personal_assistant_chat_handler import (
     personal_assistant_handler,
 )
 from handlers.help_support_handler import help_support_handler
-from utils.database import create_tables
+from utils.async_database import db_executor
+from utils.database import connection_manager, create_tables
+from utils.document_jobs import document_jobs
+from utils.metrics import log_metrics_periodically, metrics
+from utils.migrations import run_migrations
+from utils.office_pool import office_pool
+from utils.question_bank import question_bank
 from utils.motivation.button_click_tracker import load_motivational_messages
-from utils.question_management import generate_verbal_questions
+from utils.question_management import sync_all_questions
+from utils.quiz_log import journal_writer, recover_unfinished_quizzes
+from utils.quiz_report import native_renderer_enabled
 from utils.reminders import register_reminders_handlers
+from utils.report_storage import collect_garbage_periodically
+from utils.usage_quota import flush_quotas, flush_quotas_periodically
+from utils.write_queue import group_writer
 
 # Enable logging
 logging.basicConfig(
@@ -43,13 +59,44 @@ async def set_persistent_menu(application):
     await application.bot.set_my_commands(commands)
 
 
+async def post_init(application):
+    await set_persistent_menu(application)
+    # Resume the document jobs left by the last run and start the workers
+    await document_jobs.start(application)
+    application.create_task(log_metrics_periodically(METRICS_LOG_INTERVAL_SECONDS))
+    # Orphans, retention, archiving and quotas of the stored reports
+    application.create_task(collect_garbage_periodically(USER_REPORTS_GC_INTERVAL_SECONDS))
+    application.create_task(flush_quotas_periodically(USAGE_QUOTA_FLUSH_INTERVAL_SECONDS))
+
+
+async def post_shutdown(application):
+    await document_jobs.stop()
+    await openai_gateway.close()
+    # The group-commit writer stores these before the process exits
+    flush_quotas()
+
+
 def main():
     """Start the bot."""
     loop = asyncio.get_event_loop()
-    # Check if the database file exists
-    if not os.path.exists(DATABASE_FILE):
-        loop.run_until_complete(create_tables())
-        loop.run_until_complete(generate_verbal_questions())
+    # Only creates the tables that are missing, so it is safe on every start
+    loop.run_until_complete(create_tables())
+
+    # Bring the schema (indexes, new columns) up to date
+    run_migrations()
+
+    # Commit the answers of quizzes that were running when the bot stopped
+    recover_unfinished_quizzes()
+
+    # Insert, update or retire only the questions whose Excel rows changed
+    sync_all_questions()
+
+    # Index the question ids once so quizzes never sort the questions table
+    question_bank.load()
+
+    # Report a missing native PDF font or UNO bridge now rather than at the first quiz
+    native_renderer_enabled()
+    office_pool.check_uno_bridge()
 
     request = HTTPXRequest(
         connect_timeout=20.0,  # Increase the connection timeout (default is 5.0)
@@ -60,7 +107,8 @@ def main():
         .token(BOT_TOKEN)
         .concurrent_updates(True)
         .request(request)
-        .post_init(set_persistent_menu)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .build()
     )
 
@@ -83,6 +131,13 @@ def main():
     # Start the bot. This will block until the bot stops.
     application.run_polling(poll_interval=2, timeout=15)
 
+    logger.info(f"Metrics:\n{metrics.report()}")
+    group_writer.shutdown()
+    journal_writer.shutdown()
+    office_pool.shutdown()
+    db_executor.shutdown()
+    connection_manager.close_all()
+
 
 if __name__ == "__main__":
     main()
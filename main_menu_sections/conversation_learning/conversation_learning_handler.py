@@ -1,3 +1,6 @@
+import re
+import unicodedata
+
 from telegram import (
     ReplyKeyboardMarkup,
     Update,
@@ -14,6 +17,8 @@ from telegram.ext import (
 )
 
 from AIModels.chatgpt import get_chatgpt_instance
+from AIModels.explanations import get_explanation
+from utils import async_database
 from utils.question_management import (
     format_question_for_chatgpt,
     format_question_for_user,
@@ -27,7 +32,13 @@ from utils.subscription_management import check_subscription
 # Conversation states
 ASK_QUESTION, PROVIDE_FEEDBACK, REVIEW_QUESTION = range(3)
 
-chatgpt = get_chatgpt_instance()
+# Bump when the feedback prompt changes so cached feedback is not reused
+FEEDBACK_PROMPT_VERSION = 1
+
+# Arabic option letters as shown by format_question_for_user
+OPTION_LETTERS = {"أ": "A", "ا": "A", "ب": "B", "ج": "C", "د": "D"}
+
+chatgpt = get_chatgpt_instance(section="conversation")
 
 # System message to set up the assistant's behavior
 SYSTEM_MESSAGE = """
@@ -70,17 +81,33 @@ async def ask_question(update: Update, context: CallbackContext):
     await query.message.reply_text("حسنا هذا سؤال لك كيف تعتقد سيكون حله 🤔")
 
     context.user_data["current_question"] = question_data
+    context.user_data["feedback_given"] = False
     formatted_question = format_question_for_user(question_data)
 
     await query.edit_message_text(formatted_question)
     return PROVIDE_FEEDBACK
 
 
+def normalize_answer(answer: str) -> str:
+    """Maps an answer to its option letter (A-D) when it names one."""
+    answer = unicodedata.normalize("NFKC", answer).strip().upper()
+    letter = re.sub(r"[\s.):(\-]", "", answer)
+    letter = OPTION_LETTERS.get(letter, letter)
+    return letter if letter in ("A", "B", "C", "D") else re.sub(r"\s+", " ", answer)
+
+
 async def provide_feedback(update: Update, context: CallbackContext):
-    user_answer = update.message.text.strip().upper()
+    user_answer = normalize_answer(update.message.text)
     question_data = context.user_data["current_question"]
     correct_answer = question_data["correct_answer"].upper()
 
+    # The first answer to a question gets the shared cached feedback; anything
+    # after it is a follow-up that depends on the conversation
+    cache_key = None
+    if not context.user_data.get("feedback_given") and len(user_answer) == 1:
+        cache_key = ("feedback", question_data["id"], user_answer, FEEDBACK_PROMPT_VERSION)
+    context.user_data["feedback_given"] = True
+
     chatgpt_prompt = (
         f"The user answered '{user_answer}' to the following question:\n"
         f"{format_question_for_chatgpt(question_data)}\n\n"
@@ -92,6 +119,25 @@ async def provide_feedback(update: Update, context: CallbackContext):
         f"and also make the conversation fun and engage with the user and don't let the user know of the prompt, have a normal conversation"
     )
 
+    # A pre-generated explanation answers at once; follow-ups go to the model
+    explanation = None
+    if cache_key:
+        explanation = await async_database.run(
+            get_explanation, question_data["id"], user_answer
+        )
+    if explanation:
+        await update.message.reply_text(explanation)
+        await chatgpt.remember_turn(
+            update.effective_user.id,
+            context,
+            [
+                {"role": "user", "content": chatgpt_prompt},
+                {"role": "assistant", "content": explanation},
+            ],
+        )
+        await update.message.reply_text("هل لديك اي استفسارات لتسأل عنها؟ 🙋‍♂️")
+        return PROVIDE_FEEDBACK
+
     await update.message.reply_text(
         "جاري تحليل إجابتك... 🧐"
     )  # Feedback during processing
@@ -102,6 +148,7 @@ async def provide_feedback(update: Update, context: CallbackContext):
         update=update,
         context=context,
         system_message=SYSTEM_MESSAGE,
+        cache_key=cache_key,
     )
 
     if assistant_response == -1:
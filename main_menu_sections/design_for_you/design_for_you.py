@@ -12,13 +12,14 @@ from telegram.ext import (
     CallbackContext,
 )
 
-from openai import OpenAI
-from config import DESIGNS_POWER_POINT_FILES, OPENAI_API_KEY
+from AIModels.openai_client import openai_gateway
+from config import DESIGNS_POWER_POINT_FILES
 from main_menu_sections.design_for_you.helper_functions import (
     check_user_ai_limit,
     download_image,
     load_design_options,
     process_powerpoint_design,
+    release_user_ai_usage,
     update_user_ai_usage,
 )
 from handlers.main_menu_handler import (
@@ -31,9 +32,6 @@ from utils.subscription_management import check_subscription
 # States for ConversationHandler
 AI_PROMPT = 0
 
-# OpenAI client initialization
-client = OpenAI(api_key=OPENAI_API_KEY)
-
 # Enable logging
 logger = logging.getLogger(__name__)
 
@@ -218,8 +216,8 @@ async def handle_ai_prompt(update: Update, context):
             "جاري إنشاء تصميمك باستخدام الذكاء الاصطناعي...  ⏳"
         )
 
-        response = await asyncio.to_thread(
-            client.images.generate,
+        response = await openai_gateway.generate_image(
+            "design",
             model="dall-e-3",
             prompt=prompt,
             size="1024x1024",
@@ -255,6 +253,7 @@ async def handle_ai_prompt(update: Update, context):
         return AI_PROMPT
     except Exception as e:
         logger.error(f"Error generating AI image: {e}")
+        await release_user_ai_usage(user_id)
         await update.message.reply_text(
             "عذراً، حدث خطأ أثناء إنشاء التصميم. يرجى المحاولة مرة أخرى لاحقًا. 😞"
         )
@@ -1,21 +1,20 @@
 import asyncio
 import io
-import datetime
 from typing import Tuple
 import uuid
 import logging
 import os
-import openpyxl
 from PIL import Image
 from pptx import Presentation
 import aiohttp
 from config import DESIGNS_FOR_FEMALE_FILE, DESIGNS_FOR_MALE_FILE
-from utils.database import execute_query, get_data
+from utils import async_database, content_bundle
+from utils.office_pool import office_pool
+from utils.usage_quota import ai_image_quota
 from utils.user_management import get_user_data
 import tempfile
 from pdf2image import convert_from_path
 import os
-import subprocess
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +25,7 @@ def load_design_options(gender: str):
             FILE_GENDER = DESIGNS_FOR_MALE_FILE
         else:
             FILE_GENDER = DESIGNS_FOR_FEMALE_FILE
-        workbook = openpyxl.load_workbook(FILE_GENDER)
+        workbook = content_bundle.load_workbook(FILE_GENDER)
         sheet = workbook.active
         return [
             (row[0], row[1]) for row in sheet.iter_rows(min_row=2, values_only=True)
@@ -72,15 +71,8 @@ def convert_ppt_to_image(ppt_file_path, img_path, dpi=300, image_format="png"):
         pdf_filename = os.path.splitext(os.path.basename(ppt_file_path))[0] + ".pdf"
         pdf_path = os.path.join(temp_dir, pdf_filename)
         
-        # Run the LibreOffice command to convert PPTX to PDF
-        result = subprocess.run([
-            "libreoffice", "--headless", "--invisible", "--convert-to", "pdf",
-            "--outdir", temp_dir, ppt_file_path
-        ], check=True)
-        
-        # Check if the PDF was created successfully
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError("PDF conversion failed.")
+        # Convert PPTX to PDF on one of the LibreOffice workers
+        office_pool.convert_to_pdf(ppt_file_path, pdf_path)
         print(f"Converted PPTX to PDF: {pdf_path}")
         
         # Step 2: Convert PDF to images
@@ -116,27 +108,19 @@ async def download_image(image_url):
 
 
 async def check_user_ai_limit(user_id: int) -> Tuple[bool, int, int]:
-    """Checks if user has reached their daily AI design limit, considering subscription type."""
-    today = datetime.date.today()
-    today_start = datetime.datetime(today.year, today.month, today.day, 0, 0, 0)
-
-    query = """
-        SELECT COUNT(*) 
-        FROM ai_image_usage 
-        WHERE user_id = ? 
-        AND usage_time >= ?
-    """
-    params = (user_id, today_start)
-    usage_count = get_data(query, params)[0][0]
+    """Checks if user has reached their daily AI design limit, considering subscription type.
 
-    user_data = await asyncio.to_thread(get_user_data, user_id)
+    When allowed, one image is reserved: call ``update_user_ai_usage`` once it
+    is sent or ``release_user_ai_usage`` if it fails.
+    """
+    user_data = await async_database.run(get_user_data, user_id)
     subscription_type = user_data.get("type_of_last_subscription")
 
     daily_limit = get_daily_ai_limit(subscription_type)
 
+    is_allowed, usage_count = await ai_image_quota.reserve(user_id, daily_limit)
     is_not_subscribed = daily_limit == 1
     images_left = daily_limit - usage_count
-    is_allowed = images_left > 0
 
     return is_allowed, usage_count, images_left, is_not_subscribed
 
@@ -153,9 +137,9 @@ def get_daily_ai_limit(subscription_type: str) -> int:
 
 
 async def update_user_ai_usage(user_id: int):
-    query = """
-        INSERT INTO ai_image_usage (user_id, usage_time) 
-        VALUES (?, ?)
-    """
-    params = (user_id, datetime.datetime.now())
-    await asyncio.to_thread(execute_query, query, params)  # Make this awaitable
+    # Logged to ai_image_usage by the quota's write-behind
+    await ai_image_quota.commit(user_id)
+
+
+async def release_user_ai_usage(user_id: int):
+    await ai_image_quota.release(user_id)
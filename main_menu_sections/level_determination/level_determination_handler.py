@@ -1,9 +1,7 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import logging
-from datetime import datetime, timedelta
 import os
-import random
+from datetime import datetime, timedelta
 from typing import Dict, List
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
@@ -16,28 +14,24 @@ from telegram.ext import (
     CommandHandler,
 )
 
-from config import CONTEXT_DIRECTORY, UNDER_DEVLOPING_MESSAGE
+from config import QUIZ_PDF_ON_DEMAND, UNDER_DEVLOPING_MESSAGE
 from handlers.main_menu_handler import main_menu_handler
-from handlers.personal_assistant_chat_handler import chatgpt, SYSTEM_MESSAGE
-from main_menu_sections.level_determination.pdf_generator import (
-    generate_quiz_pdf,
-)
-from utils.database import (
-    execute_query,
-    get_data,
-    execute_query_return_id,
-)
-from utils.question_management import get_passage_content, get_random_questions
+from AIModels.chatgpt import get_chatgpt_instance
+from handlers.personal_assistant_chat_handler import SYSTEM_MESSAGE
+from main_menu_sections.level_determination.pdf_generator import LEVEL_REPORT_JOB
+from utils import async_database, document_jobs
+from utils.category_mangement import get_questions_metadata
+from utils.question_bank import question_bank
+from utils.quiz_deadlines import evict_quiz_session, schedule_quiz_deadline
+from utils.quiz_log import QuizAnswerLog, finalize_quiz, stored_question_ids
+from utils.question_management import get_random_questions
+from utils.quiz_rendering import prerender_quiz
+from utils.report_storage import open_report
 from utils.subscription_management import check_subscription
 from utils.user_management import (
     calculate_percentage_expected,
     calculate_points,
-    update_user_created_questions,
-    update_user_percentage_expected,
-    update_user_points,
-    update_user_usage_time,
 )
-import pythoncom
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -52,10 +46,7 @@ logger = logging.getLogger(__name__)
 ) = range(5)
 CHATTING = 0
 
-
-executor = ThreadPoolExecutor(
-    max_workers=2, initializer=pythoncom.CoInitialize
-)
+chatgpt = get_chatgpt_instance(section="level")
 
 
 async def handle_level_determination(update: Update, context: CallbackContext):
@@ -203,7 +194,9 @@ async def start_quiz(update: Update, context: CallbackContext):
     question_type = context.user_data["level_quiz_type"]
 
     try:
-        questions = get_random_questions(num_questions, question_type)
+        questions = await async_database.run(
+            get_random_questions, num_questions, question_type
+        )
     except Exception as e:
         logger.error(f"Error in getting questions: {e}")
         await update.message.reply_text(
@@ -211,7 +204,12 @@ async def start_quiz(update: Update, context: CallbackContext):
         )
         return ConversationHandler.END
 
-    context.user_data["questions"] = questions
+    # Sessions keep only ids; the records are shared by the question bank
+    context.user_data["questions"] = [question.id for question in questions]
+    # Render every question now so answering only has to send the next one
+    context.user_data["rendered_questions"] = await asyncio.to_thread(
+        prerender_quiz, questions
+    )
     context.user_data["current_question"] = 0
     context.user_data["score"] = 0
     context.user_data["start_time"] = datetime.now()
@@ -220,7 +218,7 @@ async def start_quiz(update: Update, context: CallbackContext):
 
     try:
         timestamp = datetime.now()
-        level_determination_id = execute_query_return_id(
+        level_determination_id = await async_database.execute_query_return_id(
             """
             INSERT INTO level_determinations (user_id, timestamp, num_questions, percentage, time_taken, pdf_path)
             VALUES (?, ?, ?, 0, 0, '')
@@ -228,6 +226,11 @@ async def start_quiz(update: Update, context: CallbackContext):
             (user_id, timestamp, num_questions),
         )
         context.user_data["level_determination_id"] = level_determination_id
+        # Answers stay in memory until end_quiz commits them in one go
+        context.user_data["answer_log"] = QuizAnswerLog(
+            "level", level_determination_id, user_id
+        )
+        context.user_data["quiz_active"] = True
     except Exception as e:
         logger.error(f"Error in database insertion: {e}")
         await update.message.reply_text(
@@ -261,54 +264,19 @@ async def send_question(update: Update, context: CallbackContext):
     current_question_index = context.user_data["current_question"]
 
     if current_question_index < len(questions):
-        question_data = questions[current_question_index]
-        (
-            question_id,
-            correct_answer,
-            question_text,
-            option_a,
-            option_b,
-            option_c,
-            option_d,
-            explanation,
-            main_category_id,
-            question_type,
-            image_path,
-            passage_name,
-        ) = question_data
-
-        passage_content = ""
-        if passage_name != "-":
-            passage_content = get_passage_content(CONTEXT_DIRECTORY, passage_name)
-
-        passage_text = f"النص: {passage_content}\n\n" if passage_content else ""
-        answer_options = [
-            (f"أ. {option_a}", f"answer_{question_id}_أ"),
-            (f"ب. {option_b}", f"answer_{question_id}_ب"),
-            (f"ج. {option_c}", f"answer_{question_id}_ج"),
-            (f"د. {option_d}", f"answer_{question_id}_د"),
-        ]
-        random.shuffle(answer_options)
-
-        keyboard = []
-        for i in range(0, len(answer_options), 2):
-            row = [
-                InlineKeyboardButton(text, callback_data=data)
-                for text, data in answer_options[i : i + 2]
-            ]
-            keyboard.append(row)
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Text and shuffled keyboard were rendered when the quiz started
+        rendered = context.user_data["rendered_questions"][current_question_index]
         if current_question_index == 0:
-            await update.effective_message.reply_text(
-                f"{passage_text}" f"{current_question_index+1}. {question_text}",
-                reply_markup=reply_markup,
+            message = await update.effective_message.reply_text(
+                rendered.text, reply_markup=rendered.reply_markup
             )
         else:
-            await update.effective_message.edit_text(
-                f"{passage_text}" f"{current_question_index+1}. {question_text}",
-                reply_markup=reply_markup,
+            message = await update.effective_message.edit_text(
+                rendered.text, reply_markup=rendered.reply_markup
             )
+        # The deadline timer ends the quiz on this message if the user stops answering
+        context.user_data["quiz_message"] = message
+        schedule_quiz_deadline(update, context, expire_quiz)
     else:
         await end_quiz(update, context)
         await handle_final_step(update, context)
@@ -317,6 +285,11 @@ async def send_question(update: Update, context: CallbackContext):
 
 async def handle_answer(update: Update, context: CallbackContext):
     """Handles answer button presses, checks answers, and sends the next question."""
+    # A tap on a quiz that already ended (deadline, or a double tap on the last question)
+    if not context.user_data.get("quiz_active"):
+        await update.callback_query.answer(text="انتهى هذا الاختبار. ⏱️", show_alert=True)
+        return ConversationHandler.END
+
     if (
         "end_time" in context.user_data
         and datetime.now() > context.user_data["end_time"]
@@ -341,35 +314,28 @@ async def handle_answer(update: Update, context: CallbackContext):
 
     questions = context.user_data["questions"]
     current_question_index = context.user_data["current_question"]
-    question_data = questions[current_question_index]
-    question_text = question_data[2]
+    question = await question_bank.get_async(questions[current_question_index])
+    question_text = question.question_text
     max_question_length = 100
     truncated_question_text = (
         question_text[:max_question_length] + "..."
         if len(question_text) > max_question_length
         else question_text
     )
-    correct_answer = question_data[1]
+    correct_answer = question.correct_answer
 
-    is_correct = user_answer.upper() == correct_answer.upper()
+    is_correct = question.is_correct(user_answer)
 
     # Store the user's answer and whether it was correct
     context.user_data["answers"].append(user_answer)
     context.user_data["results"].append(is_correct)
 
-    level_determination_id = context.user_data["level_determination_id"]
-
-    try:
-        record_user_answer(
-            user_id, question_id, user_answer, is_correct, level_determination_id
-        )
-    except Exception as e:
-        logger.error(f"Error in recording user answer: {e}")
-        # Decide whether to continue or halt the quiz based on the severity
+    # Buffer the answer; it is written to the database when the quiz ends
+    context.user_data["answer_log"].record(question_id, user_answer, is_correct)
 
     if is_correct:
         context.user_data["score"] += 1
-        correct_option_text = get_option_text(question_data, correct_answer)
+        correct_option_text = question.option_text(correct_answer)
 
         await query.answer(
             text=f"إجابة صحيحة! ✅ \n"
@@ -378,8 +344,8 @@ async def handle_answer(update: Update, context: CallbackContext):
             show_alert=True,
         )
     else:
-        correct_option_text = get_option_text(question_data, correct_answer)
-        user_answer_text = get_option_text(question_data, user_answer)
+        correct_option_text = question.option_text(correct_answer)
+        user_answer_text = question.option_text(user_answer)
 
         await query.answer(
             text=f"إجابة خاطئة ❌ \n"
@@ -393,169 +359,144 @@ async def handle_answer(update: Update, context: CallbackContext):
     await send_question(update, context)
 
 
-def record_user_answer(
-    user_id, question_id, user_answer, is_correct, level_determination_id
-):
-    """Records the user's answer in the database, linked to the level determination."""
-    try:
-        execute_query(
-            """
-            INSERT INTO level_determination_answers (user_id, question_id, user_answer, is_correct, level_determination_id)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (user_id, question_id, user_answer, is_correct, level_determination_id),
-        )
-    except Exception as e:
-        logger.error(f"Error recording user answer to database: {e}")
-        # Handle the exception, potentially retrying the operation or notifying the user
-
-
-def get_option_text(question_data, correct_answer):
-    """Helper function to get the text of the correct option."""
-    option_mapping = {
-        "أ": question_data[3],
-        "ب": question_data[4],
-        "ج": question_data[5],
-        "د": question_data[6],
-    }
-    return option_mapping.get(correct_answer, "غير محدد")
+async def expire_quiz(update: Update, context: CallbackContext):
+    """Ends a quiz whose deadline passed while the user was not answering."""
+    await end_quiz(update, context)
+    await handle_final_step(update, context)
 
 
 async def end_quiz(update: Update, context: CallbackContext):
     """Calculates the score and ends the quiz."""
-    end_time = datetime.now()
-    start_time = context.user_data["start_time"]
-    total_time = (end_time - start_time).total_seconds()
-    score = context.user_data["score"]
-    total_questions = len(context.user_data["questions"])
-    questions = context.user_data["questions"]
-    user_id = update.effective_user.id
-
-    level_determination_id = context.user_data["level_determination_id"]
-
-    if (
-        "end_time" in context.user_data
-        and datetime.now() > context.user_data["end_time"]
-    ):
-        await update.effective_message.reply_text("لقد انتهى وقتك. ⏱️")
-
-    message = await update.effective_message.edit_text(
-        "انتظر قليلا حتى يتم تحليل الاجابتات التي قمت بأختيارها... ⏳",
-        parse_mode="Markdown",
-    )
-
-    update_user_usage_time(user_id, total_time)
-    update_user_created_questions(user_id, total_questions)
-    percentage_expected = calculate_percentage_expected(score, total_questions)
-    update_user_percentage_expected(user_id, percentage_expected)
-    points_earned = calculate_points(total_time, score, total_questions)
-    update_user_points(user_id, points_earned)
-
-    percentage = calculate_percentage_expected(score, total_questions)
-
-    # Prepare data for analysis
-    quiz_data = []
-    for i, question_data in enumerate(questions):
-        question_id = question_data[0]
-        question_text = question_data[2]
-        correct_answer = question_data[1]
-        user_answer = context.user_data["answers"][i]
-        is_correct = context.user_data["results"][i]
-
-        # Fetch category and question type from the database
-        category_name, question_type = await get_question_category_and_type(question_id)
+    # Both the deadline timer and the user's last tap can get here; only the first ends it
+    if not context.user_data.pop("quiz_active", False):
+        return ConversationHandler.END
+    try:
+        end_time = datetime.now()
+        start_time = context.user_data["start_time"]
+        total_time = (end_time - start_time).total_seconds()
+        score = context.user_data["score"]
+        total_questions = len(context.user_data["questions"])
+        questions = await async_database.run(
+            question_bank.get_questions, context.user_data["questions"]
+        )
+        user_id = update.effective_user.id
 
-        quiz_data.append(
-            {
-                "question_text": question_text,
-                "correct_answer": correct_answer,
-                "user_answer": user_answer,
-                "is_correct": is_correct,
-                "category": category_name,
-                "question_type": question_type,
-            }
-        )
-
-    # Call the function to generate personalized feedback
-    feedback_text = await generate_feedback_with_chatgpt(
-        user_id,
-        quiz_data,
-        score,
-        total_questions,
-        total_time,
-        update=update,
-        context=context,
-    )
+        level_determination_id = context.user_data["level_determination_id"]
 
-    await message.edit_text(
-        f"*انتهت الأسئلة!* 🎉\n"
-        f"لقد ربحت *{points_earned}* نقطة! 🏆\n"
-        f"لقد حصلت على *{score}* من *{total_questions}* 👏\n"
-        f"لقد استغرقت *{int(total_time // 60)}* دقيقة و*{int(total_time % 60)}* ثانية. ⏱️\n"
-        f"*إليك بعض الملاحظات حول مستواك وطرق التحسين:*\n{feedback_text}",
-        parse_mode="Markdown",
-    )
+        if (
+            "end_time" in context.user_data
+            and datetime.now() > context.user_data["end_time"]
+        ):
+            await update.effective_message.reply_text("لقد انتهى وقتك. ⏱️")
 
-    await update.effective_message.reply_text("انتظر قليلا جاري إنشاء ملف pdf... 📄")
+        message = await update.effective_message.edit_text(
+            "انتظر قليلا حتى يتم تحليل الاجابتات التي قمت بأختيارها... ⏳",
+            parse_mode="Markdown",
+        )
 
-    def generate_pdf_wrapper(questions, user_id):
-        try:
-            return generate_quiz_pdf(questions, user_id)
-        except Exception as e:
-            logger.error(f"Error generating PDF: {e}")
-            return None
+        percentage = calculate_percentage_expected(score, total_questions)
+        points_earned = calculate_points(total_time, score, total_questions)
+
+        # Commit the answers, the user's counters and the level determination row
+        # in a single transaction
+        await async_database.run(
+            finalize_quiz,
+            context.user_data["answer_log"],
+            total_time,
+            total_questions,
+            points_earned,
+            {"percentage": percentage, "time_taken": total_time},
+            percentage,
+        )
 
-    loop = asyncio.get_running_loop()  # Get the event loop
-    pdf_filepath = await loop.run_in_executor(
-        executor, generate_pdf_wrapper, questions, user_id
-    )
+        # Prepare data for analysis; category names and types for the whole quiz
+        # come from one batch lookup
+        metadata = await async_database.run(
+            get_questions_metadata, [question.id for question in questions]
+        )
+        quiz_data = []
+        questions_by_id = {question.id: question for question in questions}
+        # A quiz ended by its deadline may not have every question answered;
+        # answers follow the session's ids, which may include a vanished question
+        for question_id, user_answer, is_correct in zip(
+            context.user_data["questions"], context.user_data["answers"], context.user_data["results"]
+        ):
+            question = questions_by_id.get(question_id)
+            if question is None:
+                continue
+            question_metadata = metadata[question.id]
+            quiz_data.append(
+                {
+                    "question_text": question.question_text,
+                    "correct_answer": question.correct_answer,
+                    "user_answer": user_answer,
+                    "is_correct": is_correct,
+                    "category": question_metadata.category_name,
+                    "question_type": question_metadata.question_type,
+                }
+            )
 
-    if pdf_filepath is None:  # Check if PDF generation failed
-        await update.effective_message.reply_text("حدث خطأ أثناء إنشاء ملف PDF. ⚠️")
+        # Call the function to generate personalized feedback
+        feedback_text = await generate_feedback_with_chatgpt(
+            user_id,
+            quiz_data,
+            score,
+            total_questions,
+            total_time,
+            update=update,
+            context=context,
+        )
 
-    try:
-        execute_query(
-            """
-            UPDATE level_determinations
-            SET percentage = ?, time_taken = ?, pdf_path = ?
-            WHERE id = ?
-            """,
-            (percentage, total_time, pdf_filepath, level_determination_id),
+        await message.edit_text(
+            f"*انتهت الأسئلة!* 🎉\n"
+            f"لقد ربحت *{points_earned}* نقطة! 🏆\n"
+            f"لقد حصلت على *{score}* من *{total_questions}* 👏\n"
+            f"لقد استغرقت *{int(total_time // 60)}* دقيقة و*{int(total_time % 60)}* ثانية. ⏱️\n"
+            f"*إليك بعض الملاحظات حول مستواك وطرق التحسين:*\n{feedback_text}",
+            parse_mode="Markdown",
         )
-    except Exception as e:
-        logger.error(f"Error updating level determination in database: {e}")
-        # Handle the error, e.g., log and potentially inform the user
-
-    # Check if pdf_filepath is valid before trying to open it
-    if pdf_filepath and os.path.exists(pdf_filepath):
-        with open(pdf_filepath, "rb") as f:
-            await context.bot.send_document(
-                chat_id=update.effective_chat.id, document=f
-            )
-    else:
-        logger.error("PDF file path is None or file does not exist.")
-        await update.effective_message.reply_text("تعذر العثور على ملف PDF. ⚠️")
 
-    return ConversationHandler.END
+        if QUIZ_PDF_ON_DEMAND:
+            # Rendered from the stored answers if the user asks for it
+            await update.effective_message.reply_text(
+                "يمكنك تحميل ملف PDF للاختبار في أي وقت. 📄",
+                reply_markup=InlineKeyboardMarkup(
+                    [
+                        [
+                            InlineKeyboardButton(
+                                "تحميل ملف PDF ⬇️",
+                                callback_data=f"download_pdf_{level_determination_id}",
+                            )
+                        ]
+                    ]
+                ),
+            )
+            return ConversationHandler.END
 
+        # The PDF is generated by the document job queue, which attaches it to
+        # the level_determinations entry and sends it to the chat when ready
+        _, position = await document_jobs.enqueue(
+            LEVEL_REPORT_JOB,
+            {
+                "level_determination_id": level_determination_id,
+                "user_id": user_id,
+                "question_ids": [question.id for question in questions],
+            },
+            user_id=user_id,
+            chat_id=update.effective_chat.id,
+        )
+        await update.effective_message.reply_text(
+            document_jobs.queue_position_message(position)
+        )
 
-async def get_question_category_and_type(question_id: int):
-    """Fetches the category name and question type for a given question."""
-    query = """
-    SELECT main_categories.name, questions.question_type
-    FROM questions
-    JOIN main_categories ON questions.main_category_id = main_categories.id
-    WHERE questions.id = ?
-    """
-    try:
-        result = await asyncio.to_thread(get_data, query, (question_id,))
-        if result:
-            category_name, question_type = result[0]
-            return category_name, question_type
-        return "Unknown", "Unknown"
+        return ConversationHandler.END
     except Exception as e:
-        logger.error(f"Error fetching question details: {e}")
-        return "Unknown", "Unknown"
+        logger.error(f"Error in end_quiz: {e}")
+        await update.effective_message.reply_text(
+            "حدث خطأ أثناء إنهاء الاختبار، يرجى المحاولة مرة أخرى."
+        )
+    finally:
+        evict_quiz_session(context.user_data)
 
 
 async def generate_feedback_with_chatgpt(
@@ -687,7 +628,7 @@ async def track_progress(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
 
     try:
-        level_determinations = get_data(
+        level_determinations = await async_database.get_data(
             "SELECT * FROM level_determinations WHERE user_id = ?", (user_id,)
         )
     except Exception as e:
@@ -739,7 +680,7 @@ async def show_level_details(update: Update, context: CallbackContext):
         return
 
     try:
-        level_determination = get_data(
+        level_determination = await async_database.get_data(
             "SELECT * FROM level_determinations WHERE id = ?",
             (level_determination_id,),
         )
@@ -765,7 +706,8 @@ async def show_level_details(update: Update, context: CallbackContext):
         f"الوقت المستغرق: {int(time_taken // 60)} دقيقة و {int(time_taken % 60)} ثانية. ⏱️\n"
     )
 
-    if pdf_path:
+    # With on-demand PDFs the file is only rendered when first downloaded
+    if pdf_path or QUIZ_PDF_ON_DEMAND:
         keyboard = [
             [
                 InlineKeyboardButton(
@@ -797,7 +739,7 @@ async def download_pdf(update: Update, context: CallbackContext):
         return
 
     try:
-        result = get_data(
+        result = await async_database.get_data(
             "SELECT pdf_path FROM level_determinations WHERE id = ?",
             (level_determination_id,),
         )
@@ -806,12 +748,16 @@ async def download_pdf(update: Update, context: CallbackContext):
         await query.message.reply_text("حدث خطأ أثناء جلب ملف PDF. ⚠️")
         return
 
-    if result:
+    if QUIZ_PDF_ON_DEMAND and not (
+        result and result[0][0] and os.path.exists(result[0][0])
+    ):
+        await queue_level_pdf(update, level_determination_id)
+    elif result:
         pdf_path = result[0][0]
         try:
-            with open(pdf_path, "rb") as f:
+            with open_report(pdf_path) as (f, filename):
                 await context.bot.send_document(
-                    chat_id=query.message.chat_id, document=f
+                    chat_id=query.message.chat_id, document=f, filename=filename
                 )
         except Exception as e:
             logger.error(f"Error sending PDF: {e}")
@@ -820,6 +766,30 @@ async def download_pdf(update: Update, context: CallbackContext):
         await query.message.reply_text("لم يتم العثور على ملف PDF لهذا الاختبار. ⚠️")
 
 
+async def queue_level_pdf(update: Update, level_determination_id: int):
+    """Queues the first rendering of a level determination's PDF from its stored answers."""
+    query = update.callback_query
+    question_ids = await async_database.run(
+        stored_question_ids, "level", level_determination_id
+    )
+    if not question_ids:
+        await query.message.reply_text("لم يتم العثور على ملف PDF لهذا الاختبار. ⚠️")
+        return
+    user_id = update.effective_user.id
+    # The job sends the file and caches its path in level_determinations
+    _, position = await document_jobs.enqueue(
+        LEVEL_REPORT_JOB,
+        {
+            "level_determination_id": level_determination_id,
+            "user_id": user_id,
+            "question_ids": question_ids,
+        },
+        user_id=user_id,
+        chat_id=query.message.chat_id,
+    )
+    await query.message.reply_text(document_jobs.queue_position_message(position))
+
+
 LEVEL_DETERMINATION_HANDLERS = {
     "level_determination": handle_level_determination,
     "test_current_level": handle_test_current_level,
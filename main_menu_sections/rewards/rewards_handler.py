@@ -8,10 +8,10 @@ from telegram import (
     InlineKeyboardButton,
 )
 from telegram.ext import CallbackContext
-import openpyxl
 import logging
 
 from config import REWARDS_DAILY_GIFTS, REWARDS_EXCEL
+from utils import content_bundle
 from utils.database import execute_query, get_data
 from utils.subscription_management import check_subscription
 
@@ -210,7 +210,7 @@ async def generate_reward_messages(user_stats):
     reward_messages = []
 
     try:
-        workbook = openpyxl.load_workbook(REWARDS_EXCEL)
+        workbook = content_bundle.load_workbook(REWARDS_EXCEL)
         rewards_sheet = workbook.active
 
         # Get target and reward text from the SECOND row (index 1)
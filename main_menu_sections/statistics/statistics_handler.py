@@ -7,7 +7,7 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 import arabic_reshaper
 from bidi.algorithm import get_display
-from utils.database import get_data
+from utils import async_database
 
 
 async def handle_statistics(update: Update, context: CallbackContext):
@@ -33,9 +33,8 @@ async def handle_statistics(update: Update, context: CallbackContext):
 
 async def handle_performance_statistics(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-
     # Fetch level determination data
-    level_determination_data = get_data(
+    level_determination_data = await async_database.get_data(
         """
         SELECT percentage, time_taken, timestamp
         FROM level_determinations
@@ -47,7 +46,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     )
 
     # Fetch previous tests data
-    previous_tests_data = get_data(
+    previous_tests_data = await async_database.get_data(
         """
         SELECT score, time_taken, timestamp
         FROM previous_tests
@@ -59,7 +58,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     )
 
     # Fetch main category performance
-    main_category_performance = get_data(
+    main_category_performance = await async_database.get_data(
         """
         SELECT mc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
         FROM user_answers ua
@@ -73,7 +72,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
     )
 
     # Fetch subcategory performance
-    subcategory_performance = get_data(
+    subcategory_performance = await async_database.get_data(
         """
         SELECT sc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
         FROM user_answers ua
@@ -176,7 +175,7 @@ async def handle_performance_statistics(update: Update, context: CallbackContext
 
 async def handle_main_categories_details(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    main_category_performance = get_data(
+    main_category_performance = await async_database.get_data(
         """
         SELECT mc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
         FROM user_answers ua
@@ -210,7 +209,7 @@ async def handle_main_categories_details(update: Update, context: CallbackContex
 
 async def handle_subcategories_details(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
-    subcategory_performance = get_data(
+    subcategory_performance = await async_database.get_data(
         """
         SELECT sc.name, AVG(ua.is_correct) as avg_correct, COUNT(ua.id) as total_questions
         FROM user_answers ua
@@ -260,7 +259,7 @@ async def handle_progress_graph(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
 
     # Fetch data for both level determinations and previous tests
-    level_determination_scores = get_data(
+    level_determination_scores = await async_database.get_data(
         """
         SELECT timestamp, percentage, num_questions
         FROM level_determinations
@@ -270,7 +269,7 @@ async def handle_progress_graph(update: Update, context: CallbackContext):
         (user_id,),
     )
 
-    previous_tests_scores = get_data(
+    previous_tests_scores = await async_database.get_data(
         """
         SELECT timestamp, score, num_questions
         FROM previous_tests
@@ -1,5 +1,4 @@
 from datetime import datetime, timedelta
-import sqlite3
 import openpyxl
 from telegram import (
     KeyboardButton,
@@ -17,7 +16,7 @@ from telegram.ext import (
     filters,
     CommandHandler,
 )
-from config import DATABASE_FILE
+from utils import database
 from utils.subscription_management import (
     SERIAL_CODE_DATA,
     activate_free_trial,
@@ -193,14 +192,10 @@ async def handle_confirm_cancel(update: Update, context: CallbackContext):
     """Handles the cancellation confirmation (if user confirms)."""
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
+    database.execute_query(
         "UPDATE users SET subscription_end_time = NULL WHERE telegram_id = ?",
         (user_id,),
     )
-    conn.commit()
-    conn.close()
     await update.callback_query.edit_message_text("تم إلغاء اشتراكك بنجاح ✅.")
 
 
@@ -257,13 +252,10 @@ async def handle_serial_code(update: Update, context: CallbackContext):
         return ConversationHandler.END  # End the conversation
 
     # 3. Update user's subscription
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
-    cursor.execute(
+    rows = database.get_data(
         "SELECT subscription_end_time FROM users WHERE telegram_id = ?", (user_id,)
     )
-    row = cursor.fetchone()
+    row = rows[0] if rows else None
     if row and row[0]:
         current_end_date = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
         new_end_date = current_end_date + timedelta(
@@ -274,7 +266,7 @@ async def handle_serial_code(update: Update, context: CallbackContext):
             days=30 * code_data["duration_months"]
         )
 
-    cursor.execute(
+    database.execute_query(
         "UPDATE users SET subscription_end_time = ?, type_of_last_subscription = ? WHERE telegram_id = ?",
         (
             new_end_date.strftime("%Y-%m-%d %H:%M:%S"),
@@ -282,8 +274,6 @@ async def handle_serial_code(update: Update, context: CallbackContext):
             user_id,
         ),
     )
-    conn.commit()
-    conn.close()
 
     await update.message.reply_text(
         f"تم تفعيل اشتراكك بنجاح لمدة {code_data['duration_months']} شهر! 🎉"
@@ -344,11 +334,10 @@ async def handle_earn_subscription_referral(update: Update, context: CallbackCon
     """Handles the 'اكسب اشتراكا عبر دعوة غيرك' sub-option."""
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT referral_code FROM users WHERE telegram_id = ?", (user_id,))
-    referral_code = cursor.fetchone()
-    conn.close()
+    rows = database.get_data(
+        "SELECT referral_code FROM users WHERE telegram_id = ?", (user_id,)
+    )
+    referral_code = rows[0] if rows else None
 
     if referral_code:
         await update.callback_query.message.reply_text(
@@ -1,13 +1,17 @@
 import logging
 from docxtpl import DocxTemplate
 from docx2pdf import convert
-import subprocess
 import os
 from datetime import datetime
-import shutil
 
-from config import Q_AND_A_FILE_PATH
-from utils import database
+from config import CONTEXT_DIRECTORY, Q_AND_A_FILE_PATH
+from utils import document_jobs
+from utils.category_mangement import category_directory
+from utils.office_pool import office_pool
+from utils.passage_store import get_passage_store
+from utils.question_bank import question_bank
+from utils.quiz_report import native_renderer_enabled, render_quiz_report
+from utils.report_storage import user_directory
 #import pypandoc
 logger = logging.getLogger(__name__)
 
@@ -16,47 +20,32 @@ def generate_quiz_pdf(questions, user_id, category_name=None):
     """
     Generates a PDF quiz with the given questions using a Word template.
     Args:
-        questions (list): A list of tuples, each containing question data.
+        questions (list): The Question records of the quiz.
     """
     try:
-        # 1. Create the directory structure
-        base_dir = "user_tests"
-        user_dir = os.path.join(base_dir, str(user_id))
-        os.makedirs(user_dir, exist_ok=True)  # Create if it doesn't exist
+        # 1. The user's (sharded) report directory
+        user_dir = user_directory(user_id)
 
         # 2. Prepare the data for the Word template
         quiz_data = []
-        for i, question_data in enumerate(questions):
-            (
-                question_id,
-                correct_answer,
-                question_text,
-                option_a,
-                option_b,
-                option_c,
-                option_d,
-                explanation,
-                main_category_id,
-                question_type,
-                image_path,
-                passage_name,
-                *_,  # Ignore unused elements
-            ) = question_data
-            main_category_name = database.get_data(
-                "SELECT name FROM main_categories WHERE id = ?", (main_category_id,)
-            )
-
+        for i, question in enumerate(questions):
             quiz_data.append(
                 {
                     "QuestionNumber": i + 1,
-                    "QuestionText": question_text,
-                    "MainCategoryName": main_category_name[0][0],
-                    "OptionA": option_a,
-                    "OptionB": option_b,
-                    "OptionC": option_c,
-                    "OptionD": option_d,
-                    "CorrectAnswer": correct_answer,
-                    "Explanation": explanation,
+                    "QuestionId": question.id,
+                    "QuestionText": question.question_text,
+                    "MainCategoryName": category_directory.main_category_name(
+                        question.main_category_id
+                    ),
+                    "OptionA": question.option_a,
+                    "OptionB": question.option_b,
+                    "OptionC": question.option_c,
+                    "OptionD": question.option_d,
+                    "CorrectAnswer": question.correct_answer,
+                    "Explanation": question.explanation,
+                    "PassageText": get_passage_store(CONTEXT_DIRECTORY).get(
+                        question.passage_name
+                    ),
                 }
             )
 
@@ -68,12 +57,19 @@ def generate_quiz_pdf(questions, user_id, category_name=None):
             user_dir, f"الاختبار_يوم_{datestamp}_الوقت_{timestamp}.pdf"
         )
 
-        generate_word_doc(Q_AND_A_FILE_PATH, word_filename, quiz_data)
-        convert_to_pdf(word_filename, pdf_filename)
+        if native_renderer_enabled():
+            try:
+                return render_quiz_report(quiz_data, pdf_filename)
+            except Exception as e:
+                logger.error(f"Native PDF rendering failed, using the Word template: {e}")
 
-        # 5. Cleanup the temporary Word file
-        if os.path.exists(word_filename):
-            os.remove(word_filename)
+        try:
+            generate_word_doc(Q_AND_A_FILE_PATH, word_filename, quiz_data)
+            convert_to_pdf(word_filename, pdf_filename)
+        finally:
+            # 5. Cleanup the temporary Word file, also when the conversion failed
+            if os.path.exists(word_filename):
+                os.remove(word_filename)
 
         return pdf_filename
     except Exception as e:
@@ -81,6 +77,17 @@ def generate_quiz_pdf(questions, user_id, category_name=None):
         return None
 
 
+def render_test_report_job(payload):
+    """Renders a queued test report (see ``TEST_REPORT_JOB``)."""
+    questions = question_bank.get_questions(payload["question_ids"])
+    return generate_quiz_pdf(questions, payload["user_id"], payload["category_name"])
+
+
+# Queued by tests_handler.end_quiz; the file is attached to previous_tests
+TEST_REPORT_JOB = "test_report"
+document_jobs.register(TEST_REPORT_JOB, render_test_report_job, "previous_tests", "test_id")
+
+
 def generate_word_doc(template_path, output_path, quiz_data):
     """Generates the Word document."""
     try:
@@ -100,25 +107,7 @@ def convert_to_pdf_using_pandoc(word_file, pdf_file):
         raise
 
 def convert_to_pdf(word_file, pdf_file=None):
-    # Set default output name if pdf_file is not specified
-    if pdf_file is None:
-        pdf_file = os.path.splitext(word_file)[0] + ".pdf"
-    
-    # Set a temporary directory for the output to handle custom names
-    temp_dir = os.path.dirname(pdf_file)
-    temp_pdf_path = os.path.join(temp_dir, os.path.splitext(os.path.basename(word_file))[0] + ".pdf")
-    
-    # Run the LibreOffice command to convert to PDF in temp directory
-    result = subprocess.run([
-        "libreoffice", "--headless", "--convert-to", "pdf", "--outdir",
-        temp_dir, word_file
-    ], check=True)
-    
-    # Rename to the specified pdf_file name if it differs from temp_pdf_path
-    if os.path.exists(temp_pdf_path):
-        if temp_pdf_path != pdf_file:
-            shutil.move(temp_pdf_path, pdf_file)
-        print(f"Conversion successful: {pdf_file}")
-        return pdf_file
-    else:
-        raise FileNotFoundError("PDF conversion failed.")
\ No newline at end of file
+    # Converted by one of the long-lived LibreOffice workers
+    pdf_file = office_pool.convert_to_pdf(word_file, pdf_file)
+    print(f"Conversion successful: {pdf_file}")
+    return pdf_file
\ No newline at end of file
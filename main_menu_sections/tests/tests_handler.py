@@ -1,10 +1,8 @@
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
-import random
 from datetime import datetime, timedelta
-from typing import Dict, List, Tuple
+from typing import Dict, List
 
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.error import BadRequest
@@ -17,20 +15,24 @@ from telegram.ext import (
     filters,
 )
 
-from config import CONTEXT_DIRECTORY, UNDER_DEVLOPING_MESSAGE
+from config import AI_EXPLANATIONS_PER_TEST, QUIZ_PDF_ON_DEMAND, UNDER_DEVLOPING_MESSAGE
 from handlers.main_menu_handler import main_menu_handler
-from handlers.personal_assistant_chat_handler import chatgpt, SYSTEM_MESSAGE
-from main_menu_sections.tests.pdf_generator import generate_quiz_pdf
-from utils import database
-from utils.question_management import get_passage_content, get_questions_by_category
+from AIModels.chatgpt import get_chatgpt_instance
+from AIModels.explanations import get_explanation
+from handlers.personal_assistant_chat_handler import SYSTEM_MESSAGE
+from main_menu_sections.tests.pdf_generator import TEST_REPORT_JOB
+from utils import async_database, database, document_jobs
+from utils.quiz_deadlines import evict_quiz_session, schedule_quiz_deadline
+from utils.quiz_log import QuizAnswerLog, finalize_quiz, stored_question_ids
+from utils.category_mangement import category_directory
+from utils.question_bank import question_bank
+from utils.question_management import get_questions_by_category
+from utils.quiz_rendering import prerender_quiz
+from utils.report_storage import open_report, user_directory
 from utils.subscription_management import check_subscription
 from utils.user_management import (
     calculate_points,
-    update_user_created_questions,
-    update_user_points,
-    update_user_usage_time,
 )
-import pythoncom
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -50,10 +52,7 @@ logger = logging.getLogger(__name__)
 CATEGORIES_PER_PAGE = 10
 CHATTING = 0
 
-
-executor = ThreadPoolExecutor(
-    max_workers=2, initializer=pythoncom.CoInitialize
-)
+chatgpt = get_chatgpt_instance(section="tests")
 
 async def handle_tests(update: Update, context: CallbackContext):
     """Handles the 'الاختبارات' option and displays its sub-menu."""
@@ -158,7 +157,7 @@ async def handle_show_main_categories(
     try:
         quiz_type = context.user_data.get("quiz_type", "quantitative")
 
-        main_categories = database.get_data(
+        main_categories = await async_database.get_data(
             """
             SELECT DISTINCT mc.id, mc.name 
             FROM main_categories mc
@@ -170,14 +169,16 @@ async def handle_show_main_categories(
         )
 
         # Get the total count for pagination
-        total_categories = database.get_data(
-            """
-            SELECT COUNT(DISTINCT mc.id)
-            FROM main_categories mc
-            JOIN questions q ON mc.id = q.main_category_id
-            WHERE q.question_type = ?
-            """,
-            (quiz_type,),
+        total_categories = (
+            await async_database.get_data(
+                """
+                SELECT COUNT(DISTINCT mc.id)
+                FROM main_categories mc
+                JOIN questions q ON mc.id = q.main_category_id
+                WHERE q.question_type = ?
+                """,
+                (quiz_type,),
+            )
         )[0][0]
 
         total_pages = (
@@ -240,12 +241,14 @@ async def handle_show_subcategories(
 ):
     """Displays a paginated list of subcategories."""
     try:
-        subcategories = database.get_data(
+        subcategories = await async_database.get_data(
             "SELECT id, name FROM subcategories LIMIT ? OFFSET ?",
             (CATEGORIES_PER_PAGE, (page - 1) * CATEGORIES_PER_PAGE),
         )
 
-        total_categories = database.get_data("SELECT COUNT(*) FROM subcategories")[0][0]
+        total_categories = (
+            await async_database.get_data("SELECT COUNT(*) FROM subcategories")
+        )[0][0]
         total_pages = (
             total_categories + CATEGORIES_PER_PAGE - 1
         ) // CATEGORIES_PER_PAGE
@@ -411,8 +414,12 @@ async def start_quiz(update: Update, context: CallbackContext):
         category_type = context.user_data["category_type"]
 
         # Retrieve questions based on category type (main or sub)
-        questions = get_questions_by_category(
-            category_id, num_questions, category_type, context.user_data["quiz_type"]
+        questions = await async_database.run(
+            get_questions_by_category,
+            category_id,
+            num_questions,
+            category_type,
+            context.user_data["quiz_type"],
         )
         if not questions:
             logger.error(
@@ -423,13 +430,18 @@ async def start_quiz(update: Update, context: CallbackContext):
             )
             return ConversationHandler.END
 
-        context.user_data["questions"] = questions
+        # Sessions keep only ids; the records are shared by the question bank
+        context.user_data["questions"] = [question.id for question in questions]
+        # Render every question now so answering only has to send the next one
+        context.user_data["rendered_questions"] = await asyncio.to_thread(
+            prerender_quiz, questions, "*{number}.*"
+        )
         context.user_data["current_question"] = 0
         context.user_data["score"] = 0
         context.user_data["start_time"] = datetime.now()
 
         # Create a new entry in the previous_tests table using database function
-        previous_test_id = database.execute_query_return_id(
+        previous_test_id = await async_database.execute_query_return_id(
             """
             INSERT INTO previous_tests (user_id, timestamp, num_questions, score, time_taken, pdf_path) 
             VALUES (?, ?, ?, 0, 0, '')
@@ -438,6 +450,9 @@ async def start_quiz(update: Update, context: CallbackContext):
         )
 
         context.user_data["previous_test_id"] = previous_test_id  # Store in user_data
+        # Answers stay in memory until end_quiz commits them in one go
+        context.user_data["answer_log"] = QuizAnswerLog("test", previous_test_id, user_id)
+        context.user_data["quiz_active"] = True
 
         await update.message.reply_text(
             "سيتم بدأ الاختبار 🏁.\n"
@@ -465,56 +480,20 @@ async def send_question(update: Update, context: CallbackContext):
     current_question_index = context.user_data["current_question"]
 
     if current_question_index < len(questions):
-        question_data = questions[current_question_index]
-        (
-            question_id,
-            correct_answer,
-            question_text,
-            option_a,
-            option_b,
-            option_c,
-            option_d,
-            explanation,
-            main_category_id,
-            question_type,
-            image_path,
-            passage_name,
-        ) = question_data
-        passage_content = ""
-        if passage_name != "-":
-            passage_content = get_passage_content(CONTEXT_DIRECTORY, passage_name)
-
-        passage_text = f"النص: {passage_content}\n\n" if passage_content else ""
-        # Create a list of answer options and shuffle them
-        answer_options = [
-            (f"أ. {option_a}", f"answer_{question_id}_أ"),
-            (f"ب. {option_b}", f"answer_{question_id}_ب"),
-            (f"ج. {option_c}", f"answer_{question_id}_ج"),
-            (f"د. {option_d}", f"answer_{question_id}_د"),
-        ]
-        random.shuffle(answer_options)
-
-        # Create the keyboard with shuffled options
-        keyboard = []
-        for i in range(0, len(answer_options), 2):  # Create rows of 2 buttons
-            row = [
-                InlineKeyboardButton(text, callback_data=data)
-                for text, data in answer_options[i : i + 2]
-            ]
-            keyboard.append(row)
-
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Text and shuffled keyboard were rendered when the quiz started
+        rendered = context.user_data["rendered_questions"][current_question_index]
         try:
             if current_question_index == 0:
-                await update.effective_message.reply_text(
-                    f"{passage_text}" f"*{current_question_index+1}.* {question_text}",
-                    reply_markup=reply_markup,
+                message = await update.effective_message.reply_text(
+                    rendered.text, reply_markup=rendered.reply_markup
                 )
             else:
-                await update.effective_message.edit_text(
-                    f"{passage_text}" f"*{current_question_index+1}.* {question_text}",
-                    reply_markup=reply_markup,
+                message = await update.effective_message.edit_text(
+                    rendered.text, reply_markup=rendered.reply_markup
                 )
+            # The deadline timer ends the quiz on this message if the user stops answering
+            context.user_data["quiz_message"] = message
+            schedule_quiz_deadline(update, context, expire_quiz)
         except Exception as e:
             logger.error(f"Error sending question: {e}")
             await update.effective_message.reply_text(
@@ -528,6 +507,11 @@ async def send_question(update: Update, context: CallbackContext):
 
 async def handle_answer(update: Update, context: CallbackContext):
     """Handles answer button presses, checks answers, and sends the next question."""
+    # A tap on a quiz that already ended (deadline, or a double tap on the last question)
+    if not context.user_data.get("quiz_active"):
+        await update.callback_query.answer(text="انتهى هذا الاختبار. ⏱️", show_alert=True)
+        return ConversationHandler.END
+
     # Check if time limit is reached
     if (
         "end_time" in context.user_data
@@ -553,32 +537,23 @@ async def handle_answer(update: Update, context: CallbackContext):
     # Get the question data
     questions = context.user_data["questions"]
     current_question_index = context.user_data["current_question"]
-    question_data = questions[current_question_index]
-    question_text = question_data[2]
+    question = await question_bank.get_async(questions[current_question_index])
+    question_text = question.question_text
     max_question_length = 100
     truncated_question_text = (
         question_text[:max_question_length] + "..."
         if len(question_text) > max_question_length
         else question_text
     )
-    correct_answer = question_data[1]
-    is_correct = user_answer.upper() == correct_answer.upper()
-
-    previous_test_id = context.user_data["previous_test_id"]
-
-    # Record the answer, including the previous_test_id
-    await record_user_answer(
-        user_id,
-        question_id,
-        user_answer,
-        is_correct,
-        previous_test_id,
-    )
+    correct_answer = question.correct_answer
+    is_correct = question.is_correct(user_answer)
 
+    # Buffer the answer; it is written to the database when the quiz ends
+    context.user_data["answer_log"].record(question_id, user_answer, is_correct)
 
     if is_correct:
         context.user_data["score"] += 1
-        correct_option_text = get_option_text(question_data, correct_answer)
+        correct_option_text = question.option_text(correct_answer)
 
         await query.answer(
             text=f"إجابة صحيحة! ✅ \n"
@@ -587,8 +562,8 @@ async def handle_answer(update: Update, context: CallbackContext):
             show_alert=True,
         )
     else:
-        correct_option_text = get_option_text(question_data, correct_answer)
-        user_answer_text = get_option_text(question_data, user_answer)
+        correct_option_text = question.option_text(correct_answer)
+        user_answer_text = question.option_text(user_answer)
 
         await query.answer(
             text=f"إجابة خاطئة ❌ \n"
@@ -603,64 +578,37 @@ async def handle_answer(update: Update, context: CallbackContext):
     await send_question(update, context)
 
 
-async def record_user_answer(
-    user_id: int,
-    question_id: int,
-    user_answer: str,
-    is_correct: bool,
-    previous_test_id: int,
-):
-    """Records the user's answer to a question."""
-    try:
-        database.execute_query(
-            """
-            INSERT INTO user_answers (user_id, question_id, user_answer, is_correct, previous_tests_id)
-            VALUES (?, ?, ?, ?, ?)
-            """,
-            (user_id, question_id, user_answer, is_correct, previous_test_id),
-        )
-    except Exception as e:
-        logger.error(
-            f"Error recording user answer for user_id: {user_id}, question_id: {question_id}, previous_test_id: {previous_test_id}: {e}"
-        )
-
-
-def get_option_text(question_data: Tuple, correct_answer: str) -> str:
-    """Helper function to get the text of the correct option."""
-    if correct_answer == "أ":
-        return question_data[3]  # option_a
-    elif correct_answer == "ب":
-        return question_data[4]  # option_b
-    elif correct_answer == "ج":
-        return question_data[5]  # option_c
-    elif correct_answer == "د":
-        return question_data[6]  # option_d
-    else:
-        return "غير محدد"
+async def expire_quiz(update: Update, context: CallbackContext):
+    """Ends a quiz whose deadline passed while the user was not answering."""
+    await end_quiz(update, context)
+    await handle_final_step(update, context)
 
 
 async def end_quiz(update: Update, context: CallbackContext):
     """Calculates the score and ends the quiz."""
+    # Both the deadline timer and the user's last tap can get here; only the first ends it
+    if not context.user_data.pop("quiz_active", False):
+        return ConversationHandler.END
     try:
         end_time = datetime.now()
         start_time = context.user_data["start_time"]
         total_time = (end_time - start_time).total_seconds()  # Time in seconds
         score = context.user_data["score"]
         total_questions = len(context.user_data["questions"])
-
-        questions = context.user_data["questions"]
         user_id = update.effective_user.id
         previous_test_id = context.user_data["previous_test_id"]
 
-        # Update user's total usage time in the database
-        update_user_usage_time(user_id, total_time)
-
-        # Update user's total created questions in the database
-        update_user_created_questions(user_id, total_questions)
-
-        # Calculate and award points
+        # Calculate points, then commit the answers, the user's counters
+        # and the test row in a single transaction
         points_earned = calculate_points(total_time, score, total_questions)
-        update_user_points(user_id, points_earned)
+        await async_database.run(
+            finalize_quiz,
+            context.user_data["answer_log"],
+            total_time,
+            total_questions,
+            points_earned,
+            {"score": score, "time_taken": total_time},
+        )
 
         if (
             "end_time" in context.user_data
@@ -674,67 +622,55 @@ async def end_quiz(update: Update, context: CallbackContext):
             f"لقد حصلت على {score} من {total_questions} 👏\n"
             f"لقد استغرقت {int(total_time // 60)} دقيقة و{int(total_time % 60)} ثانية. ⏱️"
         )
-        await update.effective_message.reply_text(
-            "انتظر قليلا جاري إنشاء ملف pdf... 📄"
-        )
+
+        if QUIZ_PDF_ON_DEMAND:
+            # Rendered from the stored answers if the user asks for it
+            await update.effective_message.reply_text(
+                "يمكنك تحميل ملف PDF للاختبار في أي وقت. 📄",
+                reply_markup=InlineKeyboardMarkup(
+                    [
+                        [
+                            InlineKeyboardButton(
+                                "تحميل ملف PDF ⬇️",
+                                callback_data=f"download_pdf:{previous_test_id}",
+                            )
+                        ]
+                    ]
+                ),
+            )
+            return ConversationHandler.END
 
         category_id = context.user_data["category_id"]
         category_type = context.user_data["category_type"]
 
         if category_type == "main_category_id":
-            category_name = database.get_data(
-                "SELECT name FROM main_categories WHERE id = ?", (category_id,)
-            )[0][
-                0
-            ]  # Access the first element of the tuple and then the first element of the list
+            category_name = await async_database.run(
+                category_directory.main_category_name, category_id
+            )
         elif category_type == "sub_category_id":
-            category_name = database.get_data(
-                "SELECT name FROM subcategories WHERE id = ?", (category_id,)
-            )[0][
-                0
-            ]  # Access the first element of the tuple and then the first element of the list
+            category_name = await async_database.run(
+                category_directory.subcategory_name, category_id
+            )
         else:
             logger.error(f"Invalid category_type: {category_type}")
             category_name = "غير محدد"
 
-        def generate_pdf_wrapper(questions, user_id, category_name):
-            try:
-                return generate_quiz_pdf(questions, user_id, category_name)
-            except Exception as e:
-                logger.error(f"Error generating PDF: {e}")
-                return None
-
-        loop = asyncio.get_running_loop()  # Get the event loop
-        pdf_filepath = await loop.run_in_executor(
-            executor, generate_pdf_wrapper, questions, user_id, category_name
+        # The PDF is generated by the document job queue, which attaches it
+        # to the previous_tests entry and sends it to the chat when ready
+        _, position = await document_jobs.enqueue(
+            TEST_REPORT_JOB,
+            {
+                "test_id": previous_test_id,
+                "user_id": user_id,
+                "question_ids": list(context.user_data["questions"]),
+                "category_name": category_name,
+            },
+            user_id=user_id,
+            chat_id=update.effective_chat.id,
+        )
+        await update.effective_message.reply_text(
+            document_jobs.queue_position_message(position)
         )
-
-        if pdf_filepath is None:  # Check if PDF generation failed
-            await update.effective_message.reply_text("حدث خطأ أثناء إنشاء ملف PDF. ⚠️")
-
-        try:
-            # Update the previous_tests entry using database function
-            database.execute_query(
-                """
-                UPDATE previous_tests
-                SET score = ?, time_taken = ?, pdf_path = ?
-                WHERE id = ?
-                """,
-                (score, total_time, pdf_filepath, previous_test_id),
-            )
-
-        except Exception as e:
-            logger.error(f"Error updating level determination in database: {e}")
-        
-        # Check if pdf_filepath is valid before trying to open it
-        if pdf_filepath and os.path.exists(pdf_filepath):
-            with open(pdf_filepath, "rb") as f:
-                await context.bot.send_document(
-                    chat_id=update.effective_chat.id, document=f
-                )
-        else:
-            logger.error("PDF file path is None or file does not exist.")
-            await update.effective_message.reply_text("تعذر العثور على ملف PDF. ⚠️")
 
         return ConversationHandler.END
     except Exception as e:
@@ -742,6 +678,9 @@ async def end_quiz(update: Update, context: CallbackContext):
         await update.effective_message.reply_text(
             "حدث خطأ أثناء إنهاء الاختبار، يرجى المحاولة مرة أخرى."
         )
+    finally:
+        evict_quiz_session(context.user_data)
+
 
 async def store_test_data(
     update: Update, context: CallbackContext, total_time: float, score: int
@@ -750,12 +689,13 @@ async def store_test_data(
     user_id = update.effective_user.id
     num_questions = context.user_data["num_questions"]
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    test_number = len(os.listdir(f"user_tests/{user_id}")) + 1
+    user_dir = user_directory(user_id)
+    test_number = len(os.listdir(user_dir)) + 1
 
-    filepath = f"user_tests/{user_id}/{test_number}_{timestamp}.pdf"
-    answers_path = f"user_tests/{user_id}/{test_number}_{timestamp}.txt"
+    filepath = os.path.join(user_dir, f"{test_number}_{timestamp}.pdf")
+    answers_path = os.path.join(user_dir, f"{test_number}_{timestamp}.txt")
     try:
-        database.execute_query(
+        await async_database.execute_query(
             """
             INSERT INTO previous_tests (user_id, timestamp, num_questions, score, time_taken, pdf_path, answers_path)
             VALUES (?, ?, ?, ?, ?, ?, ?)
@@ -799,18 +739,61 @@ async def handle_ai_assistance_no(update: Update, context: CallbackContext):
     return ConversationHandler.END
 
 
+def wrong_answer_explanations(test_id: int):
+    """Returns ``[(question, user answer, explanation)]`` for a test's explained mistakes."""
+    rows = database.get_data(
+        """
+        SELECT question_id, user_answer FROM user_answers
+        WHERE previous_tests_id = ? AND is_correct = 0 ORDER BY id
+        """,
+        (test_id,),
+    )
+    explained = []
+    for question_id, user_answer in rows:
+        explanation = get_explanation(question_id, user_answer)
+        if explanation:
+            explained.append((question_bank.get(question_id), user_answer, explanation))
+        if len(explained) == AI_EXPLANATIONS_PER_TEST:
+            break
+    return explained
+
+
 async def handle_ai_assistance_yes(update: Update, context: CallbackContext):
     """Handles the 'yes' choice for AI assistance."""
     await update.callback_query.answer()
-    await update.callback_query.edit_message_text(
-        "تفضل، كيف يمكنني مساعدتك في أسئلة الاختبار؟ 💬"
-    )
 
     # Start AI assistance chat
     user_id = update.effective_user.id
     messages = await chatgpt.get_chat_history(user_id)
     context.user_data["messages"] = messages
 
+    # The explanations of the wrong answers are ready; the chat is for follow-ups
+    test_id = context.user_data.get("previous_test_id")
+    explained = await async_database.run(wrong_answer_explanations, test_id) if test_id else []
+    if explained:
+        parts = [
+            f"❌ {question.question_text[:150]}\n"
+            f"إجابتك: {user_answer} - الإجابة الصحيحة: {question.correct_answer}\n"
+            f"{explanation}"
+            for question, user_answer, explanation in explained
+        ]
+        await update.callback_query.edit_message_text("شرح الأسئلة التي أخطأت فيها: 📖")
+        for part in parts:
+            await update.effective_message.reply_text(part[:4096])
+        await chatgpt.remember_turn(
+            user_id,
+            context,
+            [{"role": "assistant", "content": "\n\n".join(parts)}],
+            save_history=False,
+        )
+        await update.effective_message.reply_text(
+            "هل لديك أي استفسار آخر عن أسئلة الاختبار؟ 💬"
+        )
+    else:
+        await update.callback_query.edit_message_text(
+            "تفضل، كيف يمكنني مساعدتك في أسئلة الاختبار؟ 💬"
+        )
+
     return CHATTING
 
 
@@ -849,7 +832,7 @@ async def handle_list_previous_tests(update: Update, context: CallbackContext):
     user_id = update.effective_user.id
 
     # Retrieve test records using database function
-    test_records = database.get_data(
+    test_records = await async_database.get_data(
         "SELECT id, timestamp, score, num_questions FROM previous_tests WHERE user_id = ? ORDER BY timestamp DESC",
         (user_id,),
     )
@@ -894,7 +877,7 @@ async def handle_view_test_details(update: Update, context: CallbackContext):
         return
 
     # Retrieve test data using database function
-    test_data = database.get_data(
+    test_data = await async_database.get_data(
         """
         SELECT timestamp, num_questions, score, time_taken, pdf_path
         FROM previous_tests
@@ -950,15 +933,19 @@ async def download_test_pdf(update: Update, context: CallbackContext):
         return
 
     # Fetch the pdf_path using the test_id using database function
-    pdf_path = database.get_data(
+    pdf_path = await async_database.get_data(
         "SELECT pdf_path FROM previous_tests WHERE id = ?", (test_id,)
     )
 
-    if pdf_path and pdf_path[0][0]:
+    if QUIZ_PDF_ON_DEMAND and not (
+        pdf_path and pdf_path[0][0] and os.path.exists(pdf_path[0][0])
+    ):
+        await queue_test_pdf(update, test_id)
+    elif pdf_path and pdf_path[0][0]:
         try:
-            with open(pdf_path[0][0], "rb") as f:
+            with open_report(pdf_path[0][0]) as (f, filename):
                 await context.bot.send_document(
-                    chat_id=query.message.chat_id, document=f
+                    chat_id=query.message.chat_id, document=f, filename=filename
                 )
         except FileNotFoundError:
             logger.error(f"PDF file not found at path: {pdf_path[0][0]}")
@@ -974,6 +961,29 @@ async def download_test_pdf(update: Update, context: CallbackContext):
         await query.message.reply_text("لم يتم العثور على ملف PDF لهذا الاختبار. 😞")
 
 
+async def queue_test_pdf(update: Update, test_id: int):
+    """Queues the first rendering of a test's PDF from its stored answers."""
+    query = update.callback_query
+    question_ids = await async_database.run(stored_question_ids, "test", test_id)
+    if not question_ids:
+        await query.message.reply_text("لم يتم العثور على ملف PDF لهذا الاختبار. 😞")
+        return
+    user_id = update.effective_user.id
+    # The job sends the file and caches its path in previous_tests
+    _, position = await document_jobs.enqueue(
+        TEST_REPORT_JOB,
+        {
+            "test_id": test_id,
+            "user_id": user_id,
+            "question_ids": question_ids,
+            "category_name": None,
+        },
+        user_id=user_id,
+        chat_id=query.message.chat_id,
+    )
+    await query.message.reply_text(document_jobs.queue_position_message(position))
+
+
 # Dictionary to map handler names to functions
 TESTS_HANDLERS = {
     "tests": handle_tests,
@@ -8,7 +8,7 @@ This class provides methods for interacting with Excel workbooks, such as:
 - Reading the value of a specific cell.
 """
 
-import openpyxl
+from utils import content_bundle
 
 
 class ExcelHandler:
@@ -21,7 +21,7 @@ class ExcelHandler:
     def _load_workbook(self):
         """Loads the workbook from the file path."""
         try:
-            return openpyxl.load_workbook(self.file_path)
+            return content_bundle.load_workbook(self.file_path)
         except Exception as e:
             print(f"Error loading Excel file: {e}")
             return None
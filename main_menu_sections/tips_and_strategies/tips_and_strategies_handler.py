@@ -206,7 +206,7 @@ async def handle_solution_format(update: Update, context: CallbackContext) -> No
 # Conversation states
 CHATTING = 0
 
-chatgpt = get_chatgpt_instance()
+chatgpt = get_chatgpt_instance(section="tips")
 
 
 async def handle_request_specific_tips(update: Update, context: CallbackContext):
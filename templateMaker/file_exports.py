@@ -1,34 +1,37 @@
 from moviepy.editor import *
 from docx2pdf import convert
 from pdf2image import convert_from_path
-import subprocess
 import os
 import tempfile
 import cv2
 
+from utils import document_jobs
+from utils.office_pool import office_pool
+
 def convert_docx_to_pdf(word_file, pdf_file=None):
-    # Set default output name if pdf_file is not specified
-    if pdf_file is None:
-        pdf_file = os.path.splitext(word_file)[0] + ".pdf"
-    
-    # Set a temporary directory for the output to handle custom names
-    temp_dir = os.path.dirname(pdf_file)
-    temp_pdf_path = os.path.join(temp_dir, os.path.splitext(os.path.basename(word_file))[0] + ".pdf")
-    
-    # Run the LibreOffice command to convert to PDF in temp directory
-    result = subprocess.run([
-        "libreoffice", "--headless", "--convert-to", "pdf", "--outdir",
-        temp_dir, word_file
-    ], check=True)
-    
-    # Rename to the specified pdf_file name if it differs from temp_pdf_path
-    if os.path.exists(temp_pdf_path):
-        if temp_pdf_path != pdf_file:
-            shutil.move(temp_pdf_path, pdf_file)
-        print(f"Conversion successful: {pdf_file}")
-        return pdf_file
-    else:
-        raise FileNotFoundError("PDF conversion failed.")
+    # Converted by one of the long-lived LibreOffice workers
+    pdf_file = office_pool.convert_to_pdf(word_file, pdf_file)
+    print(f"Conversion successful: {pdf_file}")
+    return pdf_file
+
+
+# Template PDFs are converted by the document job queue, behind the users' reports
+TEMPLATE_PDF_JOB = "template_pdf"
+document_jobs.register(
+    TEMPLATE_PDF_JOB,
+    lambda payload: convert_docx_to_pdf(payload["word_file"], payload["pdf_file"]),
+)
+
+
+def queue_docx_to_pdf(word_file, pdf_file):
+    """Queues a batch Word to PDF conversion; returns the job id."""
+    job_id, _ = document_jobs.enqueue_job(
+        TEMPLATE_PDF_JOB,
+        {"word_file": word_file, "pdf_file": pdf_file},
+        priority=document_jobs.PRIORITY_BATCH,
+    )
+    document_jobs.document_jobs.wake()
+    return job_id
 
 def convert_pptx_to_mp4(pptx_path, mp4_path, fps=0.5, dpi=300, image_format="png"):
     """
@@ -49,15 +52,8 @@ def convert_pptx_to_mp4(pptx_path, mp4_path, fps=0.5, dpi=300, image_format="png
         pdf_filename = os.path.splitext(os.path.basename(pptx_path))[0] + ".pdf"
         pdf_path = os.path.join(temp_dir, pdf_filename)
         
-        # Run the LibreOffice command to convert PPTX to PDF
-        result = subprocess.run([
-            "libreoffice", "--headless", "--invisible", "--convert-to", "pdf",
-            "--outdir", temp_dir, pptx_path
-        ], check=True)
-        
-        # Check if the PDF was created successfully
-        if not os.path.exists(pdf_path):
-            raise FileNotFoundError("PDF conversion failed.")
+        # Convert PPTX to PDF on one of the LibreOffice workers
+        office_pool.convert_to_pdf(pptx_path, pdf_path)
         print(f"Converted PPTX to PDF: {pdf_path}")
         
         # Step 2: Convert PDF to images
@@ -13,7 +13,7 @@ from templateMaker.data_preparation import (
     load_powerpoint_template,
     read_excel_data,
 )
-from templateMaker.file_exports import convert_docx_to_pdf, convert_pptx_to_mp4
+from templateMaker.file_exports import convert_pptx_to_mp4, queue_docx_to_pdf
 from templateMaker.q_and_a_update import q_and_a_document
 
 
@@ -95,7 +95,7 @@ def create_folder_structure(df):
                     pdf_file_path = os.path.join(
                         model_folder, f"نموذج {model_number}.pdf"
                     )
-                    convert_docx_to_pdf(word_file_path, pdf_file_path)
+                    queue_docx_to_pdf(word_file_path, pdf_file_path)
 
                     # # if powerpoint_template:
 
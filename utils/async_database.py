@@ -0,0 +1,121 @@
+"""Awaitable database API for handlers running on the event loop.
+
+All handlers are ``async def`` and the bot runs with concurrent updates, so a
+synchronous query on the event loop stalls every user at once. The helpers in
+this module hand the work to a small pool of dedicated database threads (each
+one owning a pooled connection from ``utils.database``) and await the result.
+The number of outstanding jobs is bounded so a burst of updates applies
+back-pressure instead of growing an unbounded backlog.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+
+from config import DATABASE_QUEUE_SIZE, DATABASE_WORKER_THREADS
+from utils import database
+
+logger = logging.getLogger(__name__)
+
+
+def _set_result(future: asyncio.Future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future: asyncio.Future, exception: BaseException):
+    if not future.done():
+        future.set_exception(exception)
+
+
+class DatabaseExecutor:
+    """Runs blocking database callables on dedicated threads."""
+
+    def __init__(self, num_workers: int, max_queue_size: int):
+        self.num_workers = num_workers
+        self.max_queue_size = max_queue_size
+        self._jobs = queue.Queue()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._slots = None
+        self._slots_loop = None
+
+    def start(self):
+        """Starts the worker threads (idempotent)."""
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.num_workers):
+                thread = threading.Thread(
+                    target=self._worker, name=f"db-worker-{i}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _get_slots(self, loop: asyncio.AbstractEventLoop) -> asyncio.Semaphore:
+        """Returns the semaphore bounding in-flight jobs for this event loop."""
+        if self._slots_loop is not loop:
+            self._slots = asyncio.Semaphore(self.max_queue_size)
+            self._slots_loop = loop
+        return self._slots
+
+    async def run(self, func, *args, **kwargs):
+        """Runs ``func(*args, **kwargs)`` on a database thread and awaits it."""
+        if not self._threads:
+            self.start()
+
+        loop = asyncio.get_running_loop()
+        slots = self._get_slots(loop)
+        async with slots:
+            future = loop.create_future()
+            self._jobs.put((func, args, kwargs, loop, future))
+            return await future
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            func, args, kwargs, loop, future = job
+            if future.cancelled():
+                continue
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+            else:
+                loop.call_soon_threadsafe(_set_result, future, result)
+
+    def shutdown(self):
+        """Stops the worker threads after the queued jobs have finished."""
+        with self._lock:
+            for _ in self._threads:
+                self._jobs.put(None)
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+
+
+# Process-wide executor shared by all handlers
+db_executor = DatabaseExecutor(DATABASE_WORKER_THREADS, DATABASE_QUEUE_SIZE)
+
+
+async def run(func, *args, **kwargs):
+    """Runs any blocking database function without blocking the event loop."""
+    return await db_executor.run(func, *args, **kwargs)
+
+
+async def get_data(query, params=None):
+    """Awaitable version of ``utils.database.get_data``."""
+    return await db_executor.run(database.get_data, query, params)
+
+
+async def execute_query(query, params=None):
+    """Awaitable version of ``utils.database.execute_query``."""
+    return await db_executor.run(database.execute_query, query, params)
+
+
+async def execute_query_return_id(query, params=None):
+    """Awaitable version of ``utils.database.execute_query_return_id``."""
+    return await db_executor.run(database.execute_query_return_id, query, params)
@@ -1,41 +1,44 @@
 import os
+import threading
+from typing import NamedTuple, Tuple
+
 import pandas as pd
 
 from config import EXCEL_FILE_BASHAR
 from utils import database
+from utils.content_bundle import read_excel
+from utils.question_bank import question_bank
+from utils.question_management import resolve_categories, split_subcategories
 
 
 def populate_categories_data():
     """Populates the database with main and subcategories from your Excel file."""
     excel_file_path = EXCEL_FILE_BASHAR  # Replace with your Excel file
-    df = pd.read_excel(excel_file_path) 
-
-    for _, row in df.iterrows():
-        main_category = row["التصنيف الرئيسي مدقق"]
-
-        # Insert main category if it doesn't exist
-        database.execute_query("INSERT OR IGNORE INTO main_categories (name) VALUES (?)", (main_category,))
-        main_category_id = database.get_data("SELECT id FROM main_categories WHERE name = ?", (main_category,))[0][0] 
-
-        subcategories = row["التصنيفات الفرعية مدققة"].split('،')  
-
-        for subcategory in subcategories:
-            subcategory = subcategory.strip()
-            # Insert subcategory if it doesn't exist
-            database.execute_query("INSERT OR IGNORE INTO subcategories (name) VALUES (?)", (subcategory,))
-            subcategory_id = database.get_data("SELECT id FROM subcategories WHERE name = ?", (subcategory,))[0][0]
-
-            # Create the link
-            database.execute_query(
-                "INSERT OR IGNORE INTO main_sub_links (main_category_id, subcategory_id) VALUES (?, ?)", 
-                (main_category_id, subcategory_id)
-            )
+    df = read_excel(excel_file_path)
+    # Rows without a main category are not imported as questions either
+    df = df[df["التصنيف الرئيسي مدقق"].notna()]
+
+    # Resolve every category in memory and write them in one transaction
+    links = [
+        (str(main_category), subcategory)
+        for main_category, subcategories in zip(
+            df["التصنيف الرئيسي مدقق"], df["التصنيفات الفرعية مدققة"]
+        )
+        for subcategory in split_subcategories(subcategories)
+    ]
+    with database.connection_manager.transaction() as conn:
+        resolve_categories(
+            conn, (str(name) for name in df["التصنيف الرئيسي مدقق"]), links
+        )
+
+    # The subcategory links are cached by the question bank and the directory
+    question_bank.invalidate()
+    category_directory.invalidate()
 
 
 def get_subcategory_name(subcategory_id):
     """Fetches the name of a subcategory by its ID."""
-    subcategory_name = database.get_data("SELECT name FROM subcategories WHERE id = ?", (subcategory_id,))
-    return subcategory_name[0][0]
+    return category_directory.subcategory_name(subcategory_id)
 
 def get_main_categories(page=1, per_page=10):
     """Fetches a paginated list of main categories with IDs."""
@@ -91,4 +94,104 @@ def get_main_categories_by_subcategory(subcategory_id, page=1, per_page=10):
         ''', 
         (subcategory_id, per_page, (page - 1) * per_page)
     )
-    return main_categories
\ No newline at end of file
+    return main_categories
+
+
+class QuestionMetadata(NamedTuple):
+    """Category details of one question."""
+
+    main_category_id: int
+    category_name: str
+    question_type: str
+    subcategories: Tuple[str, ...]
+
+
+# Shown for a category id that does not exist (anymore)
+UNKNOWN_CATEGORY_NAME = "غير محدد"
+
+
+class CategoryDirectory:
+    """In-memory copy of the category names and main -> subcategory links.
+
+    Categories only change when the Excel files are re-imported, so one load
+    serves every lookup. An unknown id triggers a single reload, which picks
+    up categories added by a sync without an explicit invalidate; an id still
+    unknown after it is remembered as missing until the next ``invalidate``.
+    The name getters return ``UNKNOWN_CATEGORY_NAME`` for it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._main_names = None  # id -> name
+        self._sub_names = {}  # id -> name
+        self._subs_by_main = {}  # main id -> tuple of subcategory names
+        self._missing = set()  # (names attribute, id) not found after a reload
+
+    def load(self):
+        with database.connection_manager.transaction() as conn:
+            main_names = dict(conn.execute("SELECT id, name FROM main_categories"))
+            sub_names = dict(conn.execute("SELECT id, name FROM subcategories"))
+            links = conn.execute(
+                "SELECT main_category_id, subcategory_id FROM main_sub_links"
+            ).fetchall()
+        subs_by_main = {}
+        for main_id, sub_id in links:
+            if sub_id in sub_names:
+                subs_by_main.setdefault(main_id, []).append(sub_names[sub_id])
+        with self._lock:
+            self._main_names = main_names
+            self._sub_names = sub_names
+            self._subs_by_main = {
+                main_id: tuple(names) for main_id, names in subs_by_main.items()
+            }
+
+    def invalidate(self):
+        with self._lock:
+            self._main_names = None
+            self._missing = set()
+
+    def _lookup(self, names_attr, category_id):
+        if self._main_names is None:
+            self.load()
+        name = getattr(self, names_attr).get(category_id)
+        if name is None and category_id is not None:
+            if (names_attr, category_id) in self._missing:
+                return UNKNOWN_CATEGORY_NAME
+            self.load()
+            name = getattr(self, names_attr).get(category_id)
+            if name is None:
+                with self._lock:
+                    self._missing.add((names_attr, category_id))
+        return UNKNOWN_CATEGORY_NAME if name is None else name
+
+    def main_category_name(self, main_category_id):
+        return self._lookup("_main_names", main_category_id)
+
+    def subcategory_name(self, subcategory_id):
+        return self._lookup("_sub_names", subcategory_id)
+
+    def subcategories_of(self, main_category_id):
+        if self._main_names is None:
+            self.load()
+        return self._subs_by_main.get(main_category_id, ())
+
+
+category_directory = CategoryDirectory()
+
+
+def get_questions_metadata(question_ids):
+    """Returns {question id: QuestionMetadata} for a batch of questions.
+
+    Questions come from the question bank and names from the category
+    directory, so a whole quiz costs at most one query.
+    """
+    metadata = {}
+    for question in question_bank.get_questions(question_ids):
+        main_category_id = question.main_category_id
+        metadata[question.id] = QuestionMetadata(
+            main_category_id,
+            category_directory.main_category_name(main_category_id),
+            question.question_type or "Unknown",
+            category_directory.subcategories_of(main_category_id),
+        )
+    return metadata
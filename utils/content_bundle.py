@@ -0,0 +1,359 @@
+"""Compiled content bundle for the Excel workbooks the bot reads.
+
+Parsing a dozen .xlsx files with pandas/openpyxl makes startup (and the first
+use of some sections) take seconds. ``python -m utils.content_bundle`` compiles
+every workbook listed in ``CONTENT_BUNDLE_SOURCES`` into one SQLite file: the
+cell values of every sheet, stored as JSON, plus a manifest with the size,
+modification time and SHA-256 checksum of each source. Dates and times are
+stored tagged and come back as the same ``datetime`` objects openpyxl returns.
+
+At runtime ``load_workbook`` and ``read_excel`` serve the bundled copy, which
+loads in milliseconds. They fall back to parsing the .xlsx only when the
+source is newer than what was compiled (or missing from the bundle), so an
+edited workbook is never shadowed by a stale bundle.
+
+``python -m utils.content_bundle --verify`` also checks that every bundled
+workbook reads back equal to openpyxl's and pandas' own reading of the .xlsx.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import sqlite3
+import threading
+
+from config import CONTENT_BUNDLE_FILE, CONTENT_BUNDLE_SOURCES
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored format changes; bundles of another format are ignored
+BUNDLE_FORMAT_VERSION = 2
+
+# JSON tags of the cell values JSON has no type for
+_TEMPORAL_TYPES = {
+    "$datetime": datetime.datetime,
+    "$date": datetime.date,
+    "$time": datetime.time,
+}
+
+
+class BundledCell:
+    def __init__(self, value):
+        self.value = value
+
+
+class BundledSheet:
+    """Read-only stand-in for an openpyxl worksheet."""
+
+    def __init__(self, title, rows):
+        self.title = title
+        self.rows = rows
+
+    @property
+    def max_row(self):
+        return len(self.rows)
+
+    def iter_rows(self, min_row=1, max_row=None, values_only=False):
+        for row in self.rows[min_row - 1 : max_row]:
+            yield row if values_only else tuple(BundledCell(value) for value in row)
+
+    def cell(self, row, column):
+        try:
+            return BundledCell(self.rows[row - 1][column - 1])
+        except IndexError:
+            return BundledCell(None)
+
+
+class BundledWorkbook:
+    """Read-only stand-in for an openpyxl workbook."""
+
+    def __init__(self, sheets, active_index=0):
+        self.worksheets = sheets
+        self.sheetnames = [sheet.title for sheet in sheets]
+        self.active = sheets[active_index] if sheets else None
+
+    def __getitem__(self, name):
+        for sheet in self.worksheets:
+            if sheet.title == name:
+                return sheet
+        raise KeyError(f"Worksheet {name} does not exist.")
+
+
+def _key(path):
+    return os.path.normcase(os.path.normpath(path))
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_sheets(path):
+    """Reads every sheet of a workbook as lists of cell values."""
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheets = []
+        for sheet in workbook.worksheets:
+            rows = [list(row) for row in sheet.iter_rows(values_only=True)]
+            # Drop trailing empty rows, like pandas does
+            while rows and all(value is None for value in rows[-1]):
+                rows.pop()
+            sheets.append((sheet.title, rows))
+        return sheets, workbook.sheetnames.index(workbook.active.title)
+    finally:
+        workbook.close()
+
+
+def _json_default(value):
+    # datetime is a subclass of date, so it is checked first
+    for tag, kind in _TEMPORAL_TYPES.items():
+        if isinstance(value, kind):
+            return {tag: value.isoformat()}
+    return str(value)
+
+
+def _json_object_hook(obj):
+    if len(obj) == 1:
+        tag, value = next(iter(obj.items()))
+        kind = _TEMPORAL_TYPES.get(tag)
+        if kind is not None:
+            return kind.fromisoformat(value)
+    return obj
+
+
+def compile_bundle(sources=None, bundle_file=CONTENT_BUNDLE_FILE):
+    """Compiles the source workbooks into ``bundle_file``.
+
+    The bundle is written to a temporary file and swapped in atomically, so a
+    running bot never sees a half-written bundle.
+
+    Returns:
+        list: The sources that were compiled.
+    """
+    sources = sources or CONTENT_BUNDLE_SOURCES
+    temp_file = f"{bundle_file}.tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+
+    compiled = []
+    conn = sqlite3.connect(temp_file)
+    try:
+        conn.execute(f"PRAGMA user_version = {BUNDLE_FORMAT_VERSION}")
+        conn.executescript(
+            """
+            CREATE TABLE manifest (
+                source TEXT PRIMARY KEY,
+                sha256 TEXT,
+                size INTEGER,
+                mtime REAL,
+                active_sheet INTEGER,
+                compiled_at TEXT
+            );
+            CREATE TABLE sheets (
+                source TEXT,
+                sheet_index INTEGER,
+                title TEXT,
+                rows TEXT,
+                PRIMARY KEY (source, sheet_index)
+            );
+            """
+        )
+        for path in sources:
+            if not os.path.exists(path):
+                logger.warning(f"Content source not found, skipping: {path}")
+                continue
+            stat = os.stat(path)
+            sheets, active_index = _read_sheets(path)
+            conn.execute(
+                "INSERT INTO manifest VALUES (?, ?, ?, ?, ?, datetime('now'))",
+                (_key(path), file_checksum(path), stat.st_size, stat.st_mtime, active_index),
+            )
+            conn.executemany(
+                "INSERT INTO sheets VALUES (?, ?, ?, ?)",
+                [
+                    (_key(path), index, title, json.dumps(rows, ensure_ascii=False, default=_json_default))
+                    for index, (title, rows) in enumerate(sheets)
+                ],
+            )
+            compiled.append(path)
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(temp_file, bundle_file)
+    content_bundle.invalidate()
+    return compiled
+
+
+class ContentBundle:
+    """Serves workbooks from the compiled bundle, loaded once per process."""
+
+    def __init__(self, bundle_file):
+        self.bundle_file = bundle_file
+        self._lock = threading.Lock()
+        self._manifest = None  # source -> (sha256, size, mtime)
+        self._workbooks = {}  # source -> BundledWorkbook
+        self._reported_stale = set()
+
+    def load(self):
+        """Reads the whole bundle into memory (no-op when it does not exist)."""
+        manifest, workbooks = {}, {}
+        if os.path.exists(self.bundle_file):
+            conn = sqlite3.connect(self.bundle_file)
+            try:
+                version = conn.execute("PRAGMA user_version").fetchone()[0]
+                if version != BUNDLE_FORMAT_VERSION:
+                    logger.warning(
+                        f"Content bundle {self.bundle_file} has format {version}, expected "
+                        f"{BUNDLE_FORMAT_VERSION}; reading .xlsx files directly until it is recompiled"
+                    )
+                else:
+                    sheets = {}
+                    for source, _, title, rows in conn.execute(
+                        "SELECT source, sheet_index, title, rows FROM sheets ORDER BY source, sheet_index"
+                    ):
+                        rows = json.loads(rows, object_hook=_json_object_hook)
+                        sheets.setdefault(source, []).append(BundledSheet(title, [tuple(row) for row in rows]))
+                    for source, sha256, size, mtime, active_sheet in conn.execute(
+                        "SELECT source, sha256, size, mtime, active_sheet FROM manifest"
+                    ):
+                        manifest[source] = (sha256, size, mtime)
+                        workbooks[source] = BundledWorkbook(sheets.get(source, []), active_sheet)
+                    logger.info(f"Content bundle loaded: {len(manifest)} workbooks")
+            finally:
+                conn.close()
+        else:
+            logger.warning(f"No content bundle at {self.bundle_file}, reading .xlsx files directly")
+
+        with self._lock:
+            self._manifest = manifest
+            self._workbooks = workbooks
+
+    def invalidate(self):
+        with self._lock:
+            self._manifest = None
+
+    def get_workbook(self, path):
+        """Returns the bundled workbook, or None if the source must be parsed."""
+        if self._manifest is None:
+            self.load()
+        with self._lock:
+            manifest, workbooks = self._manifest or {}, self._workbooks
+        key = _key(path)
+        entry = manifest.get(key)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return workbooks[key]  # Deployed with the bundle only
+
+        _, size, mtime = entry
+        if stat.st_mtime > mtime or stat.st_size != size:
+            if key not in self._reported_stale:
+                self._reported_stale.add(key)
+                logger.warning(f"{path} is newer than the content bundle, reading it directly")
+            return None
+        return workbooks[key]
+
+    def verify(self):
+        """Returns the sources whose checksum no longer matches the manifest."""
+        if self._manifest is None:
+            self.load()
+        mismatched = []
+        for path in CONTENT_BUNDLE_SOURCES:
+            entry = (self._manifest or {}).get(_key(path))
+            if entry and os.path.exists(path) and file_checksum(path) != entry[0]:
+                mismatched.append(path)
+        return mismatched
+
+    def verify_round_trip(self):
+        """Returns the bundled sources that do not read back like their .xlsx.
+
+        Compares every sheet's cell values with openpyxl's and the first sheet's
+        ``read_excel`` frame with ``pandas.read_excel``.
+        """
+        import pandas as pd
+        from pandas.testing import assert_frame_equal
+
+        if self._manifest is None:
+            self.load()
+        different = []
+        for path in CONTENT_BUNDLE_SOURCES:
+            workbook = (self._workbooks or {}).get(_key(path))
+            if workbook is None or not os.path.exists(path):
+                continue
+            sheets, _ = _read_sheets(path)
+            same = [(sheet.title, sheet.rows) for sheet in workbook.worksheets] == [
+                (title, [tuple(row) for row in rows]) for title, rows in sheets
+            ]
+            if same:
+                try:
+                    assert_frame_equal(read_excel(path), pd.read_excel(path))
+                except AssertionError as e:
+                    logger.warning(f"read_excel differs for {path}: {e}")
+                    same = False
+            if not same:
+                different.append(path)
+        return different
+
+
+content_bundle = ContentBundle(CONTENT_BUNDLE_FILE)
+
+
+def load_workbook(path):
+    """Drop-in for ``openpyxl.load_workbook`` that prefers the bundle."""
+    workbook = content_bundle.get_workbook(path)
+    if workbook is not None:
+        return workbook
+    import openpyxl
+
+    return openpyxl.load_workbook(path)
+
+
+def read_excel(path, usecols=None):
+    """Drop-in for ``pandas.read_excel`` (first sheet) that prefers the bundle."""
+    import pandas as pd
+
+    workbook = content_bundle.get_workbook(path)
+    if workbook is None:
+        return pd.read_excel(path, usecols=usecols)
+
+    rows = workbook.worksheets[0].rows if workbook.worksheets else []
+    if not rows:
+        return pd.DataFrame(columns=usecols)
+    header = list(rows[0])
+    width = len(header)
+    # Empty cells come back as NaN from pandas, keep that behavior
+    data = [
+        [math.nan if value is None else value for value in (list(row) + [None] * width)[:width]]
+        for row in rows[1:]
+    ]
+    df = pd.DataFrame(data, columns=header)
+    return df[usecols] if usecols is not None else df
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:] == ["--verify"]:
+        stale = content_bundle.verify()
+        for path in stale:
+            print(f"Changed since compile: {path}")
+        different = content_bundle.verify_round_trip()
+        for path in different:
+            print(f"Reads back differently from the bundle: {path}")
+        raise SystemExit(1 if stale or different else 0)
+
+    for path in compile_bundle():
+        print(f"Compiled {path}")
+    print(f"Content bundle written to {CONTENT_BUNDLE_FILE}")
@@ -1,32 +1,127 @@
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 
 from telegram import Update
 from telegram.ext import CallbackContext
-from config import DATABASE_FILE
-from utils.question_management import (
-    generate_questions_with_categories,
-    generate_verbal_questions,
+from config import (
+    DATABASE_BUSY_TIMEOUT_MS,
+    DATABASE_CACHE_SIZE_KB,
+    DATABASE_FILE,
+    DATABASE_MMAP_SIZE,
 )
 
 
-def create_connection():
-    """Creates a connection to the SQLite database."""
-    conn = None
-    try:
-        conn = sqlite3.connect(DATABASE_FILE)
+class ConnectionManager:
+    """Keeps one long-lived, tuned SQLite connection per thread.
+
+    Opening a connection for every query is expensive and makes concurrent
+    writers fight over the database lock, so each thread reuses its own
+    connection and the database runs in WAL mode (readers never block the
+    single writer).
+    """
+
+    def __init__(self, database_file: str):
+        self.database_file = database_file
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = {}  # thread ident -> connection
+
+    def _configure(self, conn: sqlite3.Connection):
+        """Applies the performance pragmas to a freshly opened connection."""
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(DATABASE_BUSY_TIMEOUT_MS)}")
+        conn.execute(f"PRAGMA cache_size=-{int(DATABASE_CACHE_SIZE_KB)}")
+        conn.execute(f"PRAGMA mmap_size={int(DATABASE_MMAP_SIZE)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Returns the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "connection", None)
+        if conn is not None:
+            return conn
+
+        directory = os.path.dirname(self.database_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # check_same_thread=False only so close_all() can close it at shutdown;
+        # the connection is still used exclusively by the thread that owns it.
+        conn = sqlite3.connect(
+            self.database_file,
+            timeout=DATABASE_BUSY_TIMEOUT_MS / 1000,
+            check_same_thread=False,
+        )
+        self._configure(conn)
+        self._local.connection = conn
+
+        with self._lock:
+            self._prune_dead_threads()
+            self._connections[threading.get_ident()] = conn
         return conn
-    except sqlite3.Error as e:
-        print(e)
-    return conn
+
+    def _prune_dead_threads(self):
+        """Closes connections whose owning thread has exited."""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ident in list(self._connections):
+            if ident not in alive:
+                self._connections.pop(ident).close()
+
+    @contextmanager
+    def transaction(self):
+        """Yields the thread's connection and commits (or rolls back) on exit."""
+        conn = self.get_connection()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    @contextmanager
+    def immediate_transaction(self):
+        """Like ``transaction``, but takes the write lock before the first statement.
+
+        sqlite3 only opens a transaction at the first INSERT/UPDATE/DELETE, so
+        a SELECT followed by a write is not atomic across threads. BEGIN
+        IMMEDIATE makes such read-then-write sequences (and DDL) one unit.
+        """
+        conn = self.get_connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def close_all(self):
+        """Closes every pooled connection (used on shutdown)."""
+        with self._lock:
+            for conn in self._connections.values():
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+# Process-wide connection manager used by every database helper
+connection_manager = ConnectionManager(DATABASE_FILE)
+
+
+def create_connection():
+    """Returns the pooled connection to the SQLite database for this thread.
+
+    The connection is shared, so callers must not close it.
+    """
+    return connection_manager.get_connection()
 
 
 async def create_tables(update: Update = None, context: CallbackContext = None):
     """Creates all the necessary tables in the database."""
 
-    os.makedirs(os.path.dirname(DATABASE_FILE), exist_ok=True)
-
-    conn = sqlite3.connect(DATABASE_FILE)
+    conn = create_connection()
     cursor = conn.cursor()
 
     # Users Table
@@ -216,48 +311,46 @@ async def create_tables(update: Update = None, context: CallbackContext = None):
     """
     )
     conn.commit()
-    conn.close()
 
 
 def generate_question(update: Update = None, context: CallbackContext = None):
+    # Imported here: question_management (through the question bank) imports this module
+    from utils.question_management import (
+        generate_questions_with_categories,
+        generate_verbal_questions,
+    )
+
     generate_questions_with_categories()
     generate_verbal_questions()
 
 
 def get_data(query, params=None):
     """Executes a SELECT query and returns the result."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    data = cursor.fetchall()
-    conn.close()
-    return data
+    cursor = create_connection().cursor()
+    try:
+        if params:
+            cursor.execute(query, params)
+        else:
+            cursor.execute(query)
+        return cursor.fetchall()
+    finally:
+        cursor.close()
 
 
 def execute_query(query, params=None):
     """Executes a non-SELECT query (e.g., INSERT, UPDATE, DELETE)."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    conn.commit()
-    conn.close()
+    with connection_manager.transaction() as conn:
+        if params:
+            conn.execute(query, params)
+        else:
+            conn.execute(query)
 
 
 def execute_query_return_id(query, params=None):
     """Executes a non-SELECT query and returns the last inserted row ID."""
-    conn = create_connection()
-    cursor = conn.cursor()
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    lastrowid = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return lastrowid
+    with connection_manager.transaction() as conn:
+        if params:
+            cursor = conn.execute(query, params)
+        else:
+            cursor = conn.execute(query)
+        return cursor.lastrowid
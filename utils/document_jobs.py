@@ -0,0 +1,317 @@
+"""Durable queue of document jobs (quiz report PDFs, template conversions).
+
+Quiz reports used to be generated inside ``end_quiz`` on a small thread
+pool: a burst of finishing users queued up invisibly and a restart lost the
+jobs. Jobs are now rows in the ``document_jobs`` table:
+
+- ``enqueue`` stores a job and returns its id and position in the queue.
+  Identical requests (same kind and payload) still waiting or running are
+  deduplicated to the existing job.
+- ``DOCUMENT_JOB_WORKERS`` worker tasks on the event loop claim pending jobs
+  by priority (``PRIORITY_INTERACTIVE`` before ``PRIORITY_BATCH``) then age,
+  render them off the loop, attach the file to its quiz row in the same
+  transaction that completes the job, and send it to the user's chat.
+- A failed job is retried after ``DOCUMENT_JOB_RETRY_DELAY_SECONDS``, doubled
+  for every further attempt, up to ``DOCUMENT_JOB_MAX_ATTEMPTS`` attempts.
+- Jobs left ``running`` by a crash (or by an error while recording their
+  outcome) are put back to ``pending`` by ``start``.
+
+Every job kind is registered with ``register`` by the module that knows how
+to render it.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional
+
+from config import (
+    DOCUMENT_JOB_IDLE_POLL_SECONDS,
+    DOCUMENT_JOB_MAX_ATTEMPTS,
+    DOCUMENT_JOB_RETRY_DELAY_SECONDS,
+    DOCUMENT_JOB_WORKERS,
+)
+from utils import async_database, database
+from utils.report_storage import open_report
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = 0  # A user is waiting for the file
+PRIORITY_BATCH = 10  # Template and bulk generation
+
+PENDING, RUNNING, DONE, FAILED = "pending", "running", "done", "failed"
+
+# Pause of a worker after an unexpected error (e.g. the database stayed locked)
+WORKER_ERROR_PAUSE_SECONDS = 5
+
+
+class JobKind(NamedTuple):
+    """How to render a kind of job and where to record its file.
+
+    ``render(payload)`` runs on a worker thread and returns the file path (or
+    None on failure). If ``target_table`` is set, its ``pdf_path`` column is
+    updated for the row whose id is ``payload[target_id_key]``.
+    """
+
+    render: Callable[[dict], Optional[str]]
+    target_table: Optional[str] = None
+    target_id_key: Optional[str] = None
+
+
+class Job(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    chat_id: Optional[int]
+    attempts: int
+
+
+_kinds = {}
+
+
+def register(kind: str, render, target_table=None, target_id_key=None):
+    """Registers the renderer of a job kind (call at import time)."""
+    _kinds[kind] = JobKind(render, target_table, target_id_key)
+
+
+def _dedup_key(kind: str, payload: dict) -> str:
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(f"{kind}\n{encoded}".encode("utf-8")).hexdigest()
+
+
+def _now(delay_seconds: float = 0) -> str:
+    moment = datetime.now() + timedelta(seconds=delay_seconds)
+    return moment.isoformat(sep=" ", timespec="seconds")
+
+
+def queue_position(job_id: int) -> int:
+    """Returns how many jobs run before this one, itself included (0 if not pending)."""
+    with database.connection_manager.transaction() as conn:
+        row = conn.execute(
+            "SELECT status, priority FROM document_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if row is None or row[0] != PENDING:
+            return 0
+        ahead = conn.execute(
+            """
+            SELECT COUNT(*) FROM document_jobs
+            WHERE status = ? AND (priority < ? OR (priority = ? AND id < ?))
+            """,
+            (PENDING, row[1], row[1], job_id),
+        ).fetchone()[0]
+    return ahead + 1
+
+
+def enqueue_job(kind, payload, user_id=None, chat_id=None, priority=PRIORITY_INTERACTIVE):
+    """Stores a job (or finds the identical one already queued).
+
+    Returns ``(job_id, position)``. Blocking; use ``enqueue`` from handlers.
+    """
+    if kind not in _kinds:
+        raise ValueError(f"Unknown document job kind: {kind}")
+    dedup_key = _dedup_key(kind, payload)
+    # The lookup and the insert hold the write lock together, so identical
+    # concurrent requests (a double tap) resolve to the same job
+    with database.connection_manager.immediate_transaction() as conn:
+        row = conn.execute(
+            "SELECT id FROM document_jobs WHERE dedup_key = ? AND status IN (?, ?)",
+            (dedup_key, PENDING, RUNNING),
+        ).fetchone()
+        if row is not None:
+            job_id = row[0]
+        else:
+            job_id = conn.execute(
+                """
+                INSERT INTO document_jobs
+                    (kind, dedup_key, priority, status, payload, user_id, chat_id, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    kind,
+                    dedup_key,
+                    priority,
+                    PENDING,
+                    json.dumps(payload, ensure_ascii=False),
+                    user_id,
+                    chat_id,
+                    _now(),
+                ),
+            ).lastrowid
+    return job_id, queue_position(job_id)
+
+
+def _claim_next_job() -> Optional[Job]:
+    with database.connection_manager.immediate_transaction() as conn:
+        row = conn.execute(
+            """
+            SELECT id, kind, payload, chat_id, attempts FROM document_jobs
+            WHERE status = ? AND (not_before IS NULL OR not_before <= ?) ORDER BY priority, id LIMIT 1
+            """,
+            (PENDING, _now()),
+        ).fetchone()
+        if row is None:
+            return None
+        claimed = conn.execute(
+            """
+            UPDATE document_jobs SET status = ?, started_at = ?, attempts = attempts + 1
+            WHERE id = ? AND status = ?
+            """,
+            (RUNNING, _now(), row[0], PENDING),
+        ).rowcount
+    if not claimed:
+        return None
+    job_id, kind, payload, chat_id, attempts = row
+    return Job(job_id, kind, json.loads(payload), chat_id, attempts + 1)
+
+
+def _complete_job(job: Job, result_path: str):
+    """Marks the job done and records its file on the target row, atomically."""
+    kind = _kinds[job.kind]
+    with database.connection_manager.transaction() as conn:
+        conn.execute(
+            "UPDATE document_jobs SET status = ?, result_path = ?, finished_at = ? WHERE id = ?",
+            (DONE, result_path, _now(), job.id),
+        )
+        if kind.target_table:
+            # Table names come from register(), never from user input
+            conn.execute(
+                f"UPDATE {kind.target_table} SET pdf_path = ? WHERE id = ?",
+                (result_path, job.payload[kind.target_id_key]),
+            )
+
+
+def _fail_job(job: Job, error: str) -> bool:
+    """Records a failed attempt; returns True if the job will be retried (later)."""
+    retry = job.attempts < DOCUMENT_JOB_MAX_ATTEMPTS
+    delay = DOCUMENT_JOB_RETRY_DELAY_SECONDS * 2 ** (job.attempts - 1)
+    with database.connection_manager.transaction() as conn:
+        conn.execute(
+            """
+            UPDATE document_jobs SET status = ?, error = ?, finished_at = ?, not_before = ?
+            WHERE id = ?
+            """,
+            (
+                PENDING if retry else FAILED,
+                error,
+                None if retry else _now(),
+                _now(delay) if retry else None,
+                job.id,
+            ),
+        )
+    return retry
+
+
+def _requeue_interrupted_jobs():
+    with database.connection_manager.transaction() as conn:
+        cursor = conn.execute(
+            "UPDATE document_jobs SET status = ? WHERE status = ?", (PENDING, RUNNING)
+        )
+    if cursor.rowcount:
+        logger.info(f"Re-queued {cursor.rowcount} interrupted document jobs")
+
+
+class DocumentJobRunner:
+    """Worker tasks running the queued jobs on the bot's event loop."""
+
+    def __init__(self, num_workers: int):
+        self.num_workers = num_workers
+        self._bot = None
+        self._loop = None
+        self._wakeup = None
+        self._tasks = []
+
+    async def start(self, application):
+        """Re-queues interrupted jobs and starts the workers (from post_init)."""
+        self._bot = application.bot
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        await async_database.run(_requeue_interrupted_jobs)
+        self._tasks = [
+            self._loop.create_task(self._worker(index)) for index in range(self.num_workers)
+        ]
+
+    async def stop(self, application=None):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Tells idle workers that a job was queued (callable from any thread)."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                job = await async_database.run(_claim_next_job)
+                if job is None:
+                    self._wakeup.clear()
+                    # Re-check after clearing so a job queued in between is not missed
+                    job = await async_database.run(_claim_next_job)
+                    if job is None:
+                        # Also wakes up for the retries that become due
+                        try:
+                            await asyncio.wait_for(
+                                self._wakeup.wait(), DOCUMENT_JOB_IDLE_POLL_SECONDS
+                            )
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                await self._run_job(job)
+            except Exception as e:
+                # Keep the worker alive; a job stuck in running is re-queued by start
+                logger.error(f"Document worker {index} error: {e}")
+                await asyncio.sleep(WORKER_ERROR_PAUSE_SECONDS)
+
+    async def _run_job(self, job: Job):
+        kind = _kinds.get(job.kind)
+        try:
+            if kind is None:
+                raise ValueError(f"No renderer registered for {job.kind}")
+            result_path = await asyncio.to_thread(kind.render, job.payload)
+            if not result_path or not os.path.exists(result_path):
+                raise FileNotFoundError("The document was not generated")
+            await async_database.run(_complete_job, job, result_path)
+        except Exception as e:
+            logger.error(f"Document job {job.id} ({job.kind}) failed: {e}")
+            retry = await async_database.run(_fail_job, job, str(e))
+            if not retry and job.chat_id is not None:
+                await self._send_message(job.chat_id, "حدث خطأ أثناء إنشاء ملف PDF. ⚠️")
+            return
+
+        logger.info(f"Document job {job.id} ({job.kind}) done: {result_path}")
+        if job.chat_id is not None:
+            try:
+                with open_report(result_path) as (f, filename):
+                    await self._bot.send_document(
+                        chat_id=job.chat_id, document=f, filename=filename
+                    )
+            except Exception as e:
+                logger.error(f"Error sending the document of job {job.id}: {e}")
+
+    async def _send_message(self, chat_id, text):
+        try:
+            await self._bot.send_message(chat_id=chat_id, text=text)
+        except Exception as e:
+            logger.error(f"Error sending a message to chat {chat_id}: {e}")
+
+
+document_jobs = DocumentJobRunner(DOCUMENT_JOB_WORKERS)
+
+
+async def enqueue(kind, payload, user_id=None, chat_id=None, priority=PRIORITY_INTERACTIVE):
+    """Queues a job without blocking the event loop; returns ``(job_id, position)``."""
+    result = await async_database.run(enqueue_job, kind, payload, user_id, chat_id, priority)
+    document_jobs.wake()
+    return result
+
+
+def queue_position_message(position: int) -> str:
+    """The Arabic status line shown to the user after queueing a document."""
+    if position <= 1:
+        return "جاري إنشاء ملف pdf وسيصلك خلال لحظات... 📄"
+    return f"تمت إضافة ملف pdf إلى قائمة الانتظار، ترتيبك {position}. سيصلك فور تجهيزه... 📄"
@@ -1,11 +1,10 @@
-import pandas as pd
-
 from config import FAQ_FILE
+from utils.content_bundle import read_excel
 
 
 # Load the Excel file
 try:
-    df = pd.read_excel(FAQ_FILE)
+    df = read_excel(FAQ_FILE)
 except FileNotFoundError:
     print("Excel file not found. Make sure it's in the correct directory.")
     exit()
@@ -0,0 +1,119 @@
+"""In-process counters and timings for the bot's caches and hot paths.
+
+Code that wants to be measured increments a named counter or records a
+timing on the shared ``metrics`` registry::
+
+    metrics.counter("report_fragments.hits").inc()
+    metrics.histogram("chat.ttft_seconds").observe(0.42)
+
+Caches count ``<name>.hits`` and ``<name>.misses`` so ``hit_rate(name)``
+can report how much work is reused. ``log_metrics_periodically`` writes a
+snapshot to the log every ``METRICS_LOG_INTERVAL_SECONDS``.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+
+class Counter:
+    """A thread-safe monotonically increasing count."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: int = 1):
+        with self._lock:
+            self._value += amount
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class Histogram:
+    """Count, sum and max of observations, with percentiles of the latest ones."""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self._recent.append(value)
+
+    def percentile(self, fraction: float) -> float:
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class MetricsRegistry:
+    """Named counters and histograms, created on first use."""
+
+    def __init__(self):
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str) -> Counter:
+        with self._lock:
+            if name not in self._counters:
+                self._counters[name] = Counter()
+            return self._counters[name]
+
+    def histogram(self, name: str) -> Histogram:
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram()
+            return self._histograms[name]
+
+    def hit_rate(self, name: str) -> float:
+        """Share of ``name`` cache lookups that were hits (0.0 before any lookup)."""
+        hits = self.counter(f"{name}.hits").value
+        misses = self.counter(f"{name}.misses").value
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def report(self) -> str:
+        """A one-line-per-metric summary for the log."""
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = dict(self._histograms)
+        lines = [f"{name} = {counter.value}" for name, counter in sorted(counters.items())]
+        for name in sorted(name[: -len(".hits")] for name in counters if name.endswith(".hits")):
+            lines.append(f"{name}.hit_rate = {self.hit_rate(name):.1%}")
+        for name, histogram in sorted(histograms.items()):
+            lines.append(
+                f"{name}: n={histogram.count} mean={histogram.mean:.3f} "
+                f"p50={histogram.percentile(0.5):.3f} p95={histogram.percentile(0.95):.3f} "
+                f"max={histogram.max:.3f}"
+            )
+        return "\n".join(lines)
+
+
+metrics = MetricsRegistry()
+
+
+async def log_metrics_periodically(interval_seconds: float):
+    """Logs ``metrics.report()`` every ``interval_seconds`` (run as a task)."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        report = metrics.report()
+        if report:
+            logger.info(f"Metrics:\n{report}")
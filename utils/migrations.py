@@ -0,0 +1,295 @@
+"""Versioned schema migrations for the bot database.
+
+``create_tables`` only knows how to create the original tables. Every later
+schema change (indexes, new columns, new tables) is appended to ``MIGRATIONS``
+as a numbered step; the version reached so far is stored in SQLite's
+``PRAGMA user_version`` and ``run_migrations`` applies the missing steps, in
+order, at every startup. Never edit or reorder a released migration - add a
+new one instead.
+
+Run ``python -m utils.migrations`` to migrate and print the query plans of the
+hot queries (they should all use an index, never ``SCAN``).
+"""
+
+import json
+import logging
+
+from utils import database
+
+logger = logging.getLogger(__name__)
+
+
+class MigrationError(Exception):
+    pass
+
+
+def _check_unique_telegram_ids(conn):
+    """Refuses to migrate while several users rows share a telegram_id.
+
+    telegram_id becomes UNIQUE, but duplicate registrations may each hold
+    points, subscriptions and referrals, so they are listed for an operator
+    to merge instead of being deleted here.
+    """
+    duplicates = conn.execute(
+        """
+        SELECT telegram_id, GROUP_CONCAT(id, ', ') FROM users
+        WHERE telegram_id IS NOT NULL
+        GROUP BY telegram_id HAVING COUNT(*) > 1
+        """
+    ).fetchall()
+    if duplicates:
+        details = "\n".join(
+            f"  telegram_id {telegram_id}: users.id {ids}" for telegram_id, ids in duplicates
+        )
+        raise MigrationError(
+            f"{len(duplicates)} telegram ids belong to several users rows. Merge or "
+            f"delete the extra rows, then restart the bot:\n{details}"
+        )
+
+
+def _import_chat_history(conn):
+    """Copies the JSON chat_history blobs into chat_messages, one row per message."""
+    rows = conn.execute("SELECT user_id, messages FROM chat_history").fetchall()
+    for user_id, blob in rows:
+        try:
+            messages = json.loads(blob) if blob else []
+        except ValueError:
+            logger.warning(f"Skipped the unreadable chat history of user {user_id}")
+            continue
+        conn.executemany(
+            "INSERT INTO chat_messages (user_id, role, content) VALUES (?, ?, ?)",
+            [
+                (user_id, m["role"], m["content"])
+                for m in messages
+                if m.get("role") in ("user", "assistant") and m.get("content")
+            ],
+        )
+
+
+# (version, description, steps) - a step is an SQL string or a callable(conn)
+MIGRATIONS = [
+    (
+        1,
+        "Indexes for the hot lookup paths",
+        [
+            _check_unique_telegram_ids,
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_telegram_id ON users(telegram_id)",
+            "CREATE INDEX IF NOT EXISTS idx_users_referral_code ON users(referral_code)",
+            "CREATE INDEX IF NOT EXISTS idx_user_answers_user_id ON user_answers(user_id)",
+            "CREATE INDEX IF NOT EXISTS idx_user_answers_previous_tests_id ON user_answers(previous_tests_id)",
+            "CREATE INDEX IF NOT EXISTS idx_previous_tests_user_timestamp ON previous_tests(user_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_level_determinations_user_timestamp ON level_determinations(user_id, timestamp)",
+            "CREATE INDEX IF NOT EXISTS idx_level_answers_level_determination_id ON level_determination_answers(level_determination_id)",
+            "CREATE INDEX IF NOT EXISTS idx_questions_type_main_category ON questions(question_type, main_category_id)",
+            "CREATE INDEX IF NOT EXISTS idx_questions_main_category ON questions(main_category_id)",
+            "CREATE INDEX IF NOT EXISTS idx_main_sub_links_subcategory ON main_sub_links(subcategory_id)",
+            "CREATE INDEX IF NOT EXISTS idx_ai_image_usage_user_time ON ai_image_usage(user_id, usage_time)",
+            "CREATE INDEX IF NOT EXISTS idx_chat_history_user_id ON chat_history(user_id)",
+            # chatgpt_usage is keyed by user_id (its PRIMARY KEY), so it needs no extra index
+        ],
+    ),
+    (
+        2,
+        "Content hashes for incremental question sync",
+        [
+            "ALTER TABLE questions ADD COLUMN source_key TEXT",
+            "ALTER TABLE questions ADD COLUMN content_hash TEXT",
+            "ALTER TABLE questions ADD COLUMN retired INTEGER NOT NULL DEFAULT 0",
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_questions_source_key ON questions(source_key)",
+            """
+            CREATE TABLE IF NOT EXISTS question_sync_log (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT,
+                synced_at TEXT,
+                inserted INTEGER,
+                updated INTEGER,
+                retired INTEGER,
+                unchanged INTEGER
+            )
+            """,
+        ],
+    ),
+    (
+        3,
+        "Durable document job queue",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS document_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                dedup_key TEXT NOT NULL,
+                priority INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                user_id INTEGER,
+                chat_id INTEGER,
+                result_path TEXT,
+                error TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                created_at TEXT,
+                started_at TEXT,
+                finished_at TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_document_jobs_queue ON document_jobs(status, priority, id)",
+            # At most one waiting or running job per identical request
+            """
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_document_jobs_active_dedup
+            ON document_jobs(dedup_key) WHERE status IN ('pending', 'running')
+            """,
+        ],
+    ),
+    (
+        4,
+        "Append-only chat messages and rolling summaries",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created_at TEXT
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_chat_messages_user_id ON chat_messages(user_id, id)",
+            """
+            CREATE TABLE IF NOT EXISTS chat_summaries (
+                user_id INTEGER PRIMARY KEY,
+                summary TEXT,
+                last_message_id INTEGER NOT NULL DEFAULT 0,
+                updated_at TEXT
+            )
+            """,
+            _import_chat_history,
+        ],
+    ),
+    (
+        5,
+        "Pre-generated AI explanations per question and option",
+        [
+            """
+            CREATE TABLE IF NOT EXISTS ai_explanations (
+                question_id INTEGER NOT NULL,
+                option TEXT NOT NULL,
+                explanation TEXT NOT NULL,
+                source_hash TEXT NOT NULL,
+                prompt_version INTEGER NOT NULL,
+                model TEXT,
+                prompt_tokens INTEGER DEFAULT 0,
+                completion_tokens INTEGER DEFAULT 0,
+                created_at TEXT,
+                PRIMARY KEY (question_id, option),
+                FOREIGN KEY (question_id) REFERENCES questions(id) ON DELETE CASCADE
+            )
+            """,
+        ],
+    ),
+    (
+        6,
+        "Retry delay of failed document jobs",
+        [
+            "ALTER TABLE document_jobs ADD COLUMN not_before TEXT",
+        ],
+    ),
+]
+
+
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def run_migrations():
+    """Applies every migration newer than the database's schema version.
+
+    Each migration runs in its own transaction together with the version
+    bump, so a failure leaves the database at the last good version.
+    """
+    conn = database.create_connection()
+    current_version = get_schema_version(conn)
+
+    for version, description, steps in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        # An explicit BEGIN: sqlite3 would run CREATE/ALTER outside any transaction
+        with database.connection_manager.immediate_transaction() as conn:
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            # PRAGMA does not accept bound parameters
+            conn.execute(f"PRAGMA user_version = {int(version)}")
+        current_version = version
+
+    return current_version
+
+
+# The queries that run on (almost) every update, with sample parameters
+HOT_QUERIES = [
+    ("SELECT * FROM users WHERE telegram_id = ?", (1,)),
+    ("SELECT 1 FROM users WHERE referral_code = ?", ("x",)),
+    (
+        "SELECT id, timestamp, score, num_questions FROM previous_tests WHERE user_id = ? ORDER BY timestamp DESC",
+        (1,),
+    ),
+    ("SELECT * FROM level_determinations WHERE user_id = ?", (1,)),
+    (
+        "SELECT id FROM questions WHERE question_type = ? AND main_category_id = ?",
+        ("quantitative", 1),
+    ),
+    ("SELECT COUNT(*) FROM user_answers WHERE user_id = ?", (1,)),
+    (
+        "SELECT COUNT(*) FROM ai_image_usage WHERE user_id = ? AND usage_time >= ?",
+        (1, "2000-01-01"),
+    ),
+    ("SELECT usage_count, last_used FROM chatgpt_usage WHERE user_id = ?", (1,)),
+    (
+        "SELECT role, content FROM chat_messages WHERE user_id = ? ORDER BY id DESC LIMIT ?",
+        (1, 12),
+    ),
+    ("SELECT summary FROM chat_summaries WHERE user_id = ?", (1,)),
+    (
+        "SELECT explanation FROM ai_explanations WHERE question_id = ? AND option = ? AND source_hash = ?",
+        (1, "x", "x"),
+    ),
+    (
+        """
+        SELECT id, kind, payload, chat_id, attempts FROM document_jobs
+        WHERE status = ? AND (not_before IS NULL OR not_before <= ?) ORDER BY priority, id LIMIT 1
+        """,
+        ("pending", "2000-01-01 00:00:00"),
+    ),
+]
+
+
+def explain_hot_queries():
+    """Returns ``{query: [plan details]}`` and the queries that do a full scan."""
+    conn = database.create_connection()
+    plans, full_scans = {}, []
+    for query, params in HOT_QUERIES:
+        rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        details = [row[-1] for row in rows]
+        plans[query] = details
+        if any(d.startswith("SCAN") and "USING" not in d for d in details):
+            full_scans.append(query)
+    return plans, full_scans
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(database.create_tables())
+    print(f"Schema version: {run_migrations()}")
+
+    plans, full_scans = explain_hot_queries()
+    for query, details in plans.items():
+        print(query)
+        for detail in details:
+            print(f"    {detail}")
+    if full_scans:
+        print(f"\n{len(full_scans)} hot queries still do a full table scan!")
+        raise SystemExit(1)
+    print("\nAll hot queries use an index.")
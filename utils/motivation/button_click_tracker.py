@@ -1,5 +1,4 @@
 import random
-from openpyxl import load_workbook
 from telegram import Update
 from telegram.ext import CallbackContext
 from config import (
@@ -9,7 +8,8 @@ from config import (
     MALE_MAIN_MENU_MESSAGES_FILE,
 )
 from utils import user_management
-from utils.database import get_data
+from utils import async_database
+from utils.content_bundle import load_workbook
 
 # Constants for paths and message frequency
 MESSAGES_TRIGGER_THRESHOLD = 3
@@ -68,9 +68,11 @@ async def send_motivational_message(
     else:  # Assuming it's a CallbackQuery
         user = update.from_user
     user_id = user.id
-    gender = get_data("SELECT gender FROM users WHERE telegram_id = ?", (user_id,))[0][
-        0
-    ]
+    gender = (
+        await async_database.get_data(
+            "SELECT gender FROM users WHERE telegram_id = ?", (user_id,)
+        )
+    )[0][0]
 
     message = get_random_motivational_message(gender, called_from)
     if message:
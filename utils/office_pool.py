@@ -0,0 +1,270 @@
+"""Pool of long-lived headless LibreOffice processes for document conversion.
+
+Running ``libreoffice --headless --convert-to pdf`` per document pays the
+office cold start (2-5 seconds) every time, and parallel runs sharing one
+user profile serialize or fail. ``office_pool`` keeps ``OFFICE_POOL_SIZE``
+office processes running, each with its own profile and listening on its own
+UNO socket, and hands every conversion to an idle one.
+
+Workers are health-checked before each job, a job running longer than
+``OFFICE_JOB_TIMEOUT_SECONDS`` kills its worker, and dead workers are
+restarted on the next job. Without the ``uno`` Python bridge (python3-uno),
+each job falls back to a one-off ``--convert-to`` run, still bounded by the
+pool size and using the worker's private profile; ``check_uno_bridge`` (run
+at startup) warns about it.
+"""
+
+import atexit
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from config import (
+    OFFICE_BINARY,
+    OFFICE_JOB_TIMEOUT_SECONDS,
+    OFFICE_POOL_BASE_PORT,
+    OFFICE_POOL_SIZE,
+    OFFICE_PROFILES_DIRECTORY,
+    OFFICE_START_TIMEOUT_SECONDS,
+)
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+except ImportError:  # The UNO bridge ships with LibreOffice, not with pip
+    uno = None
+
+logger = logging.getLogger(__name__)
+
+# Export filter per source document type
+PDF_FILTERS = {
+    ".doc": "writer_pdf_Export",
+    ".docx": "writer_pdf_Export",
+    ".odt": "writer_pdf_Export",
+    ".ppt": "impress_pdf_Export",
+    ".pptx": "impress_pdf_Export",
+    ".odp": "impress_pdf_Export",
+}
+
+
+class OfficeJobTimeout(Exception):
+    pass
+
+
+def _property(name, value):
+    prop = PropertyValue()
+    prop.Name = name
+    prop.Value = value
+    return prop
+
+
+class OfficeWorker:
+    """One headless office process and its UNO connection."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.port = OFFICE_POOL_BASE_PORT + index
+        self.profile_dir = os.path.abspath(
+            os.path.join(OFFICE_PROFILES_DIRECTORY, f"worker_{index}")
+        )
+        self.process = None
+        self.desktop = None
+
+    def _base_command(self):
+        return [
+            OFFICE_BINARY,
+            "--headless",
+            "--invisible",
+            "--nologo",
+            "--norestore",
+            f"-env:UserInstallation={Path(self.profile_dir).as_uri()}",
+        ]
+
+    def start(self):
+        """Launches the office process and connects to it over UNO."""
+        os.makedirs(self.profile_dir, exist_ok=True)
+        url = f"socket,host=127.0.0.1,port={self.port};urp;StarOffice.ComponentContext"
+        self.process = subprocess.Popen(
+            self._base_command() + [f"--accept={url}"],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        local_context = uno.getComponentContext()
+        resolver = local_context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local_context
+        )
+        deadline = time.monotonic() + OFFICE_START_TIMEOUT_SECONDS
+        while True:
+            try:
+                context = resolver.resolve(f"uno:{url}")
+                break
+            except Exception:
+                if self.process.poll() is not None or time.monotonic() > deadline:
+                    self.stop()
+                    raise RuntimeError(f"Office worker {self.index} failed to start")
+                time.sleep(0.25)
+        self.desktop = context.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", context
+        )
+        logger.info(f"Office worker {self.index} listening on port {self.port}")
+
+    def is_healthy(self) -> bool:
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            self.desktop.getComponents()
+            return True
+        except Exception:
+            return False
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            try:
+                self.desktop.terminate()
+            except Exception:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        self.process = None
+        self.desktop = None
+
+    def convert(self, input_path: str, output_path: str, timeout: float):
+        """Exports ``input_path`` to PDF at ``output_path``."""
+        if uno is None:
+            return self._convert_with_subprocess(input_path, output_path, timeout)
+
+        if not self.is_healthy():
+            self.stop()
+            self.start()
+
+        error = []
+
+        def export():
+            document = None
+            try:
+                document = self.desktop.loadComponentFromURL(
+                    Path(input_path).resolve().as_uri(),
+                    "_blank",
+                    0,
+                    (_property("Hidden", True),),
+                )
+                filter_name = PDF_FILTERS.get(
+                    os.path.splitext(input_path)[1].lower(), "writer_pdf_Export"
+                )
+                document.storeToURL(
+                    Path(os.path.abspath(output_path)).as_uri(),
+                    (_property("FilterName", filter_name),),
+                )
+            except Exception as e:
+                error.append(e)
+            finally:
+                if document is not None:
+                    try:
+                        document.close(True)
+                    except Exception:
+                        pass
+
+        # UNO calls cannot be cancelled, so a stuck job costs its worker
+        thread = threading.Thread(target=export, daemon=True)
+        thread.start()
+        thread.join(timeout)
+        if thread.is_alive():
+            logger.error(f"Office worker {self.index} timed out, restarting it")
+            self.process.kill()
+            self.stop()
+            raise OfficeJobTimeout(f"Converting {input_path} took over {timeout}s")
+        if error:
+            raise error[0]
+
+    def _convert_with_subprocess(self, input_path, output_path, timeout):
+        out_dir = os.path.dirname(os.path.abspath(output_path))
+        os.makedirs(self.profile_dir, exist_ok=True)
+        try:
+            subprocess.run(
+                self._base_command()
+                + ["--convert-to", "pdf", "--outdir", out_dir, input_path],
+                check=True,
+                timeout=timeout,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+        except subprocess.TimeoutExpired as e:
+            raise OfficeJobTimeout(f"Converting {input_path} took over {timeout}s") from e
+        converted = os.path.join(
+            out_dir, os.path.splitext(os.path.basename(input_path))[0] + ".pdf"
+        )
+        if converted != os.path.abspath(output_path) and os.path.exists(converted):
+            shutil.move(converted, output_path)
+
+
+class OfficePool:
+    """Hands conversions to a fixed set of office workers."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._idle = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._bridge_checked = False
+
+    def check_uno_bridge(self) -> bool:
+        """Returns whether the UNO bridge is available; warns once when it is not."""
+        if uno is None and not self._bridge_checked:
+            logger.warning(
+                "The LibreOffice UNO bridge (python3-uno) is not installed: every "
+                "document conversion starts a new office process. Install python3-uno "
+                "for the same Python to use the pool of running office processes."
+            )
+        self._bridge_checked = True
+        return uno is not None
+
+    def _ensure_workers(self):
+        with self._lock:
+            if not self._workers:
+                self.check_uno_bridge()
+                # Processes are launched lazily, by the first job each worker runs
+                self._workers = [OfficeWorker(index) for index in range(self.size)]
+                for worker in self._workers:
+                    self._idle.put(worker)
+
+    def convert_to_pdf(self, input_path: str, output_path: str = None, timeout: float = None):
+        """Converts a Word or PowerPoint file to PDF.
+
+        Blocks until a worker is free. Returns the output path; raises
+        ``FileNotFoundError`` if no PDF was produced.
+        """
+        if output_path is None:
+            output_path = os.path.splitext(input_path)[0] + ".pdf"
+        timeout = timeout or OFFICE_JOB_TIMEOUT_SECONDS
+        self._ensure_workers()
+
+        worker = self._idle.get()
+        try:
+            started = time.perf_counter()
+            worker.convert(input_path, output_path, timeout)
+            logger.info(
+                f"Converted {os.path.basename(input_path)} on office worker "
+                f"{worker.index} in {time.perf_counter() - started:.2f}s"
+            )
+        finally:
+            self._idle.put(worker)
+
+        if not os.path.exists(output_path):
+            raise FileNotFoundError("PDF conversion failed.")
+        return output_path
+
+    def shutdown(self):
+        with self._lock:
+            for worker in self._workers:
+                worker.stop()
+
+
+office_pool = OfficePool(OFFICE_POOL_SIZE)
+atexit.register(office_pool.shutdown)
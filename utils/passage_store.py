@@ -0,0 +1,86 @@
+"""Cached access to the reading passages of verbal questions.
+
+Every verbal question shown in a quiz needs its passage, and consecutive
+questions usually share one, so reading ``<passage name>.txt`` from disk each
+time repeats the same work. ``PassageStore`` keeps the most recently used
+passages in an LRU cache. A cached entry is re-validated against the file's
+modification time at most every ``PASSAGE_CACHE_RECHECK_SECONDS``, so edited
+passages are picked up without a restart.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from config import CONTEXT_DIRECTORY, PASSAGE_CACHE_RECHECK_SECONDS, PASSAGE_CACHE_SIZE
+
+# Names used in the sheets for "this question has no passage"
+NO_PASSAGE = {"", "-", "N/A", "nan", "None"}
+
+
+class PassageStore:
+    """LRU cache of passage texts keyed by passage name."""
+
+    def __init__(self, directory: str, max_entries: int, recheck_seconds: float):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.recheck_seconds = recheck_seconds
+        self._entries = OrderedDict()  # name -> (mtime_ns or None, text, checked_at)
+        self._lock = threading.Lock()
+
+    def get(self, passage_name) -> str:
+        """Returns the passage text, or an empty string if there is none."""
+        if passage_name is None or str(passage_name) in NO_PASSAGE:
+            return ""
+        name = str(passage_name)
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and now - entry[2] < self.recheck_seconds:
+                self._entries.move_to_end(name)
+                return entry[1]
+
+        path = os.path.join(self.directory, f"{name}.txt")
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if entry is not None and entry[0] == mtime:
+            text = entry[1]
+        elif mtime is None:
+            text = ""  # Cached too, so missing passages are not looked up again
+        else:
+            with open(path, "r", encoding="utf-8") as file:
+                text = file.read().strip()
+
+        with self._lock:
+            self._entries[name] = (mtime, text, now)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return text
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_passage_store(directory: str = CONTEXT_DIRECTORY) -> PassageStore:
+    """Returns the shared store for a passages directory."""
+    with _stores_lock:
+        store = _stores.get(directory)
+        if store is None:
+            store = PassageStore(directory, PASSAGE_CACHE_SIZE, PASSAGE_CACHE_RECHECK_SECONDS)
+            _stores[directory] = store
+        return store
+
+
+# Store for the verbal questions' passages (CONTEXT_DIRECTORY)
+passage_store = get_passage_store(CONTEXT_DIRECTORY)
@@ -0,0 +1,222 @@
+"""In-memory index of question ids for fast random sampling.
+
+Picking quiz questions with ``ORDER BY RANDOM() LIMIT ?`` sorts the whole
+``questions`` table on every quiz start. Instead, the ids of all questions are
+loaded once into compact arrays grouped by ``(question_type, main_category_id)``
+together with the subcategory -> main categories mapping from
+``main_sub_links``. Sampling then only touches the ids it returns, and the
+rows themselves are fetched by primary key.
+
+Full rows are turned into immutable ``Question`` records once and shared by
+reference: quiz sessions only keep question ids and look the records up here.
+A reload drops the records, so handlers on the event loop use ``get_async``,
+which fetches a missing record on a database thread.
+
+The importers call ``question_bank.invalidate()`` after writing questions;
+the bank is rebuilt lazily on the next access. A sync run from another
+process (``python -m utils.question_management``) is noticed through
+``question_sync_log`` within ``QUESTION_BANK_REFRESH_SECONDS``.
+"""
+
+import bisect
+import logging
+import random
+import threading
+import time
+from array import array
+from typing import NamedTuple, Optional
+
+from config import QUESTION_BANK_REFRESH_SECONDS
+from utils import async_database, database
+
+logger = logging.getLogger(__name__)
+
+
+# Answer letter -> field index of the matching option in a Question
+OPTION_INDEX = {"أ": 3, "ب": 4, "ج": 5, "د": 6}
+
+
+class Question(NamedTuple):
+    """One row of the questions table (in QUESTION_COLUMNS order)."""
+
+    id: int
+    correct_answer: str
+    question_text: str
+    option_a: str
+    option_b: str
+    option_c: str
+    option_d: str
+    explanation: str
+    main_category_id: Optional[int]
+    question_type: str
+    image_path: Optional[str]
+    passage_name: Optional[str]
+
+    def option_text(self, letter: str) -> str:
+        """Text of the option for an answer letter (أ/ب/ج/د)."""
+        index = OPTION_INDEX.get(letter)
+        return self[index] if index is not None else "غير محدد"
+
+    def is_correct(self, letter: str) -> bool:
+        return letter.upper() == self.correct_answer.upper()
+
+
+class QuestionBank:
+    """Question ids grouped by type and main category."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._by_type_main = {}  # (question_type, main_category_id) -> array of ids
+        self._by_type = {}  # question_type -> array of ids
+        self._all_ids = array("q")
+        self._sub_to_main = {}  # subcategory_id -> tuple of main_category_ids
+        self._records = {}  # question id -> Question, filled on demand
+        self._sync_marker = None  # Last question_sync_log id seen at load time
+        self._checked_at = 0.0
+
+    def load(self):
+        """(Re)builds the index from the database."""
+        by_type_main, by_type, all_ids, sub_to_main = {}, {}, array("q"), {}
+        sync_marker = self._read_sync_marker()
+
+        for question_id, question_type, main_category_id in database.get_data(
+            "SELECT id, question_type, main_category_id FROM questions WHERE retired = 0 ORDER BY id"
+        ):
+            by_type_main.setdefault((question_type, main_category_id), array("q")).append(question_id)
+            by_type.setdefault(question_type, array("q")).append(question_id)
+            all_ids.append(question_id)
+
+        for main_category_id, subcategory_id in database.get_data(
+            "SELECT main_category_id, subcategory_id FROM main_sub_links"
+        ):
+            sub_to_main.setdefault(subcategory_id, []).append(main_category_id)
+
+        with self._lock:
+            self._by_type_main = by_type_main
+            self._by_type = by_type
+            self._all_ids = all_ids
+            self._sub_to_main = {sub: tuple(mains) for sub, mains in sub_to_main.items()}
+            self._sync_marker = sync_marker
+            self._checked_at = time.monotonic()
+            self._records = {}  # Content may have changed
+            self._loaded = True
+        logger.info(f"Question bank loaded: {len(all_ids)} questions")
+
+    def invalidate(self):
+        """Marks the index stale; it is reloaded on the next access."""
+        with self._lock:
+            self._loaded = False
+
+    @staticmethod
+    def _read_sync_marker():
+        return database.get_data("SELECT MAX(id) FROM question_sync_log")[0][0]
+
+    def _ensure_loaded(self):
+        if self._loaded and time.monotonic() - self._checked_at >= QUESTION_BANK_REFRESH_SECONDS:
+            self._checked_at = time.monotonic()
+            if self._read_sync_marker() != self._sync_marker:
+                self._loaded = False
+        if not self._loaded:
+            self.load()
+
+    def sample_ids(self, num_questions, question_type=None, main_category_id=None, subcategory_id=None):
+        """Returns up to ``num_questions`` distinct random question ids.
+
+        Filters by question type and by either a main category or a
+        subcategory (any main category linked to it).
+        """
+        self._ensure_loaded()
+
+        if subcategory_id is not None:
+            pools = [
+                self._by_type_main.get((question_type, main_id), ())
+                for main_id in self._sub_to_main.get(subcategory_id, ())
+            ]
+        elif main_category_id is not None:
+            pools = [self._by_type_main.get((question_type, main_category_id), ())]
+        elif question_type is not None:
+            pools = [self._by_type.get(question_type, ())]
+        else:
+            pools = [self._all_ids]
+
+        return _sample_from_pools(pools, num_questions)
+
+    def get_questions(self, question_ids):
+        """Returns the shared Question records for ``question_ids``, in order.
+
+        Ids whose row no longer exists are left out, so callers that pair the
+        records with other per-question data must match them by ``id``.
+        """
+        records = self._records
+        missing = [qid for qid in question_ids if qid not in records]
+        if missing:
+            for question in fetch_questions(missing):
+                records[question.id] = question
+        return [records[qid] for qid in question_ids if qid in records]
+
+    def get(self, question_id):
+        """Returns one Question record, or None if it does not exist."""
+        question = self._records.get(question_id)
+        if question is None:
+            questions = self.get_questions([question_id])
+            question = questions[0] if questions else None
+        return question
+
+    async def get_async(self, question_id):
+        """Awaitable ``get`` that only leaves the event loop to fetch a missing record."""
+        question = self._records.get(question_id)
+        if question is None:
+            question = await async_database.run(self.get, question_id)
+        return question
+
+    def random_id(self):
+        """Returns one random question id, or None when there are no questions."""
+        ids = self.sample_ids(1)
+        return ids[0] if ids else None
+
+
+def _sample_from_pools(pools, num_questions):
+    """Samples without replacement across several arrays without joining them."""
+    pools = [pool for pool in pools if len(pool)]
+    offsets, total = [], 0
+    for pool in pools:
+        offsets.append(total)
+        total += len(pool)
+
+    picked = random.sample(range(total), min(num_questions, total))
+    if len(pools) == 1:
+        return [pools[0][i] for i in picked]
+
+    ids = []
+    for i in picked:
+        pool_index = bisect.bisect_right(offsets, i) - 1
+        ids.append(pools[pool_index][i - offsets[pool_index]])
+    return ids
+
+
+# The columns of a Question record, in table order
+QUESTION_COLUMNS = (
+    "id, correct_answer, question_text, option_a, option_b, option_c, option_d, "
+    "explanation, main_category_id, question_type, image_path, passage_name"
+)
+
+
+def fetch_questions(question_ids):
+    """Fetches Question records by id, in the order of ``question_ids``.
+
+    Prefer ``question_bank.get_questions``, which shares the records.
+    """
+    if not question_ids:
+        return []
+    placeholders = ",".join("?" * len(question_ids))
+    rows = database.get_data(
+        f"SELECT {QUESTION_COLUMNS} FROM questions WHERE id IN ({placeholders})",
+        tuple(question_ids),
+    )
+    rows_by_id = {row[0]: Question._make(row) for row in rows}
+    return [rows_by_id[qid] for qid in question_ids if qid in rows_by_id]
+
+
+# Process-wide question bank
+question_bank = QuestionBank()
@@ -1,145 +1,315 @@
+import hashlib
+import json
+import logging
 import os
-import sqlite3
+import time
 import pandas as pd
 
-from config import DATABASE_FILE, EXCEL_FILE_BASHAR, VERBAL_FILE
+from config import EXCEL_FILE_BASHAR, VERBAL_FILE
 from utils import database
+from utils.content_bundle import content_bundle, read_excel
+from utils.passage_store import get_passage_store
+from utils.question_bank import question_bank
+
+logger = logging.getLogger(__name__)
+
+
+QUANTITATIVE_COLUMNS = [
+    "الجواب الصحيح",
+    "نص السؤال مدقق",
+    "الخيار أ مدقق",
+    "الخيار ب مدقق",
+    "الخيار ج مدقق",
+    "الخيار د مدقق",
+    "الشرح مدقق",
+    "التصنيف الرئيسي مدقق",
+    "التصنيفات الفرعية مدققة",
+]
+
+VERBAL_COLUMNS = [
+    "الجواب الصحيح",
+    "نص السؤال",
+    "الخيار أ",
+    "الخيار ب",
+    "الخيار ج",
+    "الخيار د",
+    "الشرح",
+    "التصنيف الرئيسي",
+    "القطعة",
+]
+
+
+def split_subcategories(value):
+    """Splits the Arabic-comma separated subcategories cell."""
+    if not isinstance(value, str):
+        return []
+    return [sub.strip() for sub in value.split("،")]
+
+
+def resolve_categories(conn, main_categories, links=()):
+    """Creates missing categories and links in bulk and returns their ids.
 
+    Args:
+        conn: Connection with an open transaction.
+        main_categories: Main category names.
+        links: (main category name, subcategory name) pairs.
 
-def generate_questions_with_categories():
-    # Check if data already exists in the table
-    count = database.get_data("SELECT COUNT(*) FROM questions")
-    print(count)
-    if count[0][0] == 0:  # If the table is empty, populate it from Excel
-        df = pd.read_excel(
-            EXCEL_FILE_BASHAR,
-            usecols=[
-                "الجواب الصحيح",
-                "نص السؤال مدقق",
-                "الخيار أ مدقق",
-                "الخيار ب مدقق",
-                "الخيار ج مدقق",
-                "الخيار د مدقق",
-                "الشرح مدقق",
-                "التصنيف الرئيسي مدقق",
-                "التصنيفات الفرعية مدققة",
-            ],
-        )
+    Returns:
+        Two dicts mapping main category and subcategory names to ids.
+    """
+    links = set(links)
+    main_names = set(main_categories) | {main for main, _ in links}
+    sub_names = {sub for _, sub in links}
 
-        for _, row in df.iterrows():
-            main_category = row["التصنيف الرئيسي مدقق"]
-            subcategories = row["التصنيفات الفرعية مدققة"].split("،")
+    conn.executemany(
+        "INSERT OR IGNORE INTO main_categories (name) VALUES (?)",
+        [(name,) for name in main_names],
+    )
+    conn.executemany(
+        "INSERT OR IGNORE INTO subcategories (name) VALUES (?)",
+        [(name,) for name in sub_names],
+    )
+    main_ids = dict(conn.execute("SELECT name, id FROM main_categories").fetchall())
+    sub_ids = dict(conn.execute("SELECT name, id FROM subcategories").fetchall())
 
-            # Get or create main category ID
-            database.execute_query(
-                "INSERT OR IGNORE INTO main_categories (name) VALUES (?)",
-                (main_category,),
-            )
-            main_category_id = database.get_data(
-                "SELECT id FROM main_categories WHERE name = ?", (main_category,)
-            )[0][0]
-
-            # Link main category to subcategories
-            for subcategory in subcategories:
-                subcategory = subcategory.strip()
-                database.execute_query(
-                    "INSERT OR IGNORE INTO subcategories (name) VALUES (?)",
-                    (subcategory,),
-                )
-                subcategory_id = database.get_data(
-                    "SELECT id FROM subcategories WHERE name = ?", (subcategory,)
-                )[0][0]
-                database.execute_query(
-                    "INSERT OR IGNORE INTO main_sub_links (main_category_id, subcategory_id) VALUES (?, ?)",
-                    (main_category_id, subcategory_id),
-                )
-
-            # Now insert the question with the main_category_id
-            database.execute_query(
-                """
-                INSERT INTO questions (correct_answer, question_text, option_a, option_b, option_c, option_d, explanation, main_category_id)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    str(row["الجواب الصحيح"]),
-                    str(row["نص السؤال مدقق"]),
-                    str(row["الخيار أ مدقق"]),
-                    str(row["الخيار ب مدقق"]),
-                    str(row["الخيار ج مدقق"]),
-                    str(row["الخيار د مدقق"]),
-                    str(row["الشرح مدقق"]),
-                    main_category_id,
-                ),
-            )
+    conn.executemany(
+        "INSERT OR IGNORE INTO main_sub_links (main_category_id, subcategory_id) VALUES (?, ?)",
+        [(main_ids[main], sub_ids[sub]) for main, sub in links],
+    )
+    return main_ids, sub_ids
 
 
-def generate_verbal_questions():
-    """Adds verbal questions to the database from an Excel file.
+def report_import(label, row_count, started):
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    logger.info(
+        f"{label}: imported {row_count} rows in {elapsed:.2f}s ({row_count / elapsed:.0f} rows/s)"
+    )
 
-    Args:
-        excel_file (str): The path to the Excel file.
+
+def quantitative_records(df):
+    """Normalizes rows of the quantitative sheet (EXCEL_FILE_BASHAR), skipping uncategorized ones."""
+    return [
+        {
+            "question_type": "quantitative",
+            "correct_answer": str(row["الجواب الصحيح"]),
+            "question_text": str(row["نص السؤال مدقق"]),
+            "option_a": str(row["الخيار أ مدقق"]),
+            "option_b": str(row["الخيار ب مدقق"]),
+            "option_c": str(row["الخيار ج مدقق"]),
+            "option_d": str(row["الخيار د مدقق"]),
+            "explanation": str(row["الشرح مدقق"]),
+            "main_category": str(row["التصنيف الرئيسي مدقق"]),
+            "subcategories": split_subcategories(row["التصنيفات الفرعية مدققة"]),
+            "passage_name": None,
+        }
+        for row in df.to_dict("records")
+        # str() would turn an empty cell into a main category called "nan"
+        if not pd.isna(row["التصنيف الرئيسي مدقق"])
+    ]
+
+
+def verbal_records(df):
+    """Normalizes rows of the verbal sheet (VERBAL_FILE), skipping uncategorized ones."""
+    return [
+        {
+            "question_type": "verbal",
+            "correct_answer": str(row["الجواب الصحيح"]),
+            "question_text": str(row["نص السؤال"]),
+            "option_a": str(row["الخيار أ"]),
+            "option_b": str(row["الخيار ب"]),
+            "option_c": str(row["الخيار ج"]),
+            "option_d": str(row["الخيار د"]),
+            "explanation": str(row["الشرح"]),
+            "main_category": str(row["التصنيف الرئيسي"]),
+            "subcategories": [],
+            "passage_name": str(row["القطعة"]),
+        }
+        for row in df.to_dict("records")
+        if str(row["التصنيف الرئيسي"]).lower() != "nan"
+    ]
+
+
+# source name -> (Excel file, columns, row normalizer)
+QUESTION_SOURCES = {
+    "quantitative": (EXCEL_FILE_BASHAR, QUANTITATIVE_COLUMNS, quantitative_records),
+    "verbal": (VERBAL_FILE, VERBAL_COLUMNS, verbal_records),
+}
+
+
+def content_hash(record):
+    """Stable hash of everything a question row contributes to the database."""
+    payload = json.dumps(record, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def keyed_records(source, records):
+    """Yields ``(source_key, record)`` pairs.
+
+    A question is identified by its text (and passage), so editing options or
+    the explanation updates the row in place while reordering rows in the
+    sheet changes nothing. Repeated texts are told apart by occurrence.
     """
-    df = pd.read_excel(
-        VERBAL_FILE,
-        usecols=[
-            "الجواب الصحيح",
-            "نص السؤال",
-            "الخيار أ",
-            "الخيار ب",
-            "الخيار ج",
-            "الخيار د",
-            "الشرح",
-            "التصنيف الرئيسي",
-            "القطعة",
-        ],
-    )
+    occurrences = {}
+    for record in records:
+        identity = f"{record['question_text']}\x1f{record['passage_name']}"
+        occurrences[identity] = occurrences.get(identity, 0) + 1
+        digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()[:20]
+        yield f"{source}:{digest}:{occurrences[identity]}", record
 
-    for _, row in df.iterrows():
-        main_category = row["التصنيف الرئيسي"]
-        question_type = "verbal"
-        if str(main_category).lower() == "nan":
-            continue
-        # Get the main category ID (create if it doesn't exist)
-        database.execute_query(
-            "INSERT OR IGNORE INTO main_categories (name) VALUES (?)",
-            (main_category,),
+
+def sync_questions(source, records=None):
+    """Brings the questions of one source in line with its Excel sheet.
+
+    Only changed rows are touched: new rows are inserted, rows whose content
+    hash changed are updated in place (keeping their id, so past answers stay
+    linked) and rows that disappeared from the sheet are retired. Questions
+    imported before hashes existed are adopted by matching their text. All
+    writes happen in one transaction.
+
+    Returns:
+        dict: Counts of inserted, updated, retired and unchanged rows.
+    """
+    started = time.perf_counter()
+    path, columns, normalize = QUESTION_SOURCES[source]
+    if records is None:
+        records = normalize(read_excel(path, usecols=columns))
+    question_type = source  # Sources are named after the question_type they hold
+    counts = {"inserted": 0, "updated": 0, "retired": 0, "unchanged": 0}
+
+    with database.connection_manager.transaction() as conn:
+        main_ids, _ = resolve_categories(
+            conn,
+            (record["main_category"] for record in records),
+            (
+                (record["main_category"], sub)
+                for record in records
+                for sub in record["subcategories"]
+            ),
         )
-        main_category_id = database.get_data(
-            "SELECT id FROM main_categories WHERE name = ?", (main_category,)
-        )[0][0]
 
-        # Insert the verbal question
-        database.execute_query(
+        existing = {
+            source_key: (question_id, old_hash, retired)
+            for source_key, question_id, old_hash, retired in conn.execute(
+                "SELECT source_key, id, content_hash, retired FROM questions WHERE source_key LIKE ?",
+                (f"{source}:%",),
+            )
+        }
+        legacy = {}  # (question_text, passage_name) -> ids of rows imported without a hash
+        for question_id, question_text, passage_name in conn.execute(
+            "SELECT id, question_text, passage_name FROM questions WHERE source_key IS NULL AND retired = 0 AND question_type = ? ORDER BY id",
+            (question_type,),
+        ):
+            legacy.setdefault((question_text, passage_name), []).append(question_id)
+
+        inserts, updates, seen = [], [], set()
+        for source_key, record in keyed_records(source, records):
+            seen.add(source_key)
+            row_hash = content_hash(record)
+            values = (
+                record["correct_answer"],
+                record["question_text"],
+                record["option_a"],
+                record["option_b"],
+                record["option_c"],
+                record["option_d"],
+                record["explanation"],
+                main_ids[record["main_category"]],
+                record["question_type"],
+                record["passage_name"],
+                source_key,
+                row_hash,
+            )
+            if source_key in existing:
+                question_id, old_hash, retired = existing[source_key]
+                if old_hash == row_hash and not retired:
+                    counts["unchanged"] += 1
+                    continue
+                updates.append(values + (question_id,))
+            elif legacy.get((record["question_text"], record["passage_name"])):
+                updates.append(values + (legacy[(record["question_text"], record["passage_name"])].pop(0),))
+            else:
+                inserts.append(values)
+
+        retire = [
+            (question_id,)
+            for source_key, (question_id, _, retired) in existing.items()
+            if source_key not in seen and not retired
+        ]
+        # Unclaimed legacy rows are the duplicates left by earlier full imports
+        retire += [(question_id,) for ids in legacy.values() for question_id in ids]
+
+        conn.executemany(
             """
-            INSERT INTO questions (correct_answer, question_text, option_a, option_b, 
-                                    option_c, option_d, explanation, main_category_id, 
-                                    image_path, question_type, passage_name)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO questions (correct_answer, question_text, option_a, option_b,
+                                   option_c, option_d, explanation, main_category_id,
+                                   question_type, passage_name, source_key, content_hash)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """,
-            (
-                str(row["الجواب الصحيح"]),
-                str(row["نص السؤال"]),
-                str(row["الخيار أ"]),
-                str(row["الخيار ب"]),
-                str(row["الخيار ج"]),
-                str(row["الخيار د"]),
-                str(row["الشرح"]),
-                main_category_id,
-                None,
-                question_type,
-                str(row["القطعة"]),
-            ),
+            inserts,
         )
+        conn.executemany(
+            """
+            UPDATE questions
+            SET correct_answer = ?, question_text = ?, option_a = ?, option_b = ?,
+                option_c = ?, option_d = ?, explanation = ?, main_category_id = ?,
+                question_type = ?, passage_name = ?, source_key = ?, content_hash = ?,
+                retired = 0
+            WHERE id = ?
+            """,
+            updates,
+        )
+        conn.executemany("UPDATE questions SET retired = 1 WHERE id = ?", retire)
+
+        counts["inserted"], counts["updated"], counts["retired"] = (
+            len(inserts),
+            len(updates),
+            len(retire),
+        )
+        conn.execute(
+            """
+            INSERT INTO question_sync_log (source, synced_at, inserted, updated, retired, unchanged)
+            VALUES (?, datetime('now'), ?, ?, ?, ?)
+            """,
+            (source, counts["inserted"], counts["updated"], counts["retired"], counts["unchanged"]),
+        )
+
+    report_import(f"{source} questions", len(records), started)
+    logger.info(f"{source} questions sync: {counts}")
+    if counts["inserted"] or counts["updated"] or counts["retired"]:
+        question_bank.invalidate()
+    return counts
+
+
+def sync_all_questions():
+    """Syncs every question source whose Excel file is present."""
+    results = {}
+    for source, (path, _, _) in QUESTION_SOURCES.items():
+        if not os.path.exists(path) and content_bundle.get_workbook(path) is None:
+            logger.warning(f"Skipping {source} questions sync, file not found: {path}")
+            continue
+        try:
+            results[source] = sync_questions(source)
+        except Exception as e:
+            logger.error(f"Error syncing {source} questions: {e}")
+    return results
+
+
+def generate_questions_with_categories():
+    """Imports (or incrementally re-syncs) the quantitative questions."""
+    return sync_questions("quantitative")
+
+
+def generate_verbal_questions():
+    """Imports (or incrementally re-syncs) the verbal questions.
+
+    Running it again no longer duplicates the bank; see ``sync_questions``.
+    """
+    return sync_questions("verbal")
 
 
 def get_passage_content(context_folder, passage_name):
-    """Fetches the passage content based on the passage_name."""
-    if passage_name and passage_name != "N/A":
-        file_path = os.path.join(context_folder, f"{passage_name}.txt")
-        if os.path.exists(file_path):
-            with open(file_path, "r", encoding="utf-8") as file:
-                return file.read().strip()
-    return ""
+    """Fetches the passage content based on the passage_name (cached)."""
+    return get_passage_store(context_folder).get(passage_name)
 
 
 def generate_questions():
@@ -159,40 +329,27 @@ def generate_questions():
             ],
         )  # Specify the columns you want to read
 
-        for _, row in df.iterrows():
-            database.execute_query(
+        with database.connection_manager.transaction() as conn:
+            conn.executemany(
                 """
                 INSERT INTO questions (correct_answer, question_text, option_a, option_b, option_c, option_d, explanation)
                 VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-                (
-                    row["الجواب الصحيح"],
-                    row["نص السؤال مدقق"],
-                    row["الخيار أ مدقق"],
-                    row["الخيار ب مدقق"],
-                    row["الخيار ج مدقق"],
-                    row["الخيار د مدقق"],
-                    row["الشرح مدقق"],
-                ),
+                """,
+                df[QUANTITATIVE_COLUMNS[:7]].itertuples(index=False, name=None),
             )
+        question_bank.invalidate()
 
 
 def get_random_questions(num_questions, question_type):
     """Retrieves a specified number of random questions from the database."""
     # Step 1: Retrieve a random set of questions
-    questions = database.get_data(
-        """
-        SELECT * FROM questions 
-        WHERE question_type = ?
-        ORDER BY RANDOM() 
-        LIMIT ?
-        """,
-        (question_type, num_questions),
+    questions = question_bank.get_questions(
+        question_bank.sample_ids(num_questions, question_type=question_type)
     )
     # Step 2: Group questions by passage name
     grouped_questions = sorted(
-        questions, key=lambda x: x[11]
-    )  # Sort by passage_name index
+        questions, key=lambda question: question.passage_name or ""
+    )  # Keep questions of the same passage together
     return grouped_questions
 
 
@@ -205,55 +362,31 @@ def get_questions_by_category(category_id, num_questions, category_type, questio
         category_type (str): 'main_category_id' or 'sub_category_id'.
         question_type (str): 'verbal' or 'quantitative'.
     """
-    conn = sqlite3.connect(DATABASE_FILE)
-    cursor = conn.cursor()
-
     if category_type == "main_category_id":
-        cursor.execute(
-            """
-            SELECT * FROM questions
-            WHERE main_category_id = ? AND question_type = ?
-            ORDER BY RANDOM()
-            LIMIT ?
-            """,
-            (category_id, question_type, num_questions),
+        question_ids = question_bank.sample_ids(
+            num_questions, question_type=question_type, main_category_id=category_id
         )
     elif category_type == "sub_category_id":
-        cursor.execute(
-            """
-            SELECT q.* FROM questions q
-            JOIN main_sub_links msl ON q.main_category_id = msl.main_category_id
-            WHERE msl.subcategory_id = ? AND q.question_type = ?
-            ORDER BY RANDOM()
-            LIMIT ?
-            """,
-            (category_id, question_type, num_questions),
+        question_ids = question_bank.sample_ids(
+            num_questions, question_type=question_type, subcategory_id=category_id
         )
     else:
         raise ValueError(
             "Invalid category_type. Must be 'main_category_id' or 'sub_category_id'."
         )
 
-    questions = cursor.fetchall()
-    conn.close()
-    return questions
+    return question_bank.get_questions(question_ids)
 
 
 def connect_db():
-    return sqlite3.connect(DATABASE_FILE)
+    return database.create_connection()
 
 
 def get_random_question():
-    with connect_db() as conn:
-        cursor = conn.cursor()
-        cursor.execute("SELECT * FROM questions ORDER BY RANDOM() LIMIT 1")
-        question_data = cursor.fetchone()
-
-    if question_data:
-        column_names = [description[0] for description in cursor.description]
-        return dict(zip(column_names, question_data))
-    else:
+    question_id = question_bank.random_id()
+    if question_id is None:
         return None
+    return get_question_by_id(question_id)
 
 
 def get_question_by_id(question_id):
@@ -316,3 +449,15 @@ def get_user_questions_for_review(user_id):
             (user_id,),
         )
         return cursor.fetchall()
+
+
+if __name__ == "__main__":
+    # Refresh the question bank from the Excel files; safe while the bot runs
+    import asyncio
+
+    logging.basicConfig(level=logging.INFO)
+    from utils.migrations import run_migrations
+
+    asyncio.run(database.create_tables())
+    run_migrations()
+    print(sync_all_questions())
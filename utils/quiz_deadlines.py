@@ -0,0 +1,178 @@
+"""Server-side deadlines for running quizzes.
+
+Time limits used to be checked only when the user tapped an answer, so an
+abandoned quiz never ended and its session stayed in memory. Every running
+quiz now gets a deadline in ``quiz_deadlines``, a hashed timer wheel driven
+by one task on the event loop: scheduling and cancelling are O(1) dict
+operations, so tens of thousands of deadlines cost one wake-up per tick.
+
+When a deadline passes, the quiz is ended through the handler's normal
+``end_quiz`` path and its session data is evicted from ``user_data``.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from config import (
+    DEADLINE_WHEEL_SLOTS,
+    DEADLINE_WHEEL_TICK_SECONDS,
+    QUIZ_IDLE_TIMEOUT_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+# The per-quiz keys kept in user_data while a test or level determination runs
+QUIZ_SESSION_KEYS = (
+    "questions",
+    "rendered_questions",
+    "current_question",
+    "score",
+    "start_time",
+    "end_time",
+    "answers",
+    "results",
+    "answer_log",
+    "quiz_message",
+    "quiz_deadline",
+    "quiz_active",
+)
+
+# Stand-in for the Update passed to end_quiz when no user action triggered it
+DeadlineUpdate = namedtuple(
+    "DeadlineUpdate",
+    ["effective_user", "effective_chat", "effective_message", "callback_query"],
+)
+
+
+class _Timer:
+    __slots__ = ("key", "rounds", "slot", "callback")
+
+    def __init__(self, key, rounds, slot, callback):
+        self.key = key
+        self.rounds = rounds
+        self.slot = slot
+        self.callback = callback
+
+
+class TimerWheel:
+    """Hashed timer wheel running coroutine callbacks on the event loop.
+
+    A timer due in ``n`` ticks goes into slot ``(cursor + n) % slots`` with
+    ``(n - 1) // slots`` full turns left before it fires.
+    """
+
+    def __init__(self, tick_seconds: float, slots: int):
+        self.tick_seconds = tick_seconds
+        self._slots = [dict() for _ in range(slots)]  # key -> _Timer
+        self._timers = {}  # key -> _Timer
+        self._cursor = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self._timers)
+
+    def schedule(self, key, delay_seconds: float, callback):
+        """Runs ``callback()`` (a coroutine function) after ``delay_seconds``.
+
+        Scheduling an existing key replaces its timer.
+        """
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay_seconds / self.tick_seconds))
+        slot = (self._cursor + ticks) % len(self._slots)
+        timer = _Timer(key, (ticks - 1) // len(self._slots), slot, callback)
+        self._slots[slot][key] = timer
+        self._timers[key] = timer
+        self._ensure_running()
+
+    def cancel(self, key) -> bool:
+        timer = self._timers.pop(key, None)
+        if timer is None:
+            return False
+        del self._slots[timer.slot][key]
+        return True
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        next_tick = time.monotonic() + self.tick_seconds
+        while True:
+            # Sleep to an absolute time so the wheel does not drift
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            next_tick += self.tick_seconds
+            self._cursor = (self._cursor + 1) % len(self._slots)
+            slot = self._slots[self._cursor]
+            due = []
+            for key, timer in list(slot.items()):
+                if timer.rounds > 0:
+                    timer.rounds -= 1
+                else:
+                    del slot[key]
+                    del self._timers[key]
+                    due.append(timer)
+            for timer in due:
+                asyncio.create_task(self._fire(timer))
+
+    @staticmethod
+    async def _fire(timer):
+        try:
+            await timer.callback()
+        except Exception as e:
+            logger.error(f"Error running deadline {timer.key}: {e}")
+
+
+quiz_deadlines = TimerWheel(DEADLINE_WHEEL_TICK_SECONDS, DEADLINE_WHEEL_SLOTS)
+
+
+def schedule_quiz_deadline(update, context, on_expire):
+    """Arms (or re-arms) the deadline of the quiz running in ``context``.
+
+    The deadline is the quiz's ``end_time`` or, for quizzes without a time
+    limit, ``QUIZ_IDLE_TIMEOUT_SECONDS`` from now. ``on_expire(update,
+    context)`` is called with a ``DeadlineUpdate`` pointing at the quiz message.
+    """
+    user_data = context.user_data
+    answer_log = user_data["answer_log"]
+    key = (answer_log.kind, answer_log.quiz_id)
+    previous_key = user_data.get("quiz_deadline")
+    if previous_key is not None and previous_key != key:
+        quiz_deadlines.cancel(previous_key)  # An older quiz of the same user
+    user_data["quiz_deadline"] = key
+
+    if "end_time" in user_data:
+        delay = (user_data["end_time"] - datetime.now()).total_seconds()
+    else:
+        delay = QUIZ_IDLE_TIMEOUT_SECONDS
+    user, chat = update.effective_user, update.effective_chat
+
+    async def expire():
+        # The user may have finished this quiz or started another one meanwhile
+        if user_data.get("answer_log") is not answer_log or not user_data.get("quiz_active"):
+            return
+        message = user_data.get("quiz_message")
+        if message is None:
+            evict_quiz_session(user_data)
+            return
+        logger.info(f"Quiz {key} reached its deadline, ending it")
+        await on_expire(DeadlineUpdate(user, chat, message, None), context)
+        evict_quiz_session(user_data)
+
+    quiz_deadlines.schedule(key, delay, expire)
+
+
+def cancel_quiz_deadline(user_data):
+    key = user_data.pop("quiz_deadline", None)
+    if key is not None:
+        quiz_deadlines.cancel(key)
+
+
+def evict_quiz_session(user_data):
+    """Drops the finished quiz's data from the user's session."""
+    cancel_quiz_deadline(user_data)
+    for key in QUIZ_SESSION_KEYS:
+        user_data.pop(key, None)
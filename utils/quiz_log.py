@@ -0,0 +1,312 @@
+"""Buffered answer log for running quizzes, committed once at the end.
+
+While a test or level determination is running its answers are only kept in
+memory (``QuizAnswerLog``) and appended to a small JSONL write-ahead journal
+file. ``finalize_quiz`` then writes the answers, the user's counters and the
+quiz row in one transaction and deletes the journal.
+
+The journals are written by ``journal_writer``, a single background thread
+keeping each journal open for the whole quiz, so answering never waits for
+the disk. A line is handed to the OS as soon as it is written (it survives a
+crash of the bot) and fsynced every ``QUIZ_JOURNAL_FSYNC_INTERVAL_SECONDS``
+(it survives a crash of the machine).
+
+If the bot stops mid-quiz, ``recover_unfinished_quizzes`` (run at startup)
+replays the journals so no recorded answer is lost.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from config import QUIZ_JOURNAL_DIRECTORY, QUIZ_JOURNAL_FSYNC_INTERVAL_SECONDS
+from utils import database, user_management
+
+logger = logging.getLogger(__name__)
+
+# kind -> (answers table, quiz foreign key column, quiz table)
+QUIZ_KINDS = {
+    "test": ("user_answers", "previous_tests_id", "previous_tests"),
+    "level": ("level_determination_answers", "level_determination_id", "level_determinations"),
+}
+
+
+class JournalWriter:
+    """Single thread appending journal lines through long-lived file handles."""
+
+    def __init__(self, fsync_interval: float, max_open_files: int = 256):
+        self.fsync_interval = fsync_interval
+        self.max_open_files = max_open_files
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._files = OrderedDict()  # path -> open journal, least recently used first
+        self._unsynced = set()  # Paths written since their last fsync
+
+    def start(self):
+        """Starts the writer thread (idempotent)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="quiz-journal-writer", daemon=True
+                )
+                self._thread.start()
+
+    def append(self, path: str, line: str):
+        """Queues a line to append to the journal at ``path``."""
+        if self._thread is None:
+            self.start()
+        self._queue.put(("append", path, line))
+
+    def discard(self, path: str):
+        """Closes and deletes a journal once the lines queued before are written."""
+        if self._thread is None:
+            self.start()
+        self._queue.put(("discard", path, None))
+
+    def shutdown(self):
+        """Writes and fsyncs everything still queued and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        sync_at = None  # When the lines written since the last fsync are due
+        while True:
+            timeout = None if sync_at is None else max(0.0, sync_at - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item is None:
+                break
+            if item:
+                action, path, line = item
+                if action == "append":
+                    self._append(path, line)
+                    if sync_at is None:
+                        sync_at = time.monotonic() + self.fsync_interval
+                else:
+                    self._discard(path)
+            if sync_at is not None and time.monotonic() >= sync_at:
+                self._sync()
+                sync_at = None
+        for path in list(self._files):
+            self._close(path)
+
+    def _append(self, path, line):
+        try:
+            journal = self._files.pop(path, None)
+            if journal is None:
+                if len(self._files) >= self.max_open_files:
+                    self._close(next(iter(self._files)))
+                os.makedirs(QUIZ_JOURNAL_DIRECTORY, exist_ok=True)
+                journal = open(path, "a", encoding="utf-8")
+            self._files[path] = journal
+            journal.write(line)
+            journal.flush()
+            self._unsynced.add(path)
+        except OSError as e:
+            logger.error(f"Could not journal answer to {path}: {e}")
+
+    def _sync(self):
+        for path in self._unsynced:
+            try:
+                os.fsync(self._files[path].fileno())
+            except (KeyError, OSError) as e:
+                logger.error(f"Could not fsync journal {path}: {e}")
+        self._unsynced.clear()
+
+    def _close(self, path, sync=True):
+        journal = self._files.pop(path, None)
+        if journal is None:
+            return
+        try:
+            if sync and path in self._unsynced:
+                os.fsync(journal.fileno())
+            journal.close()
+        except OSError as e:
+            logger.error(f"Could not close journal {path}: {e}")
+        self._unsynced.discard(path)
+
+    def _discard(self, path):
+        self._close(path, sync=False)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+# Process-wide writer shared by all running quizzes
+journal_writer = JournalWriter(QUIZ_JOURNAL_FSYNC_INTERVAL_SECONDS)
+
+# Make sure journaled answers reach the disk even on an unexpected exit
+atexit.register(journal_writer.shutdown)
+
+
+class QuizAnswerLog:
+    """Answers of one running quiz, mirrored to a write-ahead journal."""
+
+    def __init__(self, kind: str, quiz_id: int, user_id: int):
+        if kind not in QUIZ_KINDS:
+            raise ValueError(f"Unknown quiz kind: {kind}")
+        self.kind = kind
+        self.quiz_id = quiz_id
+        self.user_id = user_id
+        self.answers = []  # (question_id, user_answer, is_correct)
+        self.finalized = False
+        self._lock = threading.Lock()
+        self.journal_path = os.path.join(QUIZ_JOURNAL_DIRECTORY, f"{kind}_{quiz_id}.jsonl")
+
+    def record(self, question_id: int, user_answer: str, is_correct: bool):
+        """Buffers an answer and queues it for the journal."""
+        with self._lock:
+            if self.finalized:
+                return  # A late tap after the quiz was already committed
+            self.answers.append((question_id, user_answer, bool(is_correct)))
+            entry = {
+                "kind": self.kind,
+                "quiz_id": self.quiz_id,
+                "user_id": self.user_id,
+                "question_id": question_id,
+                "user_answer": user_answer,
+                "is_correct": bool(is_correct),
+            }
+            journal_writer.append(self.journal_path, json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def discard_journal(self):
+        journal_writer.discard(self.journal_path)
+
+    @property
+    def score(self) -> int:
+        return sum(1 for _, _, is_correct in self.answers if is_correct)
+
+
+def _insert_answers(conn, kind, user_id, quiz_id, answers):
+    answers_table, quiz_column, _ = QUIZ_KINDS[kind]
+    conn.executemany(
+        f"""
+        INSERT INTO {answers_table} (user_id, question_id, user_answer, is_correct, {quiz_column})
+        VALUES (?, ?, ?, ?, ?)
+        """,
+        [
+            (user_id, question_id, user_answer, is_correct, quiz_id)
+            for question_id, user_answer, is_correct in answers
+        ],
+    )
+
+
+def _update_quiz_row(conn, kind, quiz_id, values: dict):
+    _, _, quiz_table = QUIZ_KINDS[kind]
+    columns = ", ".join(f"{column} = ?" for column in values)
+    conn.execute(
+        f"UPDATE {quiz_table} SET {columns} WHERE id = ?", (*values.values(), quiz_id)
+    )
+
+
+def finalize_quiz(
+    log: QuizAnswerLog,
+    total_time: float,
+    total_questions: int,
+    points_earned: int,
+    quiz_values: dict,
+    percentage_expected=None,
+):
+    """Commits a finished quiz atomically.
+
+    Writes the buffered answers, the user's usage time / created questions /
+    points (and expected percentage, for level determinations) and the
+    ``quiz_values`` columns of the quiz row in a single transaction.
+    """
+    with log._lock:
+        if log.finalized:
+            return
+        with database.connection_manager.transaction() as conn:
+            _insert_answers(conn, log.kind, log.user_id, log.quiz_id, log.answers)
+            user_management.apply_quiz_results(
+                conn,
+                log.user_id,
+                total_time,
+                total_questions,
+                points_earned,
+                percentage_expected,
+            )
+            _update_quiz_row(conn, log.kind, log.quiz_id, quiz_values)
+        log.finalized = True
+    log.discard_journal()
+
+
+def stored_question_ids(kind: str, quiz_id: int):
+    """Returns the ids of the questions answered in a finished quiz, in order."""
+    answers_table, quiz_column, _ = QUIZ_KINDS[kind]
+    rows = database.get_data(
+        f"SELECT question_id FROM {answers_table} WHERE {quiz_column} = ? ORDER BY id",
+        (quiz_id,),
+    )
+    return [row[0] for row in rows]
+
+
+def recover_unfinished_quizzes():
+    """Commits the answers of quizzes interrupted by a restart.
+
+    Returns:
+        int: The number of quizzes recovered.
+    """
+    if not os.path.isdir(QUIZ_JOURNAL_DIRECTORY):
+        return 0
+
+    recovered = 0
+    for filename in os.listdir(QUIZ_JOURNAL_DIRECTORY):
+        if not filename.endswith(".jsonl"):
+            continue
+        path = os.path.join(QUIZ_JOURNAL_DIRECTORY, filename)
+        entries = []
+        with open(path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # Torn last line from the crash
+
+        if entries:
+            kind, quiz_id, user_id = (
+                entries[0]["kind"],
+                entries[0]["quiz_id"],
+                entries[0]["user_id"],
+            )
+            answers_table, quiz_column, _ = QUIZ_KINDS[kind]
+            answers = [
+                (entry["question_id"], entry["user_answer"], entry["is_correct"])
+                for entry in entries
+            ]
+            score = sum(1 for _, _, is_correct in answers if is_correct)
+            with database.connection_manager.transaction() as conn:
+                # Finalized just before the crash, before the journal was removed
+                already_saved = conn.execute(
+                    f"SELECT COUNT(*) FROM {answers_table} WHERE {quiz_column} = ?",
+                    (quiz_id,),
+                ).fetchone()[0]
+                if not already_saved:
+                    _insert_answers(conn, kind, user_id, quiz_id, answers)
+                    if kind == "test":
+                        quiz_values = {"score": score}
+                    else:
+                        quiz_values = {
+                            "percentage": user_management.calculate_percentage_expected(
+                                score, len(answers)
+                            )
+                        }
+                    _update_quiz_row(conn, kind, quiz_id, quiz_values)
+                    recovered += 1
+        os.remove(path)
+
+    if recovered:
+        logger.info(f"Recovered the answers of {recovered} interrupted quizzes")
+    return recovered
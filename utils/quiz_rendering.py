@@ -0,0 +1,114 @@
+"""Pre-rendered question messages for tests and level determinations.
+
+Building a question message means looking up its passage, formatting the
+four options, shuffling them and creating the ``InlineKeyboardMarkup``.
+Doing that in ``send_question`` puts it between the user's tap and the next
+edit, so ``prerender_quiz`` renders every question of a quiz once, when the
+quiz starts. ``send_question`` then only indexes the list and sends.
+
+Run ``python -m utils.quiz_rendering`` for a tap-to-edit microbenchmark.
+"""
+
+import random
+from typing import List, NamedTuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from utils.passage_store import passage_store
+from utils.question_bank import Question
+
+OPTION_LETTERS = ("أ", "ب", "ج", "د")
+
+
+class RenderedQuestion(NamedTuple):
+    """Ready-to-send text and keyboard of one quiz question."""
+
+    question_id: int
+    text: str
+    reply_markup: InlineKeyboardMarkup
+
+
+def render_question(
+    question: Question, number: int, number_format: str = "{number}."
+) -> RenderedQuestion:
+    """Renders one question with its passage and shuffled answer buttons."""
+    passage_content = passage_store.get(question.passage_name)
+    passage_text = f"النص: {passage_content}\n\n" if passage_content else ""
+
+    # Create a list of answer options and shuffle them
+    answer_options = [
+        (f"{letter}. {question.option_text(letter)}", f"answer_{question.id}_{letter}")
+        for letter in OPTION_LETTERS
+    ]
+    random.shuffle(answer_options)
+
+    # Rows of 2 buttons
+    keyboard = [
+        [
+            InlineKeyboardButton(text, callback_data=data)
+            for text, data in answer_options[i : i + 2]
+        ]
+        for i in range(0, len(answer_options), 2)
+    ]
+    text = f"{passage_text}{number_format.format(number=number)} {question.question_text}"
+    return RenderedQuestion(question.id, text, InlineKeyboardMarkup(keyboard))
+
+
+def prerender_quiz(questions, number_format: str = "{number}.") -> List[RenderedQuestion]:
+    """Renders every question of a quiz, in order.
+
+    Takes the Question records the session's ids were built from, so the
+    payloads line up with the ids. Reads passages from disk on a cache miss,
+    so call it off the event loop.
+    """
+    return [
+        render_question(question, index + 1, number_format)
+        for index, question in enumerate(questions)
+    ]
+
+
+if __name__ == "__main__":
+    import asyncio
+    import statistics
+    import time
+
+    class _Message:
+        async def edit_text(self, text, reply_markup=None):
+            return self
+
+    def _fake_question(question_id):
+        return Question(
+            question_id, "أ", f"Question {question_id} " * 10,
+            "Option one", "Option two", "Option three", "Option four",
+            "Explanation", 1, "كمي", "-", f"Passage {question_id % 7}",
+        )
+
+    async def _benchmark(num_questions=100, rounds=200):
+        questions = [_fake_question(i) for i in range(num_questions)]
+        message = _Message()
+
+        on_demand = []
+        for _ in range(rounds):
+            for index, question in enumerate(questions):
+                start = time.perf_counter()
+                rendered = render_question(question, index + 1)
+                await message.edit_text(rendered.text, reply_markup=rendered.reply_markup)
+                on_demand.append(time.perf_counter() - start)
+
+        prerendered = []
+        for _ in range(rounds):
+            payloads = [render_question(q, i + 1) for i, q in enumerate(questions)]
+            for index in range(num_questions):
+                start = time.perf_counter()
+                rendered = payloads[index]
+                await message.edit_text(rendered.text, reply_markup=rendered.reply_markup)
+                prerendered.append(time.perf_counter() - start)
+
+        for name, samples in (("on demand", on_demand), ("prerendered", prerendered)):
+            samples.sort()
+            print(
+                f"{name:>12}: median {statistics.median(samples) * 1e6:.1f} us, "
+                f"p99 {samples[int(len(samples) * 0.99)] * 1e6:.1f} us per tap"
+            )
+
+    asyncio.run(_benchmark())
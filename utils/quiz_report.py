@@ -0,0 +1,432 @@
+"""Native PDF renderer for quiz reports.
+
+The Word path (DocxTemplate -> .docx on disk -> LibreOffice -> .pdf) needs an
+office process for every report. ``render_quiz_report`` draws the same
+layout as the ``Q_AND_A_FILE_PATH`` template directly with fpdf2: the
+template's banner, then for every question a navy question bar, the 2x2
+options table with yellow letter cells, the solution steps and the correct
+option. Arabic text is shaped with ``arabic_reshaper`` and reordered with
+``bidi``, like the statistics charts (using python-bidi's compiled
+``get_display`` rather than the pure-Python ``bidi.algorithm`` one).
+
+It takes the same ``quiz_data`` dicts the template is rendered with, so the
+PDF generators can fall back to the Word path (``QUIZ_PDF_RENDERER = "docx"``,
+a missing ``QUIZ_REPORT_FONT_FILE`` or any rendering error).
+
+Everything below the question number depends only on the question, so each
+question block is laid out once into a fragment - rows of drawing
+operations with the text already shaped and wrapped - and kept in an LRU
+cache keyed by question id, ``TEMPLATE_VERSION`` and a hash of the content.
+A report replays the cached fragments under its banner; the
+``report_fragments`` hit rate in ``utils.metrics`` shows how much of the
+rendering is shared between users.
+
+Run ``python -m utils.quiz_report`` to time a 100-question report.
+"""
+
+import functools
+import hashlib
+import io
+import logging
+import os
+import threading
+import zipfile
+from collections import OrderedDict
+from typing import NamedTuple, Tuple
+
+import arabic_reshaper
+from bidi import get_display
+from fpdf import FPDF
+
+from config import (
+    Q_AND_A_FILE_PATH,
+    QUIZ_PDF_RENDERER,
+    QUIZ_REPORT_FONT_FILE,
+    QUIZ_REPORT_FRAGMENT_CACHE_SIZE,
+)
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the layout below changes, so cached fragments are not reused
+TEMPLATE_VERSION = 2
+
+# Colors and geometry of the Q&A template (A4, margins in mm)
+NAVY = (0x36, 0x45, 0x64)
+YELLOW = (0xFF, 0xD9, 0x6A)
+WHITE = (0xFF, 0xFF, 0xFF)
+PAGE_MARGIN_TOP = 19.4
+PAGE_MARGIN_RIGHT = 26.5
+PAGE_MARGIN_BOTTOM = 12
+PAGE_MARGIN_LEFT = 20.5
+FONT_SIZE = 12
+TITLE_FONT_SIZE = 14
+LINE_HEIGHT = 7
+LETTER_CELL_WIDTH = 10
+NUMBER_CELL_WIDTH = 12
+CELL_PADDING = 2
+
+# Options table: (letter, quiz_data key) for the right and left half of each row
+OPTION_ROWS = (
+    (("أ", "OptionA"), ("ب", "OptionB")),
+    (("ج", "OptionC"), ("د", "OptionD")),
+)
+# The quiz_data fields a question block is drawn from
+FRAGMENT_FIELDS = (
+    "QuestionText",
+    "OptionA",
+    "OptionB",
+    "OptionC",
+    "OptionD",
+    "CorrectAnswer",
+    "Explanation",
+)
+
+_banner = None
+_banner_lock = threading.Lock()
+
+
+def _template_banner():
+    """Returns the banner image of the Word template (read once), or None."""
+    global _banner
+    with _banner_lock:
+        if _banner is None:
+            try:
+                with zipfile.ZipFile(Q_AND_A_FILE_PATH) as template:
+                    media = sorted(
+                        name for name in template.namelist() if name.startswith("word/media/")
+                    )
+                    _banner = template.read(media[0]) if media else b""
+            except (OSError, zipfile.BadZipFile) as e:
+                logger.warning(f"Could not read the report banner from the template: {e}")
+                _banner = b""
+        return _banner or None
+
+
+class _CachedConfiguration:
+    """Configuration section whose values are parsed once."""
+
+    def __init__(self, section):
+        self._section = section
+        self._values = {}
+
+    def _lookup(self, method, key, fallback):
+        cache_key = (method, key)
+        if cache_key not in self._values:
+            self._values[cache_key] = getattr(self._section, method)(key, fallback=fallback)
+        return self._values[cache_key]
+
+    def get(self, key, fallback=None):
+        return self._lookup("get", key, fallback)
+
+    def getboolean(self, key, fallback=None):
+        return self._lookup("getboolean", key, fallback)
+
+
+class _Reshaper(arabic_reshaper.ArabicReshaper):
+    """ArabicReshaper without the per-call configuration parsing.
+
+    The library re-reads its configuration and rebuilds the ligature regex
+    (its property means to cache it but never does, up to 3.0.0) on every
+    ``reshape`` call, which made a report take seconds.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.configuration = _CachedConfiguration(self.configuration)
+
+    # Releases that already cache the regex (a cached_property, no ``fget``)
+    # keep their own behaviour
+    _build_ligatures_re = getattr(
+        getattr(arabic_reshaper.ArabicReshaper, "_ligatures_re", None), "fget", None
+    )
+    if _build_ligatures_re is not None:
+
+        @functools.cached_property
+        def _ligatures_re(self):
+            return self._build_ligatures_re()
+
+
+_reshaper = _Reshaper()
+
+
+@functools.lru_cache(maxsize=None)
+def native_renderer_enabled() -> bool:
+    """True if quiz PDFs are drawn here; checks the font once, at the first call."""
+    if QUIZ_PDF_RENDERER != "native":
+        return False
+    if not os.path.isfile(QUIZ_REPORT_FONT_FILE):
+        logger.error(
+            f'QUIZ_PDF_RENDERER is "native" but the font {QUIZ_REPORT_FONT_FILE} does '
+            "not exist; quiz PDFs use the Word template. Add an Arabic TTF font there "
+            'or set QUIZ_PDF_RENDERER = "docx".'
+        )
+        return False
+    return True
+
+
+@functools.lru_cache(maxsize=4096)
+def shape(text) -> str:
+    """Reshapes and reorders Arabic text for display."""
+    return get_display(_reshaper.reshape(text))
+
+
+class QuizReport(FPDF):
+    """A quiz report PDF being drawn, right to left."""
+
+    def __init__(self):
+        super().__init__(orientation="P", unit="mm", format="A4")
+        self.set_margins(PAGE_MARGIN_LEFT, PAGE_MARGIN_TOP, PAGE_MARGIN_RIGHT)
+        self.set_auto_page_break(False)
+        self.add_font("Report", "", QUIZ_REPORT_FONT_FILE)
+        self.set_font("Report", size=FONT_SIZE)
+        self._word_widths = {}  # (font size, word) -> width
+
+    @property
+    def content_width(self):
+        return self.w - self.l_margin - self.r_margin
+
+    def _word_width(self, word):
+        key = (self.font_size_pt, word)
+        width = self._word_widths.get(key)
+        if width is None:
+            # Arabic letters only join inside a word, so shaping word by word
+            # gives the same widths as shaping the whole line
+            width = self.get_string_width(_reshaper.reshape(word))
+            self._word_widths[key] = width
+        return width
+
+    def wrap(self, text, width):
+        """Splits logical (unshaped) text into lines fitting ``width``."""
+        space = self.get_string_width(" ")
+        lines = []
+        for paragraph in str(text).splitlines() or [""]:
+            line, line_width = [], 0.0
+            for word in paragraph.split():
+                word_width = self._word_width(word)
+                if line and line_width + space + word_width > width:
+                    lines.append(" ".join(line))
+                    line, line_width = [], 0.0
+                line_width += word_width + (space if line else 0)
+                line.append(word)
+            lines.append(" ".join(line))
+        return lines
+
+    def ensure_space(self, height):
+        if self.get_y() + height > self.h - PAGE_MARGIN_BOTTOM:
+            self.add_page()
+
+    def text_box(self, x, y, width, lines, fill=None, color=NAVY, align="R"):
+        """Returns the operations drawing wrapped lines in a box, and its height."""
+        height = max(1, len(lines)) * LINE_HEIGHT
+        ops = []
+        if fill is not None:
+            ops.append(("rect", x, y, width, height, fill, "F"))
+        for index, line in enumerate(lines):
+            ops.append(
+                (
+                    "text",
+                    x + CELL_PADDING,
+                    y + index * LINE_HEIGHT,
+                    width - 2 * CELL_PADDING,
+                    shape(str(line)),
+                    color,
+                    align,
+                    self.font_size_pt,
+                )
+            )
+        return ops, height
+
+    def paragraph(self, text, fill=None, color=NAVY):
+        """Returns one row per line of text across the content width."""
+        rows = []
+        for line in self.wrap(text, self.content_width - 2 * CELL_PADDING):
+            ops, height = self.text_box(self.l_margin, 0, self.content_width, [line], fill, color)
+            rows.append(Row(height, tuple(ops)))
+        return rows
+
+    def build_fragment(self, data) -> "Fragment":
+        """Lays out one question block (everything but its number)."""
+        width = self.content_width
+        x = self.l_margin
+        rows = []
+
+        # Question bar, with the question number in its own cell on the right
+        self.set_font_size(TITLE_FONT_SIZE)
+        text_width = width - NUMBER_CELL_WIDTH
+        lines = self.wrap(data["QuestionText"], text_width - 2 * CELL_PADDING)
+        ops, height = self.text_box(x, 0, text_width, lines, NAVY, WHITE)
+        ops.insert(0, ("rect", x + text_width, 0, NUMBER_CELL_WIDTH, height, NAVY, "F"))
+        ops.append(("number", x + text_width, 0, NUMBER_CELL_WIDTH, self.font_size_pt))
+        # Keep the bar on the same page as the start of its options
+        rows.append(Row(height, tuple(ops), keep=height + 2 * LINE_HEIGHT))
+        self.set_font_size(FONT_SIZE)
+
+        # Options table, two options per row
+        half = width / 2
+        option_width = half - LETTER_CELL_WIDTH
+        for option_row in OPTION_ROWS:
+            cells = [
+                (letter, self.wrap(data[key], option_width - 2 * CELL_PADDING))
+                for letter, key in option_row
+            ]
+            height = max(len(option_lines) for _, option_lines in cells) * LINE_HEIGHT
+            ops = []
+            for column, (letter, option_lines) in enumerate(cells):
+                right = x + width - column * half
+                ops += self.text_box(
+                    right - LETTER_CELL_WIDTH, 0, LETTER_CELL_WIDTH, [letter], YELLOW, NAVY, "C"
+                )[0]
+                ops += self.text_box(right - half, 0, option_width, option_lines)[0]
+                ops.append(("rect", right - half, 0, half, height, YELLOW, "D"))
+            rows.append(Row(height, tuple(ops)))
+
+        # Solution steps and the correct option
+        rows.append(Row(2, ()))
+        rows += self.paragraph("خطوات الحل:", color=NAVY)
+        rows += self.paragraph(data["Explanation"])
+        label_width = 35
+        right = x + width - label_width
+        ops = self.text_box(right, 0, label_width, ["الخيار الصحيح"], NAVY, WHITE)[0]
+        ops += self.text_box(
+            right - LETTER_CELL_WIDTH,
+            0,
+            LETTER_CELL_WIDTH,
+            [data["CorrectAnswer"]],
+            YELLOW,
+            NAVY,
+            "C",
+        )[0]
+        rows.append(Row(LINE_HEIGHT + 6, tuple(ops), keep=LINE_HEIGHT))
+        return tuple(rows)
+
+    def draw_fragment(self, fragment, number):
+        """Draws a question block at the cursor, breaking pages between rows."""
+        for row in fragment:
+            if not row.ops:
+                self.set_y(self.get_y() + row.height)
+                continue
+            self.ensure_space(row.keep or row.height)
+            y = self.get_y()
+            for op in row.ops:
+                self._draw(op, y, number)
+            self.set_y(y + row.height)
+
+    def _draw(self, op, top, number):
+        kind = op[0]
+        if kind == "rect":
+            _, x, y, width, height, color, style = op
+            if style == "F":
+                self.set_fill_color(*color)
+            else:
+                self.set_draw_color(*color)
+            self.rect(x, top + y, width, height, style=style)
+        elif kind == "text":
+            _, x, y, width, text, color, align, size = op
+            self.set_font_size(size)
+            self.set_text_color(*color)
+            self.set_xy(x, top + y)
+            self.cell(width, LINE_HEIGHT, text, align=align)
+        elif kind == "number":
+            _, x, y, width, size = op
+            self.set_font_size(size)
+            self.set_text_color(*WHITE)
+            self.set_xy(x, top + y)
+            self.cell(width, LINE_HEIGHT, f"{number}.", align="C")
+        self.set_font_size(FONT_SIZE)
+
+
+class Row(NamedTuple):
+    """One unbreakable band of a question block.
+
+    ``ops`` are drawing operations with y relative to the row's top; ``keep``
+    is the space the row needs left on the page (its height by default).
+    """
+
+    height: float
+    ops: tuple
+    keep: float = 0
+
+
+Fragment = Tuple[Row, ...]
+
+
+class FragmentCache:
+    """LRU cache of laid-out question blocks shared by every report."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._fragments = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(data):
+        content = "\x1f".join(str(data.get(field, "")) for field in FRAGMENT_FIELDS)
+        digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+        return (data.get("QuestionId"), TEMPLATE_VERSION, digest)
+
+    def get(self, report: QuizReport, data) -> Fragment:
+        key = self.key(data)
+        with self._lock:
+            fragment = self._fragments.get(key)
+            if fragment is not None:
+                self._fragments.move_to_end(key)
+        if fragment is not None:
+            metrics.counter("report_fragments.hits").inc()
+            return fragment
+
+        metrics.counter("report_fragments.misses").inc()
+        fragment = report.build_fragment(data)
+        with self._lock:
+            self._fragments[key] = fragment
+            while len(self._fragments) > self.max_size:
+                self._fragments.popitem(last=False)
+        return fragment
+
+
+fragment_cache = FragmentCache(QUIZ_REPORT_FRAGMENT_CACHE_SIZE)
+
+
+def render_quiz_report(quiz_data, output_path):
+    """Renders the template's ``questions`` data to a PDF at ``output_path``."""
+    pdf = QuizReport()
+    pdf.add_page()
+    banner = _template_banner()
+    if banner:
+        info = pdf.image(io.BytesIO(banner), x=12, y=6, w=186)
+        pdf.set_y(6 + info.rendered_height + 6)
+    for data in quiz_data:
+        pdf.draw_fragment(fragment_cache.get(pdf, data), data["QuestionNumber"])
+    pdf.output(output_path)
+    return output_path
+
+
+if __name__ == "__main__":
+    import sys
+    import tempfile
+    import time
+
+    if not os.path.isfile(QUIZ_REPORT_FONT_FILE):
+        sys.exit(f"Font not found: {QUIZ_REPORT_FONT_FILE} (add an Arabic TTF font there)")
+
+    sample = [
+        {
+            "QuestionNumber": number,
+            "QuestionId": number,
+            "QuestionText": "إذا كان مجموع عددين 30 والفرق بينهما 6 فما هو العدد الأكبر؟",
+            "OptionA": "18",
+            "OptionB": "12",
+            "OptionC": "24",
+            "OptionD": "15",
+            "CorrectAnswer": "أ",
+            "Explanation": "نجمع المعادلتين: س + ص = 30 و س - ص = 6 فيكون 2س = 36 ومنه س = 18. " * 3,
+            "MainCategoryName": "جبر",
+        }
+        for number in range(1, 101)
+    ]
+    output = os.path.join(tempfile.gettempdir(), "quiz_report_benchmark.pdf")
+    for label in ("cold fragment cache", "warm fragment cache"):
+        start = time.perf_counter()
+        render_quiz_report(sample, output)
+        print(f"100 questions, {label}: {time.perf_counter() - start:.3f}s -> {output}")
+    print(f"Fragment cache hit rate: {metrics.hit_rate('report_fragments'):.1%}")
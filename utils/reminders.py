@@ -1,13 +1,13 @@
 import datetime
 import os
 from typing import Dict
-import pandas as pd
 from telegram import Bot, Update
 from telegram.ext import Application, CallbackContext, CommandHandler
 
 from AIModels.tts import generate_tts
 from config import REMINDER_FILE
 from utils import user_management
+from utils.content_bundle import read_excel
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import logging
 from apscheduler.triggers.interval import IntervalTrigger
@@ -19,7 +19,7 @@ class ReminderManager:
         self.reminder_file = reminder_file
         self.scheduler = AsyncIOScheduler()
         self.user_jobs: Dict[int, list] = {}  # Store jobs by user_id
-        self.reminders_df = pd.read_excel(reminder_file)
+        self.reminders_df = read_excel(reminder_file)
 
     async def send_reminder(self, user_id: int, user_name: str, use_tts: bool):
         """Sends a reminder to the user."""
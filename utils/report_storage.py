@@ -0,0 +1,237 @@
+"""Storage of the users' quiz reports, with quotas, retention and GC.
+
+Reports used to be written to ``user_tests/<user_id>/`` and kept forever.
+``user_directory`` now spreads the users over 256 shard directories
+(``user_tests/<2 hex digits>/<user_id>/``) so no directory grows huge, and
+``collect_garbage`` (run every ``USER_REPORTS_GC_INTERVAL_SECONDS``):
+
+- deletes files no quiz row points to (failed conversions' ``.docx``,
+  replaced reports), after a grace period so running jobs are not touched;
+- clears ``pdf_path`` columns whose file is gone;
+- gzips reports older than ``USER_REPORTS_ARCHIVE_AFTER_DAYS``;
+- deletes reports older than ``USER_REPORTS_RETENTION_DAYS`` and the oldest
+  reports of users above ``USER_REPORTS_QUOTA_BYTES``.
+
+The file work runs against a snapshot of the quiz rows, outside any
+transaction; the ``pdf_path`` changes are applied at the end in one short
+transaction, and only to rows still pointing at the file that was handled.
+Only regular files under ``USER_REPORTS_DIRECTORY`` are ever touched.
+
+Cleared reports can be rendered again from the stored answers when
+``QUIZ_PDF_ON_DEMAND`` is set. Send stored reports with ``open_report``,
+which transparently reads archived ones.
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import NamedTuple
+
+from config import (
+    USER_REPORTS_ARCHIVE_AFTER_DAYS,
+    USER_REPORTS_DIRECTORY,
+    USER_REPORTS_ORPHAN_GRACE_SECONDS,
+    USER_REPORTS_QUOTA_BYTES,
+    USER_REPORTS_RETENTION_DAYS,
+)
+from utils import database
+from utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SUFFIX = ".gz"
+DAY_SECONDS = 24 * 60 * 60
+
+# Quiz tables whose pdf_path points into the report storage
+REPORT_TABLES = ("previous_tests", "level_determinations")
+
+
+def _shard(user_id) -> str:
+    return hashlib.sha1(str(user_id).encode("utf-8")).hexdigest()[:2]
+
+
+def user_directory(user_id) -> str:
+    """Returns (and creates) the directory holding a user's reports."""
+    directory = os.path.join(USER_REPORTS_DIRECTORY, _shard(user_id), str(user_id))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+@contextmanager
+def open_report(path):
+    """Opens a stored report for sending; yields ``(file, filename)``."""
+    if path.endswith(ARCHIVE_SUFFIX):
+        with gzip.open(path, "rb") as f:
+            yield f, os.path.basename(path)[: -len(ARCHIVE_SUFFIX)]
+    else:
+        with open(path, "rb") as f:
+            yield f, os.path.basename(path)
+
+
+class GcReport(NamedTuple):
+    orphans_deleted: int = 0
+    rows_reconciled: int = 0
+    archived: int = 0
+    expired: int = 0
+    over_quota: int = 0
+    reclaimed_bytes: int = 0
+
+
+def _referenced_reports():
+    """Returns ``{normalized path: [(table, row id, pdf_path), ...]}`` of the stored reports."""
+    referenced = defaultdict(list)
+    with database.connection_manager.transaction() as conn:
+        # Quizzes are created with an empty pdf_path until their report exists
+        for table in REPORT_TABLES:
+            for row_id, path in conn.execute(
+                f"SELECT id, pdf_path FROM {table} WHERE pdf_path IS NOT NULL AND pdf_path != ''"
+            ):
+                referenced[os.path.normpath(path)].append((table, row_id, path))
+        for (path,) in conn.execute(
+            "SELECT answers_path FROM previous_tests "
+            "WHERE answers_path IS NOT NULL AND answers_path != ''"
+        ):
+            referenced.setdefault(os.path.normpath(path), [])
+    return referenced
+
+
+def _apply_pdf_paths(updates):
+    """Stores the new ``pdf_path`` of ``[(rows, path)]`` in one transaction.
+
+    A row whose ``pdf_path`` changed since the snapshot (a report rendered
+    meanwhile) is left alone.
+    """
+    if not updates:
+        return
+    with database.connection_manager.transaction() as conn:
+        for rows, path in updates:
+            for table, row_id, old_path in rows:
+                conn.execute(
+                    f"UPDATE {table} SET pdf_path = ? WHERE id = ? AND pdf_path = ?",
+                    (path, row_id, old_path),
+                )
+
+
+def _in_storage(path) -> bool:
+    """True if ``path`` lies under ``USER_REPORTS_DIRECTORY``."""
+    storage = os.path.abspath(USER_REPORTS_DIRECTORY)
+    path = os.path.abspath(path)
+    return path != storage and os.path.commonpath([path, storage]) == storage
+
+
+def _archive(path) -> str:
+    archived_path = path + ARCHIVE_SUFFIX
+    with open(path, "rb") as source, gzip.open(archived_path, "wb") as target:
+        shutil.copyfileobj(source, target)
+    os.remove(path)
+    return archived_path
+
+
+def collect_garbage(now=None) -> GcReport:
+    """Runs one storage pass; blocking, call it off the event loop."""
+    now = now or time.time()
+    orphans = reconciled = archived = expired = over_quota = reclaimed = 0
+    referenced = _referenced_reports()
+    updates = []  # [(rows, new pdf_path)]
+
+    # Rows pointing at files that no longer exist; paths outside the storage
+    # are not ours to manage
+    for path, rows in list(referenced.items()):
+        if not rows or not _in_storage(path):
+            continue
+        if not os.path.exists(path):
+            updates.append((rows, None))
+            reconciled += len(rows)
+            del referenced[path]
+
+    # Files no row points to
+    for root, _, files in os.walk(USER_REPORTS_DIRECTORY):
+        for name in files:
+            path = os.path.normpath(os.path.join(root, name))
+            if path in referenced:
+                continue
+            try:
+                stat = os.stat(path)
+                if now - stat.st_mtime < USER_REPORTS_ORPHAN_GRACE_SECONDS:
+                    continue  # May still be written by a running job
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove orphan report {path}: {e}")
+                continue
+            orphans += 1
+            reclaimed += stat.st_size
+
+    # Age-based retention and archiving, and the size of each user's reports
+    user_reports = defaultdict(list)  # user directory -> [(mtime, size, path, rows)]
+    for path, rows in referenced.items():
+        if not rows or not _in_storage(path) or not os.path.isfile(path):
+            continue
+        try:
+            stat = os.stat(path)
+            age_days = (now - stat.st_mtime) / DAY_SECONDS
+            if age_days > USER_REPORTS_RETENTION_DAYS:
+                os.remove(path)
+                updates.append((rows, None))
+                expired += 1
+                reclaimed += stat.st_size
+                continue
+            if age_days > USER_REPORTS_ARCHIVE_AFTER_DAYS and not path.endswith(ARCHIVE_SUFFIX):
+                archived_path = _archive(path)
+                # Keep the age so retention still counts from the report's creation
+                os.utime(archived_path, (stat.st_atime, stat.st_mtime))
+                updates.append((rows, archived_path))
+                archived += 1
+                size = os.path.getsize(archived_path)
+                reclaimed += stat.st_size - size
+                path = archived_path
+                # The quota below must match the rows against the archived path
+                rows = [(table, row_id, archived_path) for table, row_id, _ in rows]
+            else:
+                size = stat.st_size
+        except OSError as e:
+            logger.warning(f"Could not expire or archive report {path}: {e}")
+            continue
+        user_reports[os.path.dirname(path)].append((stat.st_mtime, size, path, rows))
+
+    # Per-user quota: keep the newest reports that fit
+    for reports in user_reports.values():
+        used = 0
+        for _, size, path, rows in sorted(reports, key=lambda r: r[0], reverse=True):
+            used += size
+            if used <= USER_REPORTS_QUOTA_BYTES:
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Could not remove over-quota report {path}: {e}")
+                continue
+            updates.append((rows, None))
+            over_quota += 1
+            reclaimed += size
+
+    _apply_pdf_paths(updates)
+
+    report = GcReport(orphans, reconciled, archived, expired, over_quota, reclaimed)
+    metrics.counter("report_storage.reclaimed_bytes").inc(reclaimed)
+    logger.info(
+        f"Report storage GC: {orphans} orphans deleted, {reconciled} rows reconciled, "
+        f"{archived} archived, {expired} expired, {over_quota} over quota, "
+        f"{reclaimed / (1024 * 1024):.1f} MB reclaimed"
+    )
+    return report
+
+
+async def collect_garbage_periodically(interval_seconds: float):
+    """Runs ``collect_garbage`` now and every ``interval_seconds`` (run as a task)."""
+    while True:
+        try:
+            await asyncio.to_thread(collect_garbage)
+        except Exception as e:
+            logger.error(f"Error collecting report storage garbage: {e}")
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,193 @@
+"""In-memory daily usage quotas (ChatGPT messages, AI images).
+
+Checking a daily limit used to cost a SELECT (and sometimes an INSERT or a
+reset UPDATE) before every assistant message and another UPDATE after it,
+and two concurrent messages could both pass the check at the last free slot.
+Each ``DailyQuota`` now keeps the users' counters for the current day in
+memory:
+
+- A user's counter is loaded from the database on first use each day and
+  starts from zero when the day changes (the reset epoch is the date).
+- ``reserve`` takes a slot atomically, counting uses still in progress, so
+  the limit holds under concurrent updates. The caller then ``commit``s the
+  use once it succeeded or ``release``s the slot if it failed.
+- Committed uses are written behind: ``flush`` (every
+  ``USAGE_QUOTA_FLUSH_INTERVAL_SECONDS`` and at shutdown) hands the changed
+  counters to the group-commit writer, which stores them in batches.
+"""
+
+import asyncio
+import datetime
+import logging
+import threading
+from typing import Callable, List, Tuple
+
+from utils import async_database, database
+from utils.metrics import metrics
+from utils.write_queue import group_writer
+
+logger = logging.getLogger(__name__)
+
+
+class UsageEntry:
+    """One user's usage on one day."""
+
+    __slots__ = ("day", "used", "reserved", "pending")
+
+    def __init__(self, day: datetime.date, used: int):
+        self.day = day
+        self.used = used  # Committed uses, including the ones not written yet
+        self.reserved = 0  # Uses in progress
+        self.pending = []  # Times of the committed uses not written yet
+
+
+class DailyQuota:
+    """Per-user daily counters with atomic reservations and write-behind.
+
+    ``load(user_id, day)`` returns the uses already stored for ``day``
+    (blocking); ``statements(user_id, entry)`` returns the ``(query, params)``
+    writes that store the entry's pending uses.
+    """
+
+    def __init__(self, name: str, load: Callable, statements: Callable):
+        self.name = name
+        self._load = load
+        self._statements = statements
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _current(self, user_id, today):
+        """Returns the user's entry for today, or None if it must be loaded."""
+        entry = self._entries.get(user_id)
+        if entry is not None and entry.day != today:
+            # A new day: keep the old day's uses that are not written yet
+            self._write(user_id, entry)
+            entry = self._entries[user_id] = UsageEntry(today, 0)
+        return entry
+
+    async def _entry(self, user_id) -> UsageEntry:
+        today = datetime.date.today()
+        with self._lock:
+            entry = self._current(user_id, today)
+        if entry is None:
+            used = await async_database.run(self._load, user_id, today)
+            with self._lock:
+                # Another update may have loaded it meanwhile; keep the first one
+                entry = self._current(user_id, today) or self._entries.setdefault(
+                    user_id, UsageEntry(today, used)
+                )
+        return entry
+
+    async def usage(self, user_id) -> int:
+        """Returns the user's committed uses today."""
+        return (await self._entry(user_id)).used
+
+    async def reserve(self, user_id, limit: int) -> Tuple[bool, int]:
+        """Takes one of the user's ``limit`` daily uses if one is left.
+
+        Returns ``(allowed, used)`` where ``used`` counts the committed uses
+        before this one.
+        """
+        entry = await self._entry(user_id)
+        with self._lock:
+            used = entry.used
+            allowed = entry.used + entry.reserved < limit
+            if allowed:
+                entry.reserved += 1
+        if not allowed:
+            metrics.counter(f"quota.{self.name}.denied").inc()
+        return allowed, used
+
+    async def commit(self, user_id):
+        """Counts a reserved use as done."""
+        entry = await self._entry(user_id)
+        with self._lock:
+            entry.reserved = max(0, entry.reserved - 1)
+            entry.used += 1
+            entry.pending.append(datetime.datetime.now())
+
+    async def release(self, user_id):
+        """Gives back a reserved use that did not happen."""
+        entry = await self._entry(user_id)
+        with self._lock:
+            entry.reserved = max(0, entry.reserved - 1)
+
+    def _write(self, user_id, entry: UsageEntry):
+        if not entry.pending:
+            return
+        for query, params in self._statements(user_id, entry):
+            group_writer.submit(query, params)
+        entry.pending = []
+
+    def flush(self):
+        """Queues the pending uses for the group-commit writer; drops past days."""
+        today = datetime.date.today()
+        with self._lock:
+            for user_id, entry in list(self._entries.items()):
+                self._write(user_id, entry)
+                if entry.day != today and not entry.reserved:
+                    del self._entries[user_id]
+
+
+def _day_string(day: datetime.date) -> str:
+    return day.strftime("%Y-%m-%d")
+
+
+def _load_chatgpt_usage(user_id, day) -> int:
+    rows = database.get_data(
+        "SELECT usage_count, last_used FROM chatgpt_usage WHERE user_id = ?", (user_id,)
+    )
+    if rows and rows[0][1] == _day_string(day):
+        return rows[0][0] or 0
+    return 0
+
+
+def _chatgpt_statements(user_id, entry: UsageEntry) -> List[tuple]:
+    # chatgpt_usage holds one counter per user: store its latest value
+    return [
+        (
+            """
+            INSERT INTO chatgpt_usage (user_id, usage_count, last_used) VALUES (?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                usage_count = excluded.usage_count, last_used = excluded.last_used
+            """,
+            (user_id, entry.used, _day_string(entry.day)),
+        )
+    ]
+
+
+def _load_ai_image_usage(user_id, day) -> int:
+    day_start = datetime.datetime(day.year, day.month, day.day, 0, 0, 0)
+    rows = database.get_data(
+        "SELECT COUNT(*) FROM ai_image_usage WHERE user_id = ? AND usage_time >= ?",
+        (user_id, day_start),
+    )
+    return rows[0][0]
+
+
+def _ai_image_statements(user_id, entry: UsageEntry) -> List[tuple]:
+    # ai_image_usage logs one row per generated image
+    return [
+        ("INSERT INTO ai_image_usage (user_id, usage_time) VALUES (?, ?)", (user_id, used_at))
+        for used_at in entry.pending
+    ]
+
+
+chatgpt_quota = DailyQuota("chatgpt", _load_chatgpt_usage, _chatgpt_statements)
+ai_image_quota = DailyQuota("ai_image", _load_ai_image_usage, _ai_image_statements)
+QUOTAS = (chatgpt_quota, ai_image_quota)
+
+
+def flush_quotas():
+    for quota in QUOTAS:
+        quota.flush()
+
+
+async def flush_quotas_periodically(interval_seconds: float):
+    """Writes the changed counters every ``interval_seconds`` (run as a task)."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            flush_quotas()
+        except Exception as e:
+            logger.error(f"Error flushing the usage quotas: {e}")
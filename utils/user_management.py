@@ -2,14 +2,14 @@ import random
 import string
 from datetime import datetime, timedelta
 
-from utils import database
+from utils import async_database, database
 
 
 async def generate_referral_code():
     """Generates a unique 6-character referral code."""
     while True:
         code = "".join(random.choices(string.ascii_uppercase + string.digits, k=6))
-        user_exists = database.get_data(
+        user_exists = await async_database.get_data(
             "SELECT 1 FROM users WHERE referral_code = ?", (code,)
         )
         if not user_exists:
@@ -18,7 +18,7 @@ async def generate_referral_code():
 
 async def user_exists(user_id):
     """Checks if a user exists in the database."""
-    user_exists = database.get_data(
+    user_exists = await async_database.get_data(
         "SELECT 1 FROM users WHERE telegram_id = ?", (user_id,)
     )
     return True if user_exists else False
@@ -26,7 +26,7 @@ async def user_exists(user_id):
 
 async def user_exists_by_referral_code(referral_code):
     """Checks if a user exists with the given referral code."""
-    user_exists = database.get_data(
+    user_exists = await async_database.get_data(
         "SELECT 1 FROM users WHERE referral_code = ?", (referral_code,)
     )
     return True if user_exists else False
@@ -34,16 +34,14 @@ async def user_exists_by_referral_code(referral_code):
 
 def get_user_data(user_id: int) -> dict:
     """Retrieves user data from the database."""
-    conn = database.create_connection()  # Create connection inside the function
-    cursor = conn.cursor()  # Create cursor inside the function
-    query = "SELECT * FROM users WHERE telegram_id = ?"
-    params = (user_id,)
-    cursor.execute(query, params)
-    user_data = cursor.fetchall()
-    conn.close()  # Close the connection before exiting the function
+    cursor = database.create_connection().cursor()
+    cursor.execute("SELECT * FROM users WHERE telegram_id = ?", (user_id,))
+    user_data = cursor.fetchone()
+    columns = [column[0] for column in cursor.description]
+    cursor.close()
 
     if user_data:
-        return dict(zip([column[0] for column in cursor.description], user_data[0]))
+        return dict(zip(columns, user_data))
     else:
         return {}
 
@@ -52,7 +50,7 @@ async def save_user_data(user_data, context, user_id):
     """Saves user data to the SQLite database."""
     referral_code = await generate_referral_code()
 
-    database.execute_query(
+    await async_database.execute_query(
         "INSERT INTO users (start_time, name, class, voice_written, taking_qiyas_before, last_score, referral_code, gender, telegram_username, telegram_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
         (
             datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
@@ -80,7 +78,7 @@ async def update_user_data(user_id, data):
     # Build the SET clause for the UPDATE statement dynamically
     set_clause = ", ".join(f"{key} = ?" for key in data)
 
-    database.execute_query(
+    await async_database.execute_query(
         f"UPDATE users SET {set_clause} WHERE telegram_id = ?",
         tuple(data.values()) + (user_id,),
     )
@@ -129,14 +127,12 @@ def update_user_percentage_expected(user_id, percentage_expected):
     )
 
 
-def update_user_usage_time(user_id, duration_seconds):
-    """Updates the user's total usage time in the database."""
-    conn = database.create_connection()
-    cursor = conn.cursor()
-
+def _add_usage_time(cursor, user_id, duration_seconds):
+    """Adds to the user's usage time using an open cursor."""
     # Retrieve current usage time (if any)
     cursor.execute("SELECT usage_time FROM users WHERE telegram_id = ?", (user_id,))
-    current_usage_time_str = cursor.fetchone()[0]
+    row = cursor.fetchone()
+    current_usage_time_str = row[0] if row else None
 
     # Convert current usage time to seconds (if it exists)
     if current_usage_time_str:
@@ -159,8 +155,12 @@ def update_user_usage_time(user_id, duration_seconds):
         "UPDATE users SET usage_time = ? WHERE telegram_id = ?",
         (new_total_usage_time_str, user_id),
     )
-    conn.commit()
-    conn.close()
+
+
+def update_user_usage_time(user_id, duration_seconds):
+    """Updates the user's total usage time in the database."""
+    with database.connection_manager.transaction() as conn:
+        _add_usage_time(conn.cursor(), user_id, duration_seconds)
 
 
 def update_user_created_questions(user_id, num_questions_created):
@@ -171,31 +171,62 @@ def update_user_created_questions(user_id, num_questions_created):
     )
 
 
+def apply_quiz_results(
+    conn,
+    user_id,
+    duration_seconds,
+    num_questions_created,
+    points_earned,
+    percentage_expected=None,
+):
+    """Updates every counter touched by a finished quiz on an open connection.
+
+    Used by ``quiz_log.finalize_quiz`` so the counters are committed in the
+    same transaction as the quiz answers.
+    """
+    cursor = conn.cursor()
+    _add_usage_time(cursor, user_id, duration_seconds)
+    cursor.execute(
+        """
+        UPDATE users
+        SET total_number_of_created_questions = total_number_of_created_questions + ?,
+            points = points + ?
+        WHERE telegram_id = ?
+        """,
+        (num_questions_created, points_earned, user_id),
+    )
+    if percentage_expected is not None:
+        cursor.execute(
+            "UPDATE users SET percentage_expected = ? WHERE telegram_id = ?",
+            (percentage_expected, user_id),
+        )
+
+
 async def get_user_setting(user_id, setting_name):
     """Retrieves a specific setting for a user."""
     query = f"SELECT {setting_name} FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await async_database.get_data(query, (user_id,))
     return result[0][0] if result else None  # Return the setting value or None
 
 
 async def get_user_reminder_times_per_week(user_id):
     """Retrieves a specific setting for a user."""
     query = f"SELECT reminder_times_per_week FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await async_database.get_data(query, (user_id,))
     return result[0][0] if result else None  # Return the setting value or None
 
 
 async def get_user_name(user_id):
     """Retrieves a specific setting for a user."""
     query = f"SELECT name FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await async_database.get_data(query, (user_id,))
     return result[0][0] if result else None  # Return the setting value or None
 
 
 async def get_user_for_reminder(user_id):
     """Retrieves a specific setting for a user."""
     query = f"SELECT name, voice_written, reminder_times_per_week FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await async_database.get_data(query, (user_id,))
     user_name = result[0][0]
     preferred_method = "written"
     frequency = result[0][2]
@@ -205,19 +236,19 @@ async def get_user_for_reminder(user_id):
 async def update_user_setting(user_id, setting_name, new_value):
     """Updates a specific setting for a user."""
     query = f"UPDATE users SET {setting_name} = ? WHERE telegram_id = ?"
-    database.execute_query(query, (new_value, user_id))
+    await async_database.execute_query(query, (new_value, user_id))
 
 
 async def update_reminder_frequency(user_id, frequency):
     """Updates the user's reminder frequency in the database."""
     query = "UPDATE users SET reminder_times_per_week = ? WHERE telegram_id = ?"
-    database.execute_query(query, (frequency, user_id))
+    await async_database.execute_query(query, (frequency, user_id))
 
 
 async def get_reminder_frequency(user_id):
     """Gets the user's reminder frequency from the database."""
     query = "SELECT reminder_times_per_week FROM users WHERE telegram_id = ?"
-    result = database.get_data(query, (user_id,))
+    result = await async_database.get_data(query, (user_id,))
     return result[0][0] if result else 0  # Return 0 if no frequency is set
 
 
@@ -225,5 +256,5 @@ async def get_all_users_with_reminders():
     """Retrieves all users from the database who have a reminder frequency greater than 0."""
     # query = "SELECT * FROM users WHERE reminder_times_per_week > 0"
     query = "SELECT telegram_id, name, reminder_times_per_week, voice_written FROM users WHERE reminder_times_per_week > 0"
-    result = database.get_data(query)
+    result = await async_database.get_data(query)
     return result
@@ -0,0 +1,151 @@
+"""Group-commit queue for high-frequency, fire-and-forget INSERTs.
+
+Recording every quiz answer or AI image use with its own transaction costs
+one fsync per button press. Instead, writes are handed to a single background
+writer thread which collects them for up to ``WRITE_QUEUE_MAX_DELAY_MS`` (or
+until ``WRITE_QUEUE_MAX_BATCH_ROWS`` rows are waiting) and commits the whole
+batch in one transaction.
+
+Anything that reads rows written through this queue must call ``flush`` (or
+``flush_async``) first; it returns once every write submitted before the call
+has been committed, which gives read-your-writes consistency.
+"""
+
+import asyncio
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from config import WRITE_QUEUE_MAX_BATCH_ROWS, WRITE_QUEUE_MAX_DELAY_MS
+from utils import database
+
+logger = logging.getLogger(__name__)
+
+
+class _FlushMarker:
+    """Queued behind pending writes; signalled once they are committed."""
+
+    def __init__(self, loop=None, future=None):
+        self.event = threading.Event()
+        self.loop = loop
+        self.future = future
+
+    def done(self):
+        self.event.set()
+        if self.future is not None:
+            self.loop.call_soon_threadsafe(_resolve, self.future)
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class GroupCommitWriter:
+    """Single writer thread that batches queued statements into transactions."""
+
+    def __init__(self, max_batch_rows: int, max_delay_ms: int):
+        self.max_batch_rows = max_batch_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Starts the writer thread (idempotent)."""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="db-group-writer", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, query: str, params=()):
+        """Queues a write; it is committed with the next batch."""
+        if self._thread is None:
+            self.start()
+        self._queue.put((query, tuple(params)))
+
+    def flush(self, timeout: float = None) -> bool:
+        """Blocks until every previously submitted write is committed."""
+        if self._thread is None:
+            return True
+        marker = _FlushMarker()
+        self._queue.put(marker)
+        return marker.event.wait(timeout)
+
+    async def flush_async(self):
+        """Awaitable ``flush`` for handlers running on the event loop."""
+        if self._thread is None:
+            return
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put(_FlushMarker(loop, future))
+        await future
+
+    def shutdown(self):
+        """Commits everything still queued and stops the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            batch, markers = [], []
+            deadline = time.monotonic() + self.max_delay
+
+            while True:
+                if item is None:
+                    stopping = True
+                    break
+                if isinstance(item, _FlushMarker):
+                    # Commit right away instead of waiting for the batch window
+                    markers.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.max_batch_rows:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._commit(batch)
+            for marker in markers:
+                marker.done()
+
+    def _commit(self, batch):
+        """Writes a batch in one transaction, grouping identical statements."""
+        grouped = {}
+        for query, params in batch:
+            grouped.setdefault(query, []).append(params)
+
+        try:
+            with database.connection_manager.transaction() as conn:
+                for query, rows in grouped.items():
+                    conn.executemany(query, rows)
+        except Exception as e:
+            logger.error(f"Group commit of {len(batch)} writes failed, retrying one by one: {e}")
+            # Do not lose the whole batch because of a single bad row
+            for query, params in batch:
+                try:
+                    database.execute_query(query, params)
+                except Exception as row_error:
+                    logger.error(f"Dropping queued write {query!r} {params}: {row_error}")
+
+
+# Process-wide writer shared by all handlers
+group_writer = GroupCommitWriter(WRITE_QUEUE_MAX_BATCH_ROWS, WRITE_QUEUE_MAX_DELAY_MS)
+
+# Make sure buffered writes reach the database even on an unexpected exit
+atexit.register(group_writer.shutdown)